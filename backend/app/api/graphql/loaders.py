@@ -0,0 +1,158 @@
+"""
+Per-request DataLoaders for every relationship the schema exposes.
+
+Resolvers never follow ORM relationships. They ask a loader for the related rows and
+the loader batches every key requested in the same tick into one ``IN`` query, so a
+nested query runs one statement per relationship level however many rows it returns.
+
+Loaders share the request's ``AsyncSession``, which can't run two statements at once,
+so their queries take turns on a lock.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Any, Sequence
+
+from sqlalchemy import Select, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from strawberry.dataloader import DataLoader
+
+from ...core.archive import appointment_archive
+from ...core.availability import utc_window
+from ...core.reservations import reservations
+from ...core.timezones import local_times
+from ...models import Appointment, Doctor, Hospital, Patient
+
+# A doctor's slots over local dates start..end (inclusive)
+SlotsKey = tuple[int, date, date]
+
+
+class Loaders:  # pylint: disable=too-many-instance-attributes
+    """The DataLoaders of one request."""
+
+    def __init__(self, db: AsyncSession) -> None:
+        self.db = db
+        self._lock = asyncio.Lock()
+        self.hospital = DataLoader(self._load_hospitals)
+        self.doctor = DataLoader(self._load_doctors)
+        self.patient = DataLoader(self._load_patients)
+        self.hospital_doctors = DataLoader(self._load_hospital_doctors)
+        self.appointment = DataLoader(self._load_appointments)
+        self.doctor_slots = DataLoader(self._load_doctor_slots)
+        self.reserved = DataLoader(self._load_reserved)
+
+    async def _all(self, query: Select) -> Sequence[Any]:
+        async with self._lock:
+            return (await self.db.scalars(query)).all()
+
+    async def _rows(self, query: Select) -> Sequence[Any]:
+        async with self._lock:
+            return (await self.db.execute(query)).all()
+
+    async def _by_id(self, model: Any, ids: list[int]) -> list[Any]:
+        found = {
+            obj.id: obj
+            for obj in await self._all(select(model).where(model.id.in_(ids)))
+        }
+        return [found.get(key) for key in ids]
+
+    async def _load_hospitals(self, ids: list[int]) -> list[Hospital | None]:
+        return await self._by_id(Hospital, ids)
+
+    async def _load_doctors(self, ids: list[int]) -> list[Doctor | None]:
+        return await self._by_id(Doctor, ids)
+
+    async def _load_patients(self, ids: list[int]) -> list[Patient | None]:
+        return await self._by_id(Patient, ids)
+
+    async def _load_appointments(self, ids: list[int]) -> list[Appointment | None]:
+        return await self._by_id(Appointment, ids)
+
+    async def _load_reserved(self, appointment_ids: list[int]) -> list[bool]:
+        reserved = reservations.reserved(appointment_ids)
+        return [appointment_id in reserved for appointment_id in appointment_ids]
+
+    async def _load_hospital_doctors(
+        self, hospital_ids: list[int]
+    ) -> list[list[Doctor]]:
+        doctors = await self._all(
+            select(Doctor)
+            .where(Doctor.hospital_id.in_(hospital_ids))
+            .order_by(Doctor.id)
+        )
+        grouped: dict[int, list[Doctor]] = defaultdict(list)
+        for doctor in doctors:
+            grouped[doctor.hospital_id].append(doctor)
+        return [grouped[hospital_id] for hospital_id in hospital_ids]
+
+    async def _archived_slots(
+        self, doctor_ids: list[int], lower: datetime, upper: datetime
+    ) -> list[tuple[Appointment, Any]]:
+        """Archived slots as detached ``Appointment`` objects, with their timezones."""
+        doctors = await self._rows(
+            select(Doctor.id, Doctor.hospital_id, Hospital.timezone)
+            .join(Hospital, Doctor.hospital_id == Hospital.id)
+            .where(Doctor.id.in_(doctor_ids))
+        )
+        zones = {doctor_id: tz for doctor_id, _, tz in doctors}
+        archived = await appointment_archive.read_async(
+            {hospital_id for _, hospital_id, _ in doctors}, lower, upper, doctor_ids
+        )
+        return [
+            (
+                Appointment(
+                    id=slot.id,
+                    doctor_id=slot.doctor_id,
+                    hospital_id=slot.hospital_id,
+                    patient_id=slot.patient_id,
+                    appointment_time=slot.appointment_time,
+                    created_by=slot.created_by,
+                    created_at=slot.created_at,
+                    updated_at=slot.updated_at,
+                ),
+                zones[slot.doctor_id],
+            )
+            for slot in archived
+        ]
+
+    async def _load_doctor_slots(
+        self, keys: list[SlotsKey]
+    ) -> list[list[tuple[Appointment, datetime]]]:
+        """
+        Each doctor's slots with their local times, one query per distinct date range
+        (normally just one), plus one for the doctors of a range reaching into the
+        archive.
+        """
+        ranges: dict[tuple[date, date], list[int]] = defaultdict(list)
+        for doctor_id, start, end in keys:
+            ranges[start, end].append(doctor_id)
+
+        watermark = appointment_archive.watermark()
+        found: dict[SlotsKey, list[tuple[Appointment, datetime]]] = defaultdict(list)
+        for (start, end), doctor_ids in ranges.items():
+            lower, upper = utc_window(start, end)
+            rows: list[Any] = []
+            if watermark is not None and lower < watermark:
+                rows = await self._archived_slots(
+                    doctor_ids, lower, min(upper, watermark)
+                )
+                lower = watermark
+            rows += await self._rows(
+                select(Appointment, Hospital.timezone)
+                .join(Doctor, Appointment.doctor_id == Doctor.id)
+                .join(Hospital, Doctor.hospital_id == Hospital.id)
+                .where(
+                    Appointment.doctor_id.in_(doctor_ids),
+                    Appointment.appointment_time >= lower,
+                    Appointment.appointment_time < upper,
+                )
+                .order_by(Appointment.doctor_id, Appointment.appointment_time)
+            )
+            locals_ = local_times([(tz, slot.appointment_time) for slot, tz in rows])
+            for (slot, _), local in zip(rows, locals_):
+                if local is not None and start <= local.date() <= end:
+                    found[slot.doctor_id, start, end].append((slot, local))
+        return [found[key] for key in keys]
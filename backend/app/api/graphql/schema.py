@@ -0,0 +1,119 @@
+"""
+The GraphQL endpoint, mounted at ``/graphql`` next to the REST API.
+
+Queries are limited in depth, size and aliases before they run, so one request can't
+fan out into an unbounded amount of work. Lists are limited like their REST
+counterparts, and every field reading slots draws on one budget of doctor-days per
+request.
+"""
+
+from __future__ import annotations
+
+from datetime import date
+
+import strawberry
+from fastapi import Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+from strawberry.extensions import (
+    MaxAliasesLimiter,
+    MaxTokensLimiter,
+    QueryDepthLimiter,
+)
+from strawberry.fastapi import GraphQLRouter
+from strawberry.types import Info
+
+from ...core.config import settings
+from ...core.database import get_async_read_db
+from ...core.security import Principal, optional_user
+from .loaders import Loaders
+from .types import (
+    AppointmentType,
+    Context,
+    DoctorType,
+    HospitalType,
+    IsAuthenticated,
+    PatientType,
+    charge_slots,
+)
+
+
+def check_count(ids: list[int], limit: int, what: str) -> None:
+    if len(set(ids)) > limit:
+        raise ValueError(f"At most {limit} {what} can be requested")
+
+
+@strawberry.type
+class Query:
+    @strawberry.field
+    async def hospital(self, info: Info, id: int) -> HospitalType | None:
+        # pylint: disable=redefined-builtin
+        hospital = await info.context.loaders.hospital.load(id)
+        return HospitalType.from_model(hospital) if hospital else None
+
+    @strawberry.field
+    async def hospitals(self, info: Info, ids: list[int]) -> list[HospitalType]:
+        check_count(ids, settings.graphql_max_ids, "hospitals")
+        hospitals = await info.context.loaders.hospital.load_many(ids)
+        return [HospitalType.from_model(h) for h in hospitals if h is not None]
+
+    @strawberry.field
+    async def doctor(self, info: Info, id: int) -> DoctorType | None:
+        # pylint: disable=redefined-builtin
+        doctor = await info.context.loaders.doctor.load(id)
+        return DoctorType.from_model(doctor) if doctor else None
+
+    @strawberry.field
+    async def doctors(self, info: Info, ids: list[int]) -> list[DoctorType]:
+        check_count(ids, settings.graphql_max_ids, "doctors")
+        doctors = await info.context.loaders.doctor.load_many(ids)
+        return [DoctorType.from_model(d) for d in doctors if d is not None]
+
+    @strawberry.field
+    async def appointment(self, info: Info, id: int) -> AppointmentType | None:
+        # pylint: disable=redefined-builtin
+        appointment = await info.context.loaders.appointment.load(id)
+        return AppointmentType.from_model(appointment) if appointment else None
+
+    @strawberry.field(
+        description="Open and booked slots of several doctors on local dates "
+        "start..end, like the REST calendar."
+    )
+    async def calendar(
+        self, info: Info, doctor_ids: list[int], start: date, end: date
+    ) -> list[AppointmentType]:
+        check_count(doctor_ids, settings.calendar_max_doctors, "doctors")
+        charge_slots(info, len(set(doctor_ids)), start, end)
+        keys = [(doctor_id, start, end) for doctor_id in dict.fromkeys(doctor_ids)]
+        slots = await info.context.loaders.doctor_slots.load_many(keys)
+        return [
+            AppointmentType.from_model(slot, local)
+            for doctor_slots in slots
+            for slot, local in doctor_slots
+        ]
+
+    @strawberry.field(permission_classes=[IsAuthenticated])
+    async def patient(self, info: Info, id: int) -> PatientType | None:
+        # pylint: disable=redefined-builtin
+        patient = await info.context.loaders.patient.load(id)
+        return PatientType.from_model(patient) if patient else None
+
+
+schema = strawberry.Schema(
+    query=Query,
+    extensions=[
+        QueryDepthLimiter(max_depth=settings.graphql_max_depth),
+        MaxTokensLimiter(max_token_count=settings.graphql_max_tokens),
+        MaxAliasesLimiter(max_alias_count=settings.graphql_max_aliases),
+    ],
+)
+
+
+async def get_context(
+    db: AsyncSession = Depends(get_async_read_db),
+    user: Principal | None = Depends(optional_user),
+) -> Context:
+    # None for anonymous callers; fields that need a user will say so
+    return Context(Loaders(db), user)
+
+
+router: GraphQLRouter[Context, None] = GraphQLRouter(schema, context_getter=get_context)
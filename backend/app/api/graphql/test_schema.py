@@ -0,0 +1,196 @@
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select, update
+
+from app.core.archive import appointment_archive, archive_appointments
+from app.core.auth import create_jwt_token
+from app.core.config import settings
+from app.core.reservations import reservations
+from app.models import Appointment, Patient
+
+CALENDAR = """
+query Calendar($doctorIds: [Int!]!, $start: Date!, $end: Date!) {
+  calendar(doctorIds: $doctorIds, start: $start, end: $end) {
+    id
+    localTime
+    bookable
+    patient { name }
+    doctor {
+      name
+      hospital {
+        name
+        doctors { id }
+      }
+    }
+  }
+}
+"""
+
+
+def _calendar(client, doctor_ids, start, days):
+    return client.post(
+        "/graphql",
+        json={
+            "query": CALENDAR,
+            "variables": {
+                "doctorIds": doctor_ids,
+                "start": start.isoformat(),
+                "end": (start + timedelta(days=days - 1)).isoformat(),
+            },
+        },
+    ).json()
+
+
+def _book_every_other_slot(db):
+    patient = Patient(name="Pat")
+    db.add(patient)
+    db.commit()
+    slot_ids = db.scalars(select(Appointment.id).order_by(Appointment.id)).all()
+    db.execute(
+        update(Appointment)
+        .where(Appointment.id.in_(slot_ids[::2]))
+        .values(patient_id=patient.id)
+    )
+    db.commit()
+
+
+def test_nested_calendar_runs_a_fixed_number_of_statements(
+    client, db, make_hospital, make_user, statements
+):
+    start = date(2025, 3, 3)
+    small = make_hospital(doctors=2, slot_start=start, slot_days=1)
+    small_ids = [doctor.id for doctor in small.doctors]
+    large = make_hospital(doctors=10, slot_start=start, slot_days=7)
+    large_ids = [doctor.id for doctor in large.doctors]
+    _book_every_other_slot(db)
+    user = make_user(is_superuser=True)
+    client.cookies.set("access_token", create_jwt_token(user.id, user.email))
+    _calendar(client, small_ids, start, 1)  # Caches the caller
+
+    statements.clear()
+    few = _calendar(client, small_ids, start, 1)
+    few_statements = len(statements)
+    statements.clear()
+    many = _calendar(client, large_ids, start, 7)
+
+    assert "errors" not in many
+    assert len(few["data"]["calendar"]) == 2 * 8
+    assert len(many["data"]["calendar"]) == 10 * 7 * 8
+    slot = many["data"]["calendar"][0]
+    assert slot["patient"] == {"name": "Pat"}
+    assert slot["localTime"] == "2025-03-03T09:00:00"
+    assert len(slot["doctor"]["hospital"]["doctors"]) == 10
+    # Slots, doctors, patients, hospitals and the hospitals' doctors
+    assert few_statements == len(statements) == 5
+
+
+def test_calendar_reads_archived_slots(client, db, make_hospital, make_user):
+    start = date(2025, 1, 30)
+    hospital = make_hospital(doctors=2, slot_start=start, slot_days=4)
+    doctor_ids = [doctor.id for doctor in hospital.doctors]
+    _book_every_other_slot(db)
+    user = make_user(is_superuser=True)
+    client.cookies.set("access_token", create_jwt_token(user.id, user.email))
+    before = _calendar(client, doctor_ids, start, 4)
+
+    # Archives the slots before 2025-02-01 (UTC)
+    run = archive_appointments(
+        db, appointment_archive, 365, 100, now=datetime(2026, 2, 1)
+    )
+    after = _calendar(client, doctor_ids, start, 4)
+
+    assert run.deleted == 2 * 2 * 8
+    assert "errors" not in after
+    assert after == before
+
+
+def test_patients_need_a_logged_in_user(client, db, make_hospital):
+    start = date(2025, 3, 3)
+    hospital = make_hospital(doctors=1, slot_start=start, slot_days=1)
+    doctor_id = hospital.doctors[0].id
+    _book_every_other_slot(db)
+
+    result = _calendar(client, [doctor_id], start, 1)
+
+    assert result["errors"][0]["message"] == "Not authenticated"
+
+
+def test_patient_ids_are_shown_to_the_hospitals_staff_only(  # pylint: disable=too-many-locals
+    client, db, make_hospital, make_user
+):
+    start = date(2025, 3, 3)
+    hospital = make_hospital(doctors=2, slot_start=start, slot_days=1)
+    doctor_id, colleague_id = [doctor.id for doctor in hospital.doctors]
+    other_doctor_id = make_hospital(doctors=1).doctors[0].id
+    _book_every_other_slot(db)
+    query = f"""{{
+      calendar(doctorIds: [{doctor_id}], start: "{start}", end: "{start}") {{
+        patientId
+        bookable
+      }}
+    }}"""
+
+    def patient_ids():
+        result = client.post("/graphql", json={"query": query}).json()
+        return [slot["patientId"] for slot in result["data"]["calendar"]]
+
+    anonymous = patient_ids()
+    outsider = make_user("other@test.com", person_id=other_doctor_id)
+    client.cookies.set("access_token", create_jwt_token(outsider.id, outsider.email))
+    other_hospital = patient_ids()
+    colleague = make_user(person_id=colleague_id)
+    client.cookies.set("access_token", create_jwt_token(colleague.id, colleague.email))
+    staff = patient_ids()
+
+    assert anonymous == other_hospital == [None] * 8
+    assert staff[0] is not None and staff[1] is None
+
+
+def test_queries_are_limited(client, make_hospital):
+    hospital = make_hospital(doctors=1)
+    nested = "doctors { hospital { " * 5 + "name" + " } }" * 5
+    deep = client.post(
+        "/graphql", json={"query": f"{{ hospital(id: {hospital.id}) {{ {nested} }} }}"}
+    ).json()
+    too_long = _calendar(client, [hospital.doctors[0].id], date(2025, 3, 1), 60)
+
+    assert "exceeds maximum operation depth" in deep["errors"][0]["message"]
+    assert too_long["errors"][0]["message"] == "Date range is limited to 31 days"
+
+
+def test_reserved_slots_are_not_bookable(client, db, make_hospital):
+    start = date(2025, 3, 3)
+    hospital = make_hospital(doctors=1, slot_start=start, slot_days=1)
+    doctor_id = hospital.doctors[0].id
+    slot_id = db.scalars(select(Appointment.id).order_by(Appointment.id)).first()
+    reservations.claim(slot_id, "someone")
+    query = f"""{{
+      calendar(doctorIds: [{doctor_id}], start: "{start}", end: "{start}") {{
+        id
+        bookable
+        reserved
+      }}
+    }}"""
+
+    slots = client.post("/graphql", json={"query": query}).json()["data"]["calendar"]
+
+    assert slots[0] == {"id": slot_id, "bookable": False, "reserved": True}
+    assert all(slot["bookable"] and not slot["reserved"] for slot in slots[1:])
+
+
+def test_nested_slots_share_one_budget(client, make_hospital, monkeypatch):
+    monkeypatch.setattr(settings, "graphql_max_doctor_days", 10)
+    hospital = make_hospital(doctors=3)
+    query = f"""{{
+      hospital(id: {hospital.id}) {{
+        doctors {{ slots(start: "2025-03-03", end: "2025-03-0%d") {{ id }} }}
+      }}
+    }}"""
+
+    within = client.post("/graphql", json={"query": query % 5}).json()
+    over = client.post("/graphql", json={"query": query % 6}).json()
+
+    assert "errors" not in within
+    assert over["errors"][0]["message"] == (
+        "At most 10 doctor-days of slots can be requested"
+    )
@@ -0,0 +1,192 @@
+"""
+GraphQL object types.
+
+Types are built from ORM rows but only copy their columns; every relationship is
+resolved through the request's loaders (see ``loaders.py``).
+"""
+
+from __future__ import annotations
+
+from datetime import date, datetime, time
+from typing import Any
+
+import strawberry
+from strawberry.fastapi import BaseContext
+from strawberry.permission import BasePermission
+from strawberry.types import Info
+
+from ...core.availability import date_range_error
+from ...core.config import settings
+from ...core.security import Principal
+from ...models import Appointment, Doctor, Hospital, Patient
+from .loaders import Loaders
+
+
+class Context(BaseContext):
+    """Per-request state shared by resolvers."""
+
+    def __init__(self, loaders: Loaders, user: Principal | None) -> None:
+        super().__init__()
+        self.loaders = loaders
+        # None when the caller isn't logged in
+        self.user = user
+        # Doctor-days of slots the request has asked for so far
+        self.doctor_days = 0
+
+
+class IsAuthenticated(BasePermission):
+    message = "Not authenticated"
+
+    def has_permission(self, source: Any, info: Info, **kwargs: Any) -> bool:
+        return info.context.user is not None
+
+
+def check_date_range(start: date, end: date) -> None:
+    """Apply the same limits as the REST calendar."""
+    error = date_range_error(start, end, settings.calendar_max_days)
+    if error:
+        raise ValueError(error)
+
+
+def charge_slots(info: Info, doctors: int, start: date, end: date) -> None:
+    """
+    Count slots read for ``doctors`` over start..end against the request's budget,
+    since nested fields can ask for many doctors' slots at once.
+    """
+    check_date_range(start, end)
+    context = info.context
+    context.doctor_days += doctors * ((end - start).days + 1)
+    if context.doctor_days > settings.graphql_max_doctor_days:
+        raise ValueError(
+            f"At most {settings.graphql_max_doctor_days} doctor-days of slots "
+            "can be requested"
+        )
+
+
+@strawberry.type(name="Patient")
+class PatientType:
+    id: int
+    name: str
+
+    @classmethod
+    def from_model(cls, patient: Patient) -> PatientType:
+        return cls(id=patient.id, name=patient.name)
+
+
+@strawberry.type(name="Appointment")
+class AppointmentType:
+    id: int
+    doctor_id: int
+    # Who booked the slot, only shown to the hospital's doctors and staff
+    booked_by: strawberry.Private[int | None]
+    hospital_id: strawberry.Private[int]
+    # Naive UTC, like the database
+    appointment_time: datetime
+    # The same instant at the hospital, when the appointment was loaded for a calendar
+    local_time: datetime | None = None
+
+    def _patient_id(self, info: Info) -> int | None:
+        user = info.context.user
+        if user is None or not user.sees_patients(self.hospital_id):
+            return None
+        return self.booked_by
+
+    @strawberry.field
+    def patient_id(self, info: Info) -> int | None:
+        return self._patient_id(info)
+
+    async def _reserved(self, info: Info) -> bool:
+        # Overlaid on every read like the REST calendar, since reservations aren't cached
+        if self.booked_by is not None:
+            return False
+        reserved: bool = await info.context.loaders.reserved.load(self.id)
+        return reserved
+
+    @strawberry.field
+    async def reserved(self, info: Info) -> bool:
+        return await self._reserved(info)
+
+    @strawberry.field
+    async def bookable(self, info: Info) -> bool:
+        return self.booked_by is None and not await self._reserved(info)
+
+    @strawberry.field
+    async def doctor(self, info: Info) -> DoctorType:
+        return DoctorType.from_model(
+            await info.context.loaders.doctor.load(self.doctor_id)
+        )
+
+    @strawberry.field(permission_classes=[IsAuthenticated])
+    async def patient(self, info: Info) -> PatientType | None:
+        patient_id = self._patient_id(info)
+        if patient_id is None:
+            return None
+        patient = await info.context.loaders.patient.load(patient_id)
+        return PatientType.from_model(patient) if patient else None
+
+    @classmethod
+    def from_model(
+        cls, appointment: Appointment, local_time: datetime | None = None
+    ) -> AppointmentType:
+        return cls(
+            id=appointment.id,
+            doctor_id=appointment.doctor_id,
+            booked_by=appointment.patient_id,
+            hospital_id=appointment.hospital_id,
+            appointment_time=appointment.appointment_time,
+            local_time=local_time,
+        )
+
+
+@strawberry.type(name="Doctor")
+class DoctorType:
+    id: int
+    name: str
+    specialty: str | None
+    hospital_id: int
+
+    @strawberry.field
+    async def hospital(self, info: Info) -> HospitalType:
+        hospital = await info.context.loaders.hospital.load(self.hospital_id)
+        return HospitalType.from_model(hospital)
+
+    @strawberry.field(description="Open and booked slots on local dates start..end.")
+    async def slots(self, info: Info, start: date, end: date) -> list[AppointmentType]:
+        charge_slots(info, 1, start, end)
+        slots = await info.context.loaders.doctor_slots.load((self.id, start, end))
+        return [AppointmentType.from_model(slot, local) for slot, local in slots]
+
+    @classmethod
+    def from_model(cls, doctor: Doctor) -> DoctorType:
+        return cls(
+            id=doctor.id,
+            name=doctor.name,
+            specialty=doctor.specialty,
+            hospital_id=doctor.hospital_id,
+        )
+
+
+@strawberry.type(name="Hospital")
+class HospitalType:
+    id: int
+    name: str
+    address: str
+    timezone: str
+    open_time: time
+    close_time: time
+
+    @strawberry.field
+    async def doctors(self, info: Info) -> list[DoctorType]:
+        doctors = await info.context.loaders.hospital_doctors.load(self.id)
+        return [DoctorType.from_model(doctor) for doctor in doctors]
+
+    @classmethod
+    def from_model(cls, hospital: Hospital) -> HospitalType:
+        return cls(
+            id=hospital.id,
+            name=hospital.name,
+            address=hospital.address,
+            timezone=str(hospital.timezone),
+            open_time=hospital.open_time,
+            close_time=hospital.close_time,
+        )
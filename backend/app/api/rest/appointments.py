@@ -0,0 +1,335 @@
+from __future__ import annotations
+
+import hashlib
+from collections.abc import Collection
+from datetime import date
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import Row, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from ...core.availability import CalendarDay, date_range_error, pack_day
+from ...core.cache import availability_cache
+from ...core.calendar_versions import calendar_versions, etag_matches
+from ...core.config import settings
+from ...core.database import (
+    ShardMap,
+    fan_out,
+    get_async_db,
+    get_async_read_db,
+    get_async_shards,
+)
+from ...core.metrics import slot_conflicts
+from ...core.reservations import TooManyReservations, reservations
+from ...core.security import Principal, current_user, optional_user
+from ...core.slot_events import SlotChange, publish_slot_changes
+from ...models import Appointment, Doctor, Patient
+from ..schemas.appointments import (
+    AppointmentInfo,
+    BookingInfo,
+    CalendarInfo,
+    PatientAppointmentInfo,
+    ReservationInfo,
+)
+
+router = APIRouter(prefix="/api/appointments", tags=["appointments"])
+
+COMPACT_MEDIA_TYPE = "application/vnd.scheduler.calendar-compact+json"
+
+
+def calendar_body(
+    days: list[CalendarDay],
+    start: date,
+    end: date,
+    patients: Collection[int] | None = None,
+) -> dict:
+    """
+    The calendar in the object per slot form of ``CalendarInfo``, with patient ids
+    only for the doctors in ``patients`` (every doctor when ``None``).
+    """
+    return {
+        "start": start,
+        "end": end,
+        "days": [
+            {
+                "doctor_id": day.doctor_id,
+                "date": day.date,
+                "available_slots": [
+                    {
+                        "appointment_id": slot.appointment_id,
+                        "time": slot.time,
+                        "bookable": slot.bookable,
+                        "patient_id": (
+                            slot.patient_id
+                            if patients is None or day.doctor_id in patients
+                            else None
+                        ),
+                        "reserved": slot.reserved,
+                    }
+                    for slot in day.slots
+                ],
+            }
+            for day in days
+        ],
+    }
+
+
+async def _patients_shown(
+    db: AsyncSession, user: Principal | None, doctor_ids: list[int]
+) -> set[int]:
+    """
+    The doctors whose calendars may show who booked them: every doctor for
+    superusers, those of the user's hospitals for doctors and staff, none otherwise.
+    """
+    if user is None or not (user.is_superuser or user.hospital_ids):
+        return set()
+    if user.is_superuser:
+        return set(doctor_ids)
+    result = await db.scalars(
+        select(Doctor.id).where(
+            Doctor.id.in_(doctor_ids), Doctor.hospital_id.in_(user.hospital_ids)
+        )
+    )
+    return set(result)
+
+
+def _patients_variant(doctor_ids: list[int], shown: set[int]) -> str:
+    """The ETag suffix telling apart calendars that show different patients."""
+    if not shown:
+        return "-anonymous"
+    if shown.issuperset(doctor_ids):
+        return ""
+    digest = hashlib.blake2b(digest_size=4)
+    digest.update(",".join(map(str, sorted(shown))).encode())
+    return "-patients-" + digest.hexdigest()
+
+
+@router.get("", response_model=CalendarInfo)
+async def read_calendar(  # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    response: Response,
+    doctor: list[int] = Query(...),
+    start: date = Query(...),
+    end: date = Query(...),
+    shape: str | None = Query(None, alias="format", pattern="^(slots|compact)$"),
+    accept: str | None = Header(None),
+    if_none_match: str | None = Header(None),
+    db: AsyncSession = Depends(get_async_read_db),
+    user: Principal | None = Depends(optional_user),
+) -> dict | Response:
+    """
+    Retrieve open and booked slots for several doctors over a date range. Answers
+    304 when the calendar still matches ``If-None-Match``. Who booked a slot is only
+    shown to superusers and the doctors and staff of the doctor's hospital.
+
+    With ``format=compact``, or when ``Accept`` asks for ``COMPACT_MEDIA_TYPE``, each
+    day is sent in the columnar form of ``pack_day`` instead of one object per slot.
+    """
+    error = date_range_error(start, end, settings.calendar_max_days)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+    if len(set(doctor)) > settings.calendar_max_doctors:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.calendar_max_doctors} doctors can be requested",
+        )
+    compact = shape == "compact" or (
+        shape is None and accept is not None and COMPACT_MEDIA_TYPE in accept
+    )
+    patients = await _patients_shown(db, user, doctor)
+    headers = {"Vary": "Accept, Cookie"}
+    # Read before the calendar, so a change made meanwhile shows up in the next tag
+    etag = calendar_versions.etag(doctor, start, end)
+    if etag is not None:
+        # Each form is a different representation, so it needs a tag of its own
+        variant = ("-compact" if compact else "") + _patients_variant(doctor, patients)
+        headers["ETag"] = etag[:-1] + variant + '"' if variant else etag
+        if etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+
+    days = await availability_cache.get_calendar_async(db, doctor, start, end)
+    if len({day.doctor_id for day in days}) != len(set(doctor)):
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    # Reservations change too often to cache, so they're overlaid on every read
+    days = reservations.mark_reserved(days)
+    if compact:
+        return ORJSONResponse(
+            {
+                "start": start,
+                "end": end,
+                "days": [pack_day(day, day.doctor_id in patients) for day in days],
+            },
+            media_type=COMPACT_MEDIA_TYPE,
+            headers=headers,
+        )
+    response.headers.update(headers)
+    return calendar_body(days, start, end, patients)
+
+
+@router.get("/patients/{patient_id}", response_model=list[PatientAppointmentInfo])
+async def read_patient_appointments(
+    patient_id: int,
+    shards: ShardMap[async_sessionmaker[AsyncSession]] = Depends(get_async_shards),
+    user: Principal = Depends(current_user),
+) -> list[dict]:
+    """
+    A patient's appointments at every hospital, by time, read from every database
+    at once. Archived appointments aren't included.
+    """
+    if not user.is_superuser and user.person_id != patient_id:
+        raise HTTPException(status_code=403, detail="Not allowed for this patient")
+
+    async def query(db: AsyncSession, _hospital_ids: list[int] | None) -> list[Row]:
+        result = await db.execute(
+            select(
+                Appointment.id,
+                Appointment.hospital_id,
+                Appointment.doctor_id,
+                Appointment.appointment_time,
+                Appointment.patient_id,
+            ).where(Appointment.patient_id == patient_id)
+        )
+        return list(result.all())
+
+    rows = await fan_out(shards, query, key=lambda row: (row.appointment_time, row.id))
+    return [row._asdict() for row in rows]
+
+
+async def _find_slot(db: AsyncSession, appointment_id: int) -> Row | None:
+    result = await db.execute(
+        select(
+            Appointment.hospital_id,
+            Appointment.doctor_id,
+            Appointment.appointment_time,
+            Appointment.patient_id,
+        ).where(Appointment.id == appointment_id)
+    )
+    return result.first()
+
+
+def _may_book(user: Principal, hospital_id: int, patient_id: int | None = None) -> bool:
+    """
+    Whether a user may take a hospital's slots: superusers and the hospital's doctors
+    and staff for anyone, and patients (users working at no hospital) only for
+    themselves. Until a slot is booked it isn't known for whom.
+    """
+    if user.is_superuser or hospital_id in user.hospital_ids:
+        return True
+    return (
+        not user.hospital_ids
+        and user.person_id is not None
+        and patient_id in (None, user.person_id)
+    )
+
+
+@router.post("/{appointment_id}/reservation", response_model=ReservationInfo)
+async def reserve_slot(
+    appointment_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    user: Principal = Depends(current_user),
+) -> dict:
+    """Hold an open slot while the caller books it. Reserving it again extends it."""
+    # Claim first, so contended slots are turned away without touching the database
+    try:
+        claimed = reservations.claim(appointment_id, user.id)
+    except TooManyReservations:
+        raise HTTPException(status_code=409, detail="Too many slots reserved") from None
+    if not claimed:
+        slot_conflicts.inc("reservation")
+        raise HTTPException(status_code=409, detail="Slot is reserved")
+    slot = await _find_slot(db, appointment_id)
+    if slot is None or slot.patient_id is not None:
+        reservations.release(appointment_id, user.id)
+        if slot is None:
+            raise HTTPException(status_code=404, detail="Slot not found")
+        slot_conflicts.inc("already_booked")
+        raise HTTPException(status_code=409, detail="Slot is already booked")
+    if not _may_book(user, slot.hospital_id):
+        reservations.release(appointment_id, user.id)
+        raise HTTPException(status_code=403, detail="Not allowed at this hospital")
+    calendar_versions.reserved(
+        appointment_id, slot.doctor_id, slot.appointment_time, reservations.ttl
+    )
+    return {"appointment_id": appointment_id, "expires_in": reservations.ttl}
+
+
+@router.put("/{appointment_id}/reservation", response_model=ReservationInfo)
+async def extend_reservation(
+    appointment_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    user: Principal = Depends(current_user),
+) -> dict:
+    if not reservations.extend(appointment_id, user.id):
+        raise HTTPException(status_code=409, detail="Reservation is not held")
+    slot = await _find_slot(db, appointment_id)
+    if slot is not None:
+        calendar_versions.reserved(
+            appointment_id, slot.doctor_id, slot.appointment_time, reservations.ttl
+        )
+    return {"appointment_id": appointment_id, "expires_in": reservations.ttl}
+
+
+@router.delete("/{appointment_id}/reservation")
+async def release_reservation(
+    appointment_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    user: Principal = Depends(current_user),
+) -> dict[str, str]:
+    if not reservations.release(appointment_id, user.id):
+        raise HTTPException(status_code=409, detail="Reservation is not held")
+    slot = await _find_slot(db, appointment_id)
+    if slot is not None:
+        calendar_versions.released(
+            appointment_id, slot.doctor_id, slot.appointment_time
+        )
+    return {"message": "Reservation released"}
+
+
+@router.post("/{appointment_id}/booking", response_model=AppointmentInfo)
+async def book_slot(
+    appointment_id: int,
+    info: BookingInfo,
+    db: AsyncSession = Depends(get_async_db),
+    user: Principal = Depends(current_user),
+) -> dict:
+    """Book a slot the caller has reserved for a patient."""
+    if reservations.holder(appointment_id) != user.id:
+        raise HTTPException(status_code=409, detail="Reserve the slot first")
+    patient = await db.scalar(select(Patient.id).where(Patient.id == info.patient_id))
+    if patient is None:
+        raise HTTPException(status_code=404, detail="Patient not found")
+
+    # Only an open slot is updated, so a stale reservation can't overwrite a booking
+    result = await db.execute(
+        update(Appointment)
+        .where(Appointment.id == appointment_id, Appointment.patient_id.is_(None))
+        .values(patient_id=info.patient_id)
+        .returning(
+            Appointment.hospital_id, Appointment.doctor_id, Appointment.appointment_time
+        )
+    )
+    booked = result.first()
+    if booked is None:
+        await db.rollback()
+        slot_conflicts.inc("booking")
+        raise HTTPException(status_code=409, detail="Slot is already booked")
+    # Checked on the row the update returns rather than read beforehand
+    if not _may_book(user, booked.hospital_id, info.patient_id):
+        await db.rollback()
+        raise HTTPException(status_code=403, detail="Not allowed for this patient")
+    await db.commit()
+    # A Core UPDATE isn't seen by the session's change tracking
+    publish_slot_changes(
+        [SlotChange.for_row(booked.doctor_id, booked.appointment_time, info.patient_id)]
+    )
+    reservations.release(appointment_id, user.id)
+    calendar_versions.released(
+        appointment_id, booked.doctor_id, booked.appointment_time
+    )
+
+    return {
+        "id": appointment_id,
+        "doctor_id": booked.doctor_id,
+        "appointment_time": booked.appointment_time,
+        "patient_id": info.patient_id,
+    }
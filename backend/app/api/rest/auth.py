@@ -1,33 +1,43 @@
 from __future__ import annotations
 
 from fastapi import APIRouter, Cookie, Depends, HTTPException, Response
-from sqlalchemy.orm import Session
-
-from ...core.auth import (
-    authenticate_user,
-    create_jwt_token,
-    create_refresh_token,
-    verify_jwt_token,
-    verify_refresh_token,
-)
-from ...core.database import get_db
-from ...models.users import User
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ...core.auth import authenticate_user, create_jwt_token, verify_jwt_token
+from ...core.database import get_async_db
+from ...core.refresh_tokens import refresh_tokens
+from ...core.security import Principal, current_user, principal_cache
+from ...models import User
 from ..schemas.auth import LoginInfo
 
 router = APIRouter(prefix="/api/auth", tags=["authentication"])
 
 
+def set_refresh_cookie(response: Response, refresh_token: str) -> None:
+    response.set_cookie(
+        key="refresh_token",
+        value=refresh_token,
+        httponly=True,
+        secure=False,  # Set to True in production with HTTPS
+        samesite="lax",
+        path="/",
+        max_age=30 * 24 * 60 * 60,  # 30 days
+    )
+
+
 @router.post("/login")
-def login(
-    info: LoginInfo, response: Response, db: Session = Depends(get_db)
+async def login(
+    info: LoginInfo, response: Response, db: AsyncSession = Depends(get_async_db)
 ) -> dict[str, str]:
-    if user := authenticate_user(db, info.email, info.password):
+    if user := await authenticate_user(db, info.email, info.password):
         access_token = create_jwt_token(user.id, user.email)
-        refresh_token = create_refresh_token(user.id, user.email)
-
-        # Store refresh token in database
-        user.refresh_token_hash = refresh_token
-        db.commit()
+        # Starts a new token family in the refresh token store. Its calls to Redis
+        # block, so they run in the threadpool rather than on the event loop.
+        refresh_token = await run_in_threadpool(
+            refresh_tokens.issue, user.id, user.email
+        )
 
         # Set httpOnly cookies
         response.set_cookie(
@@ -39,15 +49,7 @@ def login(
             path="/",
             max_age=15 * 60 * 60,  # 15 minutes
         )
-        response.set_cookie(
-            key="refresh_token",
-            value=refresh_token,
-            httponly=True,
-            secure=False,  # Set to True in production with HTTPS
-            samesite="lax",
-            path="/",
-            max_age=30 * 24 * 60 * 60,  # 30 days
-        )
+        set_refresh_cookie(response, refresh_token)
 
         return {"message": "Login successful"}
 
@@ -55,43 +57,34 @@ def login(
 
 
 @router.get("/me")
-def read_current_user(
-    db: Session = Depends(get_db), access_token: str | None = Cookie(None)
-) -> dict[str, str]:
-    if not access_token:
-        raise HTTPException(status_code=401, detail="No access token provided")
-
-    # Verify and decode the JWT token
-    payload = verify_jwt_token(access_token)
-    if not payload:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
-
-    # Get user from database using the user_id from token
-    user_id = payload.get("sub")
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
+async def read_current_user(user: Principal = Depends(current_user)) -> dict[str, str]:
     return {"id": str(user.id), "email": user.email, "is_active": str(user.is_active)}
 
 
 @router.get("/refresh")
-def refresh_jwt_token(
+async def refresh_jwt_token(
     response: Response,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     refresh_token: str | None = Cookie(None),
 ) -> dict[str, str]:
     if not refresh_token:
         raise HTTPException(status_code=401, detail="No refresh token provided")
 
-    # Verify and decode the refresh token
-    payload = verify_refresh_token(db, refresh_token)
+    # Verify the refresh token and rotate it, so each one can only be used once
+    rotated = await run_in_threadpool(refresh_tokens.rotate, refresh_token)
 
-    if not payload:
+    if not rotated:
         raise HTTPException(status_code=401, detail="Invalid or expired refresh token")
+    payload, new_refresh_token = rotated
 
-    # Generate a new access token
+    # Check the user still exists and is active, in case a revocation was missed
     user_id = payload["sub"]
+    is_active = await db.scalar(select(User.is_active).where(User.id == user_id))
+    if not is_active:
+        await run_in_threadpool(refresh_tokens.revoke_family, payload["fam"], user_id)
+        raise HTTPException(status_code=401, detail="Invalid or expired refresh token")
+
+    # Generate a new access token
     email = payload["email"]
     new_access_token = create_jwt_token(user_id, email)
 
@@ -103,13 +96,22 @@ def refresh_jwt_token(
         secure=False,  # Set to True in production with HTTPS
         samesite="lax",
     )
+    set_refresh_cookie(response, new_refresh_token)
 
     return {"message": "Token refreshed successfully"}
 
 
 @router.post("/logout")
-def logout(response: Response) -> dict[str, str]:
-    """Log out the user by clearing authentication cookies."""
+async def logout(
+    response: Response,
+    access_token: str | None = Cookie(None),
+    refresh_token: str | None = Cookie(None),
+) -> dict[str, str]:
+    """Log out the user by revoking the refresh token and clearing the cookies."""
+    if refresh_token:
+        await run_in_threadpool(refresh_tokens.revoke, refresh_token)
+    if access_token and (payload := verify_jwt_token(access_token)):
+        principal_cache.invalidate([payload["sub"]])
     response.delete_cookie("access_token")
     response.delete_cookie("refresh_token")
     return {"message": "Logged out successfully"}
@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+from datetime import UTC, date, datetime, time
+from typing import Iterator
+from zoneinfo import ZoneInfo
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Connection, Engine, select
+from sqlalchemy.orm import Session
+
+from ...core.availability import (
+    date_range_error,
+    get_calendar,
+    to_local,
+    to_utc,
+)
+from ...core.calendar_versions import calendar_versions, etag_matches
+from ...core.config import settings
+from ...core.database import get_hospital_db, get_hospital_read_db
+from ...core.exports import (
+    CSV_MEDIA_TYPE,
+    NDJSON_MEDIA_TYPE,
+    csv_chunks,
+    export_batches,
+    ndjson_chunks,
+)
+from ...core.revalidation import hospital_conflicts
+from ...core.security import Principal, current_user
+from ...core.slot_index import OutsideIndexWindow, slot_index
+from ...core.slot_search import earliest_slots
+from ...core.slots import open_slots
+from ...models import Doctor, Hospital
+from ..schemas.hospitals import (
+    ConflictInfo,
+    EarliestSlotsInfo,
+    FreeSlotsInfo,
+    OpenedSlotsInfo,
+    OpenSlotsInfo,
+)
+
+router = APIRouter(prefix="/api/hospitals", tags=["hospitals"])
+
+
+def _free_slots_from_calendar(
+    db: Session, hospital_id: int, start: date, end: date
+) -> dict | None:
+    """Fallback for ranges the slot index doesn't cover."""
+    doctor_ids = db.scalars(
+        select(Doctor.id).where(Doctor.hospital_id == hospital_id)
+    ).all()
+    if not doctor_ids:
+        return None
+    slots: dict = {}
+    for day in get_calendar(db, doctor_ids, start, end):
+        times = [slot.time for slot in day.slots if slot.bookable]
+        if times:
+            slots.setdefault(day.doctor_id, {})[day.date] = times
+    return slots
+
+
+@router.get("/{hospital_id}/free-slots", response_model=FreeSlotsInfo)
+def read_free_slots(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    hospital_id: int,
+    response: Response,
+    start: date = Query(...),
+    end: date = Query(...),
+    if_none_match: str | None = Header(None),
+    db: Session = Depends(get_hospital_read_db),
+) -> dict | Response:
+    """
+    Retrieve every open slot across a hospital's doctors over a date range. Answers
+    304 when the slots still match ``If-None-Match``.
+    """
+    error = date_range_error(start, end, settings.calendar_max_days)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+
+    doctor_ids = db.scalars(
+        select(Doctor.id).where(Doctor.hospital_id == hospital_id)
+    ).all()
+    etag = calendar_versions.etag(doctor_ids, start, end, reservations=False)
+    if etag is not None and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    try:
+        slots = slot_index.free_slots(db, hospital_id, start, end)
+    except OutsideIndexWindow:
+        slots = _free_slots_from_calendar(db, hospital_id, start, end)
+    if slots is None:
+        raise HTTPException(status_code=404, detail="Hospital not found")
+    if etag is not None:
+        response.headers["ETag"] = etag
+
+    return {
+        "hospital_id": hospital_id,
+        "start": start,
+        "end": end,
+        "days": [
+            {"doctor_id": doctor_id, "date": day, "times": times}
+            for doctor_id, days in slots.items()
+            for day, times in days.items()
+        ],
+    }
+
+
+@router.get("/{hospital_id}/earliest-slots", response_model=EarliestSlotsInfo)
+def read_earliest_slots(
+    hospital_id: int,
+    specialty: str | None = Query(None),
+    start: date | None = Query(None),
+    limit: int = Query(10, ge=1, le=settings.earliest_slots_max),
+    db: Session = Depends(get_hospital_read_db),
+) -> dict:
+    """
+    Retrieve the first open slots with any doctor at a hospital, optionally with a
+    given specialty, from ``start`` (a local date, today by default) on.
+    """
+    hospital = db.get(Hospital, hospital_id)
+    if hospital is None:
+        raise HTTPException(status_code=404, detail="Hospital not found")
+
+    after = datetime.now(UTC).replace(tzinfo=None)
+    if start is not None:
+        after = max(after, to_utc(datetime.combine(start, time()), hospital.timezone))
+    slots = earliest_slots(db, hospital_id, specialty, after, limit)
+    return {
+        "hospital_id": hospital_id,
+        "specialty": specialty,
+        "slots": [
+            {
+                "appointment_id": slot.appointment_id,
+                "doctor_id": slot.doctor_id,
+                "time": to_local(slot.appointment_time, hospital.timezone),
+            }
+            for slot in slots
+        ],
+    }
+
+
+@router.post("/{hospital_id}/slots", response_model=OpenedSlotsInfo)
+def create_slots(
+    hospital_id: int,
+    info: OpenSlotsInfo,
+    db: Session = Depends(get_hospital_db),
+    user: Principal = Depends(current_user),
+) -> dict:
+    """Open every opening hour of a hospital's doctors over a date range."""
+    if not user.is_superuser and hospital_id not in user.hospital_ids:
+        raise HTTPException(status_code=403, detail="Not allowed at this hospital")
+    error = date_range_error(info.start, info.end, settings.open_slots_max_days)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+
+    doctor_ids = set(
+        db.scalars(select(Doctor.id).where(Doctor.hospital_id == hospital_id)).all()
+    )
+    if not doctor_ids:
+        raise HTTPException(status_code=404, detail="Hospital not found")
+    if info.doctor_ids is not None:
+        if not set(info.doctor_ids) <= doctor_ids:
+            raise HTTPException(status_code=404, detail="Doctor not found")
+        doctor_ids = set(info.doctor_ids)
+
+    opened = open_slots(db, doctor_ids, info.start, info.end, user.person_id)
+    return {"inserted": opened.inserted, "skipped": opened.skipped}
+
+
+@router.get("/{hospital_id}/conflicts", response_model=list[ConflictInfo])
+def read_conflicts(
+    hospital_id: int,
+    limit: int = Query(100, ge=1, le=settings.conflicts_max_results),
+    db: Session = Depends(get_hospital_read_db),
+    user: Principal = Depends(current_user),
+) -> list[dict]:
+    """
+    Upcoming booked appointments that no longer fit their doctor's availability and
+    need rescheduling, soonest first.
+    """
+    if not user.is_superuser and hospital_id not in user.hospital_ids:
+        raise HTTPException(status_code=403, detail="Not allowed at this hospital")
+    hospital = db.get(Hospital, hospital_id)
+    if hospital is None:
+        raise HTTPException(status_code=404, detail="Hospital not found")
+
+    now = datetime.now(UTC).replace(tzinfo=None)
+    return [
+        {
+            "appointment_id": conflict.appointment_id,
+            "doctor_id": conflict.doctor_id,
+            "patient_id": conflict.patient_id,
+            "time": to_local(conflict.appointment_time, hospital.timezone),
+            "reason": conflict.reason,
+            "detected_at": conflict.detected_at,
+        }
+        for conflict in hospital_conflicts(db, hospital_id, now, limit)
+    ]
+
+
+def _export_chunks(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    bind: Engine | Connection,
+    hospital_id: int,
+    tz: ZoneInfo,
+    start: date,
+    end: date,
+    csv: bool,
+) -> Iterator[bytes]:
+    # The request's session is closed before the body is sent, so the export reads
+    # through its own, on the same database
+    with Session(bind) as db:
+        batches = export_batches(
+            db, hospital_id, tz, start, end, settings.export_batch_size
+        )
+        yield from csv_chunks(batches) if csv else ndjson_chunks(batches)
+
+
+@router.get("/{hospital_id}/appointments/export")
+def export_appointments(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    hospital_id: int,
+    start: date = Query(...),
+    end: date = Query(...),
+    shape: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    db: Session = Depends(get_hospital_read_db),
+    user: Principal = Depends(current_user),
+) -> StreamingResponse:
+    """
+    Stream every appointment of a hospital over a date range, open or booked, as
+    NDJSON or CSV. The range isn't limited; rows are read and sent in batches.
+    """
+    if not user.is_superuser and hospital_id not in user.hospital_ids:
+        raise HTTPException(status_code=403, detail="Not allowed at this hospital")
+    if end < start:
+        raise HTTPException(status_code=400, detail="End date is before start date")
+    hospital = db.get(Hospital, hospital_id)
+    if hospital is None:
+        raise HTTPException(status_code=404, detail="Hospital not found")
+
+    csv = shape == "csv"
+    filename = f"appointments-{hospital_id}-{start}-{end}.{shape}"
+    return StreamingResponse(
+        _export_chunks(db.get_bind(), hospital_id, hospital.timezone, start, end, csv),
+        media_type=CSV_MEDIA_TYPE if csv else NDJSON_MEDIA_TYPE,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+
+from ...core.config import settings
+from ...core.database import get_read_db
+from ...core.patient_index import patient_index, search_patients
+from ...core.security import Principal, current_user
+from ..schemas.patients import PatientInfo
+
+router = APIRouter(prefix="/api/patients", tags=["patients"])
+
+
+@router.get("", response_model=list[PatientInfo])
+def find_patients(
+    q: str = Query(..., min_length=2),
+    limit: int = Query(10, ge=1, le=settings.patient_search_max_results),
+    db: Session = Depends(get_read_db),
+    user: Principal = Depends(current_user),
+) -> list[dict]:
+    """
+    Find patients by the start of any word of their name or email, or of their phone
+    number, as staff type while booking. Matches are sorted by name.
+    """
+    if not user.is_superuser and not user.hospital_ids:
+        raise HTTPException(status_code=403, detail="Only staff can find patients")
+    return [row._asdict() for row in search_patients(db, patient_index, q, limit)]
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import AsyncIterator
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    WebSocket,
+    WebSocketDisconnect,
+)
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from ...core.config import settings
+from ...core.database import ShardMap, get_async_shards
+from ...core.security import Principal, current_streaming_user
+from ...core.slot_feed import Overflowed, SlotDelta, Subscription, slot_feed
+from ...models import Doctor, Hospital
+
+router = APIRouter(prefix="/api/hospitals", tags=["hospitals"])
+
+
+async def watched_doctors(
+    hospital_id: int,
+    doctor: list[int] | None = Query(None),
+    shards: ShardMap[async_sessionmaker[AsyncSession]] = Depends(get_async_shards),
+    user: Principal = Depends(current_streaming_user),
+) -> list[int]:
+    """
+    The hospital's doctors to follow, all of them unless some are given. They are
+    looked up in a session of their own, closed before the stream starts, so open
+    streams don't each hold a pooled connection.
+    """
+    if not user.is_superuser and hospital_id not in user.hospital_ids:
+        raise HTTPException(status_code=403, detail="Not allowed at this hospital")
+    async with shards.for_hospital(hospital_id)() as db:
+        if await db.get(Hospital, hospital_id) is None:
+            raise HTTPException(status_code=404, detail="Hospital not found")
+        doctor_ids = set(
+            (
+                await db.scalars(
+                    select(Doctor.id).where(Doctor.hospital_id == hospital_id)
+                )
+            ).all()
+        )
+    if doctor is None:
+        return sorted(doctor_ids)
+    if not doctor_ids.issuperset(doctor):
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    return sorted(set(doctor))
+
+
+def _changes(batch: list[SlotDelta]) -> list[dict]:
+    return [delta.to_dict() for delta in batch]
+
+
+async def server_sent_events(
+    request: Request, doctor_ids: list[int]
+) -> AsyncIterator[str]:
+    """Slot changes as ``slots`` events, or ``resync`` when some were dropped."""
+    subscription = slot_feed.subscribe(doctor_ids)
+    try:
+        # Tells the client the subscription is in place
+        yield ": subscribed\n\n"
+        while not await request.is_disconnected():
+            try:
+                batch = await subscription.next_batch(
+                    settings.slot_feed_keepalive_seconds
+                )
+            except Overflowed:
+                yield "event: resync\ndata: {}\n\n"
+                continue
+            if batch:
+                data = json.dumps({"changes": _changes(batch)})
+                yield f"event: slots\ndata: {data}\n\n"
+            else:
+                yield ": keepalive\n\n"
+    finally:
+        slot_feed.unsubscribe(subscription)
+
+
+@router.get("/{hospital_id}/slot-events")
+async def stream_slot_events(
+    request: Request, doctor_ids: list[int] = Depends(watched_doctors)
+) -> StreamingResponse:
+    """
+    Follow changes to a hospital's slots as server-sent events, optionally for some
+    of its doctors only. Bursts are batched, and a ``resync`` event means changes
+    were dropped and calendars should be reloaded.
+    """
+    return StreamingResponse(
+        server_sent_events(request, doctor_ids),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _send_changes(websocket: WebSocket, subscription: Subscription) -> None:
+    await websocket.send_json(
+        {"type": "subscribed", "doctor_ids": sorted(subscription.doctor_ids)}
+    )
+    while True:
+        try:
+            batch = await subscription.next_batch(settings.slot_feed_keepalive_seconds)
+        except Overflowed:
+            await websocket.send_json({"type": "resync"})
+            continue
+        if batch:
+            await websocket.send_json({"type": "slots", "changes": _changes(batch)})
+        else:
+            await websocket.send_json({"type": "keepalive"})
+
+
+@router.websocket("/{hospital_id}/slot-events/ws")
+async def slot_events_socket(
+    websocket: WebSocket, doctor_ids: list[int] = Depends(watched_doctors)
+) -> None:
+    """The same changes as ``/slot-events``, as JSON messages over a websocket."""
+    await websocket.accept()
+    subscription = slot_feed.subscribe(doctor_ids)
+    sender = asyncio.create_task(_send_changes(websocket, subscription))
+    try:
+        # Nothing is expected from the client; this waits for it to go away
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        slot_feed.unsubscribe(subscription)
@@ -0,0 +1,556 @@
+import asyncio
+import gc
+import random
+import statistics
+import time as clock
+from datetime import date, datetime, time
+from zoneinfo import ZoneInfo
+
+import httpx
+import orjson
+import pytest
+from sqlalchemy import create_engine, select, text, update
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+from app.api.rest.appointments import COMPACT_MEDIA_TYPE, calendar_body
+from app.api.schemas.appointments import CalendarInfo
+from app.core.auth import create_jwt_token
+from app.core.availability import calendar_query, get_calendar, pack_day
+from app.core.cache import availability_cache
+from app.core.calendar_versions import calendar_versions
+from app.core.database import ShardMap, get_async_shards
+from app.core.metrics import slot_conflicts
+from app.main import app
+from app.models import Appointment, Base, Doctor, Hospital, Patient
+
+
+def _login(client, user) -> None:
+    client.cookies.set("access_token", create_jwt_token(user.id, user.email))
+
+
+def _patient(db) -> int:
+    patient = Patient(name="Pat")
+    db.add(patient)
+    db.commit()
+    return patient.id
+
+
+def test_calendar_groups_slots_by_local_date(client, db, make_hospital):
+    hospital = make_hospital(doctors=2, slot_start=date(2025, 3, 8), slot_days=2)
+    first, second = (doctor.id for doctor in hospital.doctors)
+    booked = db.query(Appointment).filter(Appointment.doctor_id == first).first()
+    booked.patient_id = _patient(db)
+    db.commit()
+
+    response = client.get(
+        "/api/appointments",
+        params={"doctor": [first, second], "start": "2025-03-08", "end": "2025-03-10"},
+    )
+
+    assert response.status_code == 200
+    days = response.json()["days"]
+    assert len(days) == 6
+    by_key = {(day["doctor_id"], day["date"]): day["available_slots"] for day in days}
+    # Local hours are kept across the DST change on 2025-03-09
+    assert [s["time"] for s in by_key[(first, "2025-03-09")]][0] == "09:00:00"
+    assert len(by_key[(second, "2025-03-09")]) == 8
+    assert by_key[(first, "2025-03-10")] == []
+    assert by_key[(first, "2025-03-08")][0]["bookable"] is False
+
+
+def test_calendar_rejects_unknown_doctor_and_bad_range(client, make_hospital):
+    hospital = make_hospital(doctors=1)
+    doctor_id = hospital.doctors[0].id
+
+    missing = client.get(
+        "/api/appointments",
+        params={"doctor": [doctor_id, 999], "start": "2025-01-01", "end": "2025-01-01"},
+    )
+    backwards = client.get(
+        "/api/appointments",
+        params={"doctor": [doctor_id], "start": "2025-01-02", "end": "2025-01-01"},
+    )
+
+    assert missing.status_code == 404
+    assert backwards.status_code == 400
+
+
+def test_only_the_hospitals_staff_see_who_booked(  # pylint: disable=too-many-locals
+    client, db, make_hospital, make_user, monkeypatch
+):
+    monkeypatch.setattr(calendar_versions, "settle_seconds", 0)
+    hospital = make_hospital(doctors=1, slot_start=date(2025, 3, 3), slot_days=1)
+    doctor_id = hospital.doctors[0].id
+    other_doctor_id = make_hospital(doctors=1).doctors[0].id
+    patient_id = _patient(db)
+    booked = db.query(Appointment).first()
+    booked.patient_id = patient_id
+    db.commit()
+    params = {"doctor": [doctor_id], "start": "2025-03-03", "end": "2025-03-03"}
+
+    def booked_slots(**extra) -> list:
+        response = client.get("/api/appointments", params={**params, **extra})
+        days = response.json()["days"]
+        if "format" in extra:
+            return [(day["booked"], day["patient_ids"]) for day in days]
+        slots = days[0]["available_slots"]
+        return [(s["bookable"], s["patient_id"]) for s in slots if not s["bookable"]]
+
+    anonymous = booked_slots(), booked_slots(format="compact")
+    tags = {client.get("/api/appointments", params=params).headers["ETag"]}
+    _login(client, make_user("patient@test.com", person_id=patient_id))
+    patient = booked_slots(), booked_slots(format="compact")
+    _login(client, make_user("other@test.com", person_id=other_doctor_id))
+    other_hospital = booked_slots(), booked_slots(format="compact")
+    tags.add(client.get("/api/appointments", params=params).headers["ETag"])
+    _login(client, make_user(person_id=doctor_id))
+    staff = booked_slots(), booked_slots(format="compact")
+    tags.add(client.get("/api/appointments", params=params).headers["ETag"])
+
+    assert anonymous == patient == other_hospital == ([(False, None)], [(1, [])])
+    assert staff == ([(False, patient_id)], [(1, [patient_id])])
+    assert len(tags) == 2
+
+
+def test_staff_only_see_who_booked_at_their_own_hospital(
+    client, db, make_hospital, make_user
+):
+    start = date(2025, 3, 3)
+    own = make_hospital(doctors=1, slot_start=start, slot_days=1).doctors[0].id
+    other = make_hospital(doctors=1, slot_start=start, slot_days=1).doctors[0].id
+    patient_id = _patient(db)
+    db.execute(update(Appointment).values(patient_id=patient_id))
+    db.commit()
+    _login(client, make_user(person_id=own))
+
+    response = client.get(
+        "/api/appointments",
+        params={"doctor": [own, other], "start": "2025-03-03", "end": "2025-03-03"},
+    )
+
+    shown = {
+        day["doctor_id"]: {slot["patient_id"] for slot in day["available_slots"]}
+        for day in response.json()["days"]
+    }
+    assert shown == {own: {patient_id}, other: {None}}
+
+
+def test_patient_appointments_span_every_shard(  # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    client, db, async_session_factory, make_hospital, make_user, query_budget, tmp_path
+):
+    hospital = make_hospital(doctors=1, slot_start=date(2025, 3, 3), slot_days=1)
+    patient = Patient(name="Pat")
+    db.add(patient)
+    db.flush()
+    here = db.scalars(select(Appointment).order_by(Appointment.id.desc())).first()
+    here.patient_id = patient.id
+    db.commit()
+    patient_id, here_id = patient.id, here.id
+    # A hospital on a database of its own, where the patient booked earlier
+    shard = create_engine(f"sqlite:///{tmp_path / 'shard.db'}")
+    Base.metadata.create_all(shard)
+    with Session(shard) as shard_db:
+        elsewhere = Hospital(
+            id=hospital.id + 1000,
+            name="Elsewhere",
+            address="2 Test Street",
+            timezone=ZoneInfo("UTC"),
+            open_time=time(9),
+            close_time=time(17),
+        )
+        doctor = Doctor(name="Doctor", hospital=elsewhere)
+        shard_db.add_all([Patient(id=patient_id, name="Pat"), doctor])
+        shard_db.flush()
+        shard_db.add(
+            Appointment(
+                doctor_id=doctor.id,
+                hospital_id=elsewhere.id,
+                patient_id=patient_id,
+                appointment_time=datetime(2025, 3, 1, 9),
+                created_by=doctor.id,
+            )
+        )
+        shard_db.commit()
+        elsewhere_id = elsewhere.id
+    shard.dispose()
+    shard_factory = async_sessionmaker(
+        bind=create_async_engine(
+            f"sqlite+aiosqlite:///{tmp_path / 'shard.db'}", poolclass=NullPool
+        ),
+        expire_on_commit=False,
+    )
+    app.dependency_overrides[get_async_shards] = lambda: ShardMap(
+        async_session_factory, [(range(elsewhere_id, elsewhere_id + 1), shard_factory)]
+    )
+    _login(client, make_user(person_id=patient_id))
+
+    client.get("/api/auth/me")  # Caches the caller
+    # One query per database
+    with query_budget(2):
+        response = client.get(f"/api/appointments/patients/{patient_id}")
+    someone_else = client.get(f"/api/appointments/patients/{patient_id + 1}")
+
+    assert response.status_code == 200
+    appointments = response.json()
+    assert [a["hospital_id"] for a in appointments] == [elsewhere_id, hospital.id]
+    assert appointments[1]["id"] == here_id
+    assert someone_else.status_code == 403
+
+
+def test_reserved_slots_can_only_be_booked_by_their_holder(  # pylint: disable=too-many-locals
+    client, db, make_hospital, make_user
+):
+    hospital = make_hospital(doctors=1, slot_start=date(2025, 3, 3), slot_days=1)
+    doctor_id = hospital.doctors[0].id
+    slot_id = db.scalars(select(Appointment.id).order_by(Appointment.id)).first()
+    alice = make_user("alice@test.com", person_id=doctor_id)
+    bob = make_user("bob@test.com", person_id=doctor_id)
+    params = {"doctor": [doctor_id], "start": "2025-03-03", "end": "2025-03-03"}
+    patient_id = _patient(db)
+    booking = {"patient_id": patient_id}
+
+    _login(client, alice)
+    assert (
+        client.post(f"/api/appointments/{slot_id}/booking", json=booking).status_code
+        == 409
+    )
+    assert client.post(f"/api/appointments/{slot_id}/reservation").status_code == 200
+    reserved = client.get("/api/appointments", params=params).json()
+    _login(client, bob)
+    assert client.post(f"/api/appointments/{slot_id}/reservation").status_code == 409
+    assert (
+        client.post(f"/api/appointments/{slot_id}/booking", json=booking).status_code
+        == 409
+    )
+    _login(client, alice)
+    booked = client.post(f"/api/appointments/{slot_id}/booking", json=booking)
+    after = client.get("/api/appointments", params=params).json()
+
+    slot = reserved["days"][0]["available_slots"][0]
+    assert (slot["bookable"], slot["reserved"]) == (False, True)
+    assert booked.status_code == 200
+    assert booked.json()["patient_id"] == patient_id
+    slot = after["days"][0]["available_slots"][0]
+    assert (slot["patient_id"], slot["reserved"]) == (patient_id, False)
+    assert client.post(f"/api/appointments/{slot_id}/reservation").status_code == 409
+    assert slot_conflicts.value("reservation") == 1
+    assert slot_conflicts.value("already_booked") == 1
+
+
+def test_slots_are_booked_for_known_patients_within_scope(
+    client, db, make_hospital, make_user
+):
+    hospital = make_hospital(doctors=1, slot_start=date(2025, 3, 3), slot_days=1)
+    doctor_id = hospital.doctors[0].id
+    other_doctor = make_hospital(doctors=1).doctors[0].id
+    first, second = db.scalars(select(Appointment.id).limit(2)).all()
+    patient_id, someone_else = _patient(db), _patient(db)
+
+    def book(slot_id: int, patient: int) -> tuple[int, int]:
+        reserved = client.post(f"/api/appointments/{slot_id}/reservation")
+        booked = client.post(
+            f"/api/appointments/{slot_id}/booking", json={"patient_id": patient}
+        )
+        return reserved.status_code, booked.status_code
+
+    _login(client, make_user("other@test.com", person_id=other_doctor))
+    assert book(first, patient_id) == (403, 409)
+    _login(client, make_user("patient@test.com", person_id=patient_id))
+    assert book(first, someone_else) == (200, 403)
+    assert book(first, 999) == (200, 404)
+    assert book(first, patient_id) == (200, 200)
+    _login(client, make_user("staff@test.com", person_id=doctor_id))
+    assert book(second, someone_else) == (200, 200)
+
+
+def test_reservations_are_released(client, db, make_hospital, make_user):
+    hospital = make_hospital(doctors=1, slot_start=date(2025, 3, 3), slot_days=1)
+    doctor_id = hospital.doctors[0].id
+    slot_id = db.scalars(select(Appointment.id)).first()
+    alice = make_user("alice@test.com", person_id=doctor_id)
+    bob = make_user("bob@test.com", person_id=doctor_id)
+
+    _login(client, alice)
+    client.post(f"/api/appointments/{slot_id}/reservation")
+    assert client.put(f"/api/appointments/{slot_id}/reservation").status_code == 200
+    _login(client, bob)
+    assert client.delete(f"/api/appointments/{slot_id}/reservation").status_code == 409
+    _login(client, alice)
+    assert client.delete(f"/api/appointments/{slot_id}/reservation").status_code == 200
+    _login(client, bob)
+    assert client.post(f"/api/appointments/{slot_id}/reservation").status_code == 200
+    assert client.post("/api/appointments/999/reservation").status_code == 404
+
+
+def test_users_can_only_reserve_a_few_slots_at_once(
+    client, db, make_hospital, make_user
+):
+    hospital = make_hospital(doctors=1, slot_start=date(2025, 3, 3), slot_days=1)
+    doctor_id = hospital.doctors[0].id
+    *held, extra = db.scalars(select(Appointment.id).limit(6)).all()
+    _login(client, make_user("alice@test.com", person_id=doctor_id))
+
+    reserved = [
+        client.post(f"/api/appointments/{slot_id}/reservation").status_code
+        for slot_id in held
+    ]
+    refused = client.post(f"/api/appointments/{extra}/reservation")
+    client.delete(f"/api/appointments/{held[0]}/reservation")
+
+    assert reserved == [200] * 5
+    assert refused.status_code == 409
+    assert refused.json()["detail"] == "Too many slots reserved"
+    assert client.post(f"/api/appointments/{extra}/reservation").status_code == 200
+
+
+def test_unchanged_calendars_are_not_modified(  # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    client, db, make_hospital, make_user, statements, monkeypatch
+):
+    hospital = make_hospital(doctors=2, slot_start=date(2025, 3, 3), slot_days=1)
+    first, second = (doctor.id for doctor in hospital.doctors)
+    params = {"doctor": [first, second], "start": "2025-03-03", "end": "2025-03-03"}
+    calendar = client.get("/api/appointments", params=params)
+    etag = calendar.headers["ETag"]
+    slot_id = calendar.json()["days"][1]["available_slots"][0]["appointment_id"]
+
+    statements.clear()
+    polled = client.get(
+        "/api/appointments", params=params, headers={"If-None-Match": etag}
+    )
+    assert (polled.status_code, polled.content) == (304, b"")
+    assert not statements
+
+    _login(client, make_user(person_id=first))
+    client.post(f"/api/appointments/{slot_id}/reservation")
+    reserved = client.get(
+        "/api/appointments", params=params, headers={"If-None-Match": etag}
+    )
+    assert reserved.status_code == 200
+    assert reserved.headers["ETag"] != etag
+
+    patient_id = _patient(db)
+    client.post(f"/api/appointments/{slot_id}/booking", json={"patient_id": patient_id})
+    # Replicas may lag for a moment after a write
+    assert "ETag" not in client.get("/api/appointments", params=params).headers
+    monkeypatch.setattr(calendar_versions, "settle_seconds", 0)
+    booked = client.get(
+        "/api/appointments", params=params, headers={"If-None-Match": etag}
+    )
+    assert booked.status_code == 200
+    assert booked.headers["ETag"] != etag
+
+
+def test_calendar_query_uses_doctor_timeslot_index(db, make_hospital):
+    make_hospital(doctors=1)
+    statement = calendar_query([1, 2], date(2025, 1, 1), date(2025, 1, 14))
+    compiled = statement.compile(
+        dialect=db.bind.dialect, compile_kwargs={"literal_binds": True}
+    )
+
+    plan = db.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+
+    assert any("idx_unique_doctor_timeslot" in row[-1] for row in plan)
+
+
+@pytest.mark.benchmark
+def test_calendar_latency_budget(client, db, make_hospital):
+    """
+    A 14 day, 20 doctor view of a 100 doctor hospital stays under 200ms at p99, when
+    it isn't cached.
+    """
+    hospital = make_hospital(doctors=100, slot_start=date(2025, 1, 1), slot_days=14)
+    doctor_ids = [doctor.id for doctor in hospital.doctors[::5]]
+    db.execute(
+        update(Appointment)
+        .where(Appointment.id % 3 == 0)
+        .values(patient_id=_patient(db))
+    )
+    db.commit()
+    params = {"doctor": doctor_ids, "start": "2025-01-01", "end": "2025-01-14"}
+
+    client.get("/api/appointments", params=params)  # warm up
+    # Like a worker at startup (see main.lifespan), so full collections don't scan
+    # the fixtures' objects
+    gc.collect()
+    gc.freeze()
+    timings = []
+    try:
+        for _ in range(50):
+            # Every request reads the database rather than the availability cache
+            availability_cache.clear()
+            started = clock.perf_counter()
+            response = client.get("/api/appointments", params=params)
+            timings.append(clock.perf_counter() - started)
+            assert response.status_code == 200
+    finally:
+        gc.unfreeze()
+
+    timings.sort()
+    p99 = timings[int(len(timings) * 0.99) - 1]
+    print(
+        f"calendar p50={timings[len(timings) // 2] * 1000:.1f}ms p99={p99 * 1000:.1f}ms"
+    )
+    assert len(response.json()["days"]) == 20 * 14
+    assert p99 < 0.2
+
+
+def _unpack(day: dict) -> dict:
+    """Turn a compact calendar day back into the object per slot form."""
+    patients = iter(day["patient_ids"])
+    slots = []
+    for i, (minutes, appointment_id) in enumerate(zip(day["times"], day["ids"])):
+        booked, reserved = day["booked"] >> i & 1, day["reserved"] >> i & 1
+        slots.append(
+            {
+                "appointment_id": appointment_id,
+                "time": f"{minutes // 60:02}:{minutes % 60:02}:00",
+                "duration": 60,
+                "bookable": not booked and not reserved,
+                "patient_id": next(patients) if booked else None,
+                "reserved": bool(reserved),
+            }
+        )
+    return {
+        "doctor_id": day["doctor_id"],
+        "date": day["date"],
+        "available_slots": slots,
+    }
+
+
+def test_compact_calendars_carry_the_same_slots(client, db, make_hospital, make_user):
+    hospital = make_hospital(doctors=2, slot_start=date(2025, 3, 8), slot_days=2)
+    first, second = (doctor.id for doctor in hospital.doctors)
+    slot_ids = db.scalars(select(Appointment.id).order_by(Appointment.id)).all()
+    db.execute(
+        update(Appointment)
+        .where(Appointment.id == slot_ids[1])
+        .values(patient_id=_patient(db))
+    )
+    db.commit()
+    _login(client, make_user(person_id=first))
+    client.post(f"/api/appointments/{slot_ids[2]}/reservation")
+    params = {"doctor": [first, second], "start": "2025-03-08", "end": "2025-03-10"}
+
+    slots = client.get("/api/appointments", params=params)
+    compact = client.get("/api/appointments", params={**params, "format": "compact"})
+    negotiated = client.get(
+        "/api/appointments", params=params, headers={"Accept": COMPACT_MEDIA_TYPE}
+    )
+
+    assert compact.headers["content-type"] == COMPACT_MEDIA_TYPE
+    assert negotiated.content == compact.content
+    assert [_unpack(day) for day in compact.json()["days"]] == slots.json()["days"]
+    assert compact.json()["days"][0]["booked"] == 0b10
+    assert compact.json()["days"][0]["reserved"] == 0b100
+    assert compact.headers["ETag"] != slots.headers["ETag"]
+
+
+def _serialize(days: list, compact: bool) -> bytes:
+    """Serialize a calendar the way each form of the endpoint does."""
+    if compact:
+        return orjson.dumps({"days": [pack_day(day) for day in days]})
+    calendar = calendar_body(days, days[0].date, days[-1].date)
+    return CalendarInfo.model_validate(calendar).model_dump_json().encode()
+
+
+@pytest.mark.benchmark
+def test_compact_calendar_serialization(db, make_hospital):
+    """A 20 doctor, two week calendar in both forms."""
+    hospital = make_hospital(doctors=20, slot_start=date(2025, 1, 1), slot_days=14)
+    doctor_ids = [doctor.id for doctor in hospital.doctors]
+    patient_id = _patient(db)
+    db.execute(
+        update(Appointment).where(Appointment.id % 3 == 0).values(patient_id=patient_id)
+    )
+    db.commit()
+    days = get_calendar(db, doctor_ids, date(2025, 1, 1), date(2025, 1, 14))
+
+    results = {}
+    for compact in (False, True):
+        timings = []
+        for _ in range(30):
+            started = clock.perf_counter()
+            body = _serialize(days, compact)
+            timings.append(clock.perf_counter() - started)
+        results[compact] = (statistics.median(timings), len(body))
+        print(
+            f"{'compact' if compact else 'slots'}: {results[compact][0] * 1000:.2f}ms "
+            f"{results[compact][1] / 1024:.0f}KiB"
+        )
+
+    assert results[True][1] * 4 < results[False][1]
+    # Packing is a Python loop over the slots too, so it's nearer 3x than 5x faster
+    assert results[True][0] * 2 < results[False][0]
+
+
+async def _book_any(
+    client: httpx.AsyncClient, token: str, slot_ids: list[int], patient_id: int
+):
+    """Try slots in a random order until one is reserved and booked."""
+    headers = {"Cookie": f"access_token={token}"}
+    latencies, statuses = [], []
+    for slot_id in random.sample(slot_ids, len(slot_ids)):
+        started = clock.perf_counter()
+        response = await client.post(
+            f"/api/appointments/{slot_id}/reservation", headers=headers
+        )
+        if response.status_code == 200:
+            response = await client.post(
+                f"/api/appointments/{slot_id}/booking",
+                json={"patient_id": patient_id},
+                headers=headers,
+            )
+        latencies.append(clock.perf_counter() - started)
+        statuses.append(response.status_code)
+        if response.status_code == 200:
+            return slot_id, latencies, statuses
+    return None, latencies, statuses
+
+
+@pytest.mark.benchmark
+def test_booking_contention_on_a_hot_doctor(client, db, make_hospital, make_user):
+    """200 clients race for one doctor's 8 slots. Each slot is booked exactly once."""
+    # pylint: disable=unused-argument,too-many-locals
+    hospital = make_hospital(doctors=1, slot_start=date(2025, 3, 3), slot_days=1)
+    doctor_id = hospital.doctors[0].id
+    slot_ids = list(db.scalars(select(Appointment.id)).all())
+    patient_id = _patient(db)
+    # Receptionists booking on behalf of the same patient
+    users = (make_user(f"user{i}@test.com", person_id=doctor_id) for i in range(200))
+    tokens = [create_jwt_token(user.id, user.email) for user in users]
+
+    async def run() -> list:
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://test"
+        ) as http:
+            # Callers are already signed in, so their principals are cached
+            for token in tokens:
+                await http.get(
+                    "/api/auth/me", headers={"Cookie": f"access_token={token}"}
+                )
+            return await asyncio.gather(
+                *(_book_any(http, token, slot_ids, patient_id) for token in tokens)
+            )
+
+    results = asyncio.run(run())
+
+    booked = [slot_id for slot_id, _, _ in results if slot_id is not None]
+    latencies = [latency for _, times, _ in results for latency in times]
+    statuses = {status for _, _, codes in results for status in codes}
+    p99 = statistics.quantiles(latencies, n=100)[98]
+    print(
+        f"{len(tokens)} clients, {len(slot_ids)} slots: "
+        f"{len(booked) / len(tokens):.1%} booked, {len(latencies)} attempts, "
+        f"p99={p99 * 1000:.1f}ms"
+    )
+    assert sorted(booked) == sorted(slot_ids)
+    assert statuses == {200, 409}
+    assert (
+        db.scalar(select(Appointment.id).where(Appointment.patient_id.is_(None)))
+        is None
+    )
+    # Every attempt waits its turn on this one event loop, so p99 is mostly queueing:
+    # 0.4 to 0.65s, alone or beside the rest of the suite
+    assert p99 < 0.8
@@ -0,0 +1,313 @@
+import asyncio
+import statistics
+import time as clock
+
+import bcrypt
+import httpx
+import pytest
+from fastapi import Cookie, Depends, FastAPI, HTTPException
+from sqlalchemy import create_engine, update
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import NullPool
+
+from app.core import auth
+from app.core.auth import create_jwt_token, verify_jwt_token
+from app.core.cache import RedisBackend
+from app.core.config import settings
+from app.core.database import get_async_db, get_db
+from app.core.hashing import PasswordHasher
+from app.core.refresh_tokens import RefreshTokenStore, refresh_tokens
+from app.main import app
+from app.models import User
+
+
+def test_login_sets_auth_cookies(client, make_user):
+    make_user(email="staff@test.com", password="password")
+
+    response = client.post(
+        "/api/auth/login", json={"email": "Staff@Test.com", "password": "password"}
+    )
+    rejected = client.post(
+        "/api/auth/login", json={"email": "staff@test.com", "password": "incorrect"}
+    )
+
+    assert response.status_code == 200
+    assert {"access_token", "refresh_token"} <= set(response.cookies)
+    assert rejected.status_code == 401
+
+
+def test_refresh_rotates_the_refresh_token(client, make_user, monkeypatch):
+    # Replays right after a refresh are otherwise taken for a second tab
+    monkeypatch.setattr(refresh_tokens, "grace", 0)
+    make_user(email="staff@test.com", password="password")
+    client.post(
+        "/api/auth/login", json={"email": "staff@test.com", "password": "password"}
+    )
+    first = client.cookies["refresh_token"]
+
+    refreshed = client.get("/api/auth/refresh")
+    second = client.cookies["refresh_token"]
+    client.cookies.set("refresh_token", first)
+    replayed = client.get("/api/auth/refresh")
+    client.cookies.set("refresh_token", second)
+
+    assert refreshed.status_code == 200
+    assert second != first
+    assert replayed.status_code == 401
+    # Replaying the old token revoked the whole family
+    assert client.get("/api/auth/refresh").status_code == 401
+
+
+def test_logout_revokes_the_refresh_token(client, make_user):
+    make_user(email="staff@test.com", password="password")
+    client.post(
+        "/api/auth/login", json={"email": "staff@test.com", "password": "password"}
+    )
+    token = client.cookies["refresh_token"]
+
+    client.post("/api/auth/logout")
+    client.cookies.set("refresh_token", token)
+
+    assert client.get("/api/auth/refresh").status_code == 401
+
+
+def test_refresh_needs_an_active_user(client, db, make_user):
+    user = make_user(email="staff@test.com", password="password")
+    client.post(
+        "/api/auth/login", json={"email": "staff@test.com", "password": "password"}
+    )
+
+    # A Core update, so the session doesn't revoke the user's tokens itself
+    db.execute(update(User).where(User.id == user.id).values(is_active=False))
+    db.commit()
+
+    assert client.get("/api/auth/refresh").status_code == 401
+
+
+def test_refresh_tokens_outlive_the_worker_that_issued_them(
+    client, make_user, refresh_token_redis
+):
+    make_user(email="staff@test.com", password="password")
+    client.post(
+        "/api/auth/login", json={"email": "staff@test.com", "password": "password"}
+    )
+
+    # Another worker, or this one restarted, with an empty memory but the same Redis
+    restarted = RefreshTokenStore(
+        RedisBackend(refresh_token_redis, prefix="auth:"),
+        ttl=refresh_tokens.ttl,
+        secret=settings.secret_key,
+    )
+
+    assert restarted.verify(client.cookies["refresh_token"]) is not None
+
+
+def test_login_is_rejected_quickly_when_hashing_is_saturated(
+    client, make_user, monkeypatch
+):
+    make_user(email="staff@test.com", password="password")
+    monkeypatch.setattr(auth, "password_hasher", PasswordHasher(1, max_pending=0))
+
+    response = client.post(
+        "/api/auth/login", json={"email": "staff@test.com", "password": "password"}
+    )
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_me_returns_the_token_owner(client, make_user):
+    user = make_user()
+    client.cookies.set("access_token", create_jwt_token(user.id, user.email))
+
+    response = client.get("/api/auth/me")
+
+    assert response.status_code == 200
+    assert response.json() == {"id": user.id, "email": user.email, "is_active": "True"}
+
+
+def test_me_requires_a_valid_token(client):
+    assert client.get("/api/auth/me").status_code == 401
+    client.cookies.set("access_token", "not-a-token")
+    assert client.get("/api/auth/me").status_code == 401
+
+
+def _sync_me_app(database_path) -> FastAPI:
+    """
+    The previous threadpool-bound implementation of /api/auth/me.
+
+    The pool has to overflow to one connection per caller. Otherwise routes blocked
+    on a checkout hold all of Starlette's 40 threads, while the requests holding
+    connections need one of those threads to validate their response before their
+    session is closed, and the stack deadlocks until the pool timeout.
+    """
+    sync_app = FastAPI()
+    engine = create_engine(
+        f"sqlite:///{database_path}",
+        connect_args={"check_same_thread": False},
+        pool_size=40,
+        max_overflow=500,
+    )
+    factory = sessionmaker(bind=engine)
+
+    def override_get_db():
+        with factory() as session:
+            yield session
+
+    @sync_app.get("/api/auth/me")
+    def read_current_user(
+        db: Session = Depends(get_db), access_token: str | None = Cookie(None)
+    ) -> dict[str, str]:
+        payload = verify_jwt_token(access_token or "")
+        if not payload:
+            raise HTTPException(status_code=401, detail="Invalid or expired token")
+        user = db.query(User).filter(User.id == payload.get("sub")).first()
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        return {"id": str(user.id), "email": user.email}
+
+    sync_app.dependency_overrides[get_db] = override_get_db
+    return sync_app
+
+
+async def _throughput(asgi_app: FastAPI, cookies: dict, callers: int) -> float:
+    transport = httpx.ASGITransport(app=asgi_app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://test", cookies=cookies
+    ) as client:
+        started = clock.perf_counter()
+        responses = await asyncio.gather(
+            *(client.get("/api/auth/me") for _ in range(callers))
+        )
+        elapsed = clock.perf_counter() - started
+    assert all(response.status_code == 200 for response in responses)
+    return callers / elapsed
+
+
+@pytest.mark.benchmark
+def test_me_throughput_sync_vs_async(database_path, make_user):
+    """500 simultaneous /api/auth/me callers against the sync and async stacks."""
+    user = make_user()
+    cookies = {"access_token": create_jwt_token(user.id, user.email)}
+
+    async def run() -> tuple[float, float]:
+        async_engine = create_async_engine(
+            f"sqlite+aiosqlite:///{database_path}", pool_size=20, max_overflow=0
+        )
+        factory = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+
+        async def override_get_async_db():
+            async with factory() as session:
+                yield session
+
+        app.dependency_overrides[get_async_db] = override_get_async_db
+        try:
+            sync_rate = await _throughput(_sync_me_app(database_path), cookies, 500)
+            async_rate = await _throughput(app, cookies, 500)
+        finally:
+            app.dependency_overrides.clear()
+            await async_engine.dispose()
+        return sync_rate, async_rate
+
+    sync_rate, async_rate = asyncio.run(run())
+    print(f"/api/auth/me x500: sync={sync_rate:.0f} req/s async={async_rate:.0f} req/s")
+    # The principal cache is cold, so this also covers 500 simultaneous misses
+    assert async_rate >= sync_rate
+
+
+async def _latencies(client: httpx.AsyncClient, path: str, calls: int) -> list[float]:
+    latencies = []
+    for _ in range(calls):
+        started = clock.perf_counter()
+        response = await client.get(path)
+        latencies.append(clock.perf_counter() - started)
+        assert response.status_code == 200
+    return latencies
+
+
+def _p50(latencies: list[float]) -> float:
+    return statistics.median(latencies)
+
+
+def _p95(latencies: list[float]) -> float:
+    return statistics.quantiles(latencies, n=20)[18]
+
+
+async def _login_storm(database_path, user: User, logins: int) -> tuple[dict, set]:
+    """Poll /health and /api/auth/me while ``logins`` logins arrive at once."""
+    # One connection per session, so logins reach the hashing pool instead of
+    # queueing for a database connection
+    async_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{database_path}", poolclass=NullPool
+    )
+    factory = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+
+    async def override_get_async_db():
+        async with factory() as session:
+            yield session
+
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    credentials = {"email": user.email, "password": "incorrect"}
+    cookies = {"access_token": create_jwt_token(user.id, user.email)}
+    try:
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app),
+            base_url="http://test",
+            cookies=cookies,
+        ) as client:
+            storm = asyncio.gather(
+                *(
+                    client.post("/api/auth/login", json=credentials)
+                    for _ in range(logins)
+                )
+            )
+            latencies = {
+                path: await _latencies(client, path, 100)
+                for path in ("/health", "/api/auth/me")
+            }
+            statuses = {response.status_code for response in await storm}
+    finally:
+        app.dependency_overrides.clear()
+        await async_engine.dispose()
+    return latencies, statuses
+
+
+def _print_storm(results):
+    for name, (latencies, statuses) in results.items():
+        for path, samples in latencies.items():
+            p50, p95 = _p50(samples), _p95(samples)
+            print(f"{name} {path}: p50={p50 * 1000:.1f}ms p95={p95 * 1000:.1f}ms")
+        print(f"{name} login statuses: {sorted(statuses)}")
+
+
+@pytest.mark.benchmark
+def test_login_storm_leaves_other_routes_responsive(
+    db, database_path, make_user, monkeypatch
+):
+    """
+    300 simultaneous logins at bcrypt cost 10 while /health and /api/auth/me are
+    polled, with bcrypt on a threadpool sized like Starlette's and on the bounded
+    hashing pool. The bounded pool sheds the excess logins with 503. The password is
+    wrong, so the logins cost the same bcrypt check without contending for SQLite's
+    single writer.
+    """
+    user = make_user(email="staff@test.com")
+    user.hashed_password = bcrypt.hashpw(b"password", bcrypt.gensalt(10)).decode()
+    db.commit()
+
+    results = {}
+    for name, hasher in (
+        ("threadpool", PasswordHasher(40, max_pending=1_000)),
+        ("bounded", PasswordHasher(1, max_pending=16)),
+    ):
+        monkeypatch.setattr(auth, "password_hasher", hasher)
+        results[name] = asyncio.run(_login_storm(database_path, user, 300))
+
+    _print_storm(results)
+
+    (unbounded, _), (bounded, statuses) = results["threadpool"], results["bounded"]
+    assert statuses == {401, 503}
+    for path, samples in bounded.items():
+        assert _p50(samples) < 0.1
+        assert _p95(samples) < _p95(unbounded[path])
@@ -0,0 +1,222 @@
+# pylint: disable=not-callable
+
+import time as clock
+from datetime import date, time, timedelta
+
+import pytest
+from sqlalchemy import func, select, update
+
+from app.core.auth import create_jwt_token
+from app.core.calendar_versions import calendar_versions
+from app.core.revalidation import revalidate
+from app.models import Appointment, Doctor, Patient
+
+
+def test_free_slots_cover_the_whole_hospital(client, make_hospital):
+    today = date.today()
+    hospital = make_hospital(doctors=3, slot_start=today, slot_days=2)
+    params = {
+        "start": today.isoformat(),
+        "end": (today + timedelta(days=1)).isoformat(),
+    }
+
+    response = client.get(f"/api/hospitals/{hospital.id}/free-slots", params=params)
+    missing = client.get(f"/api/hospitals/{hospital.id + 1}/free-slots", params=params)
+
+    assert response.status_code == 200
+    days = response.json()["days"]
+    assert len(days) == 6
+    assert all(len(day["times"]) == 8 for day in days)
+    assert missing.status_code == 404
+
+
+def test_unchanged_free_slots_are_not_modified(client, db, make_hospital, monkeypatch):
+    today = date.today()
+    hospital = make_hospital(doctors=2, slot_start=today, slot_days=1)
+    url = f"/api/hospitals/{hospital.id}/free-slots"
+    params = {"start": today.isoformat(), "end": today.isoformat()}
+    etag = client.get(url, params=params).headers["ETag"]
+
+    polled = client.get(url, params=params, headers={"If-None-Match": etag})
+    slot = db.scalars(select(Appointment)).first()
+    slot.patient_id = hospital.doctors[1].id
+    db.commit()
+    monkeypatch.setattr(calendar_versions, "settle_seconds", 0)
+    booked = client.get(url, params=params, headers={"If-None-Match": etag})
+
+    assert polled.status_code == 304
+    assert booked.status_code == 200
+    assert booked.headers["ETag"] != etag
+
+
+def test_free_slots_outside_the_index_fall_back_to_sql(client, make_hospital):
+    start = date.today() + timedelta(days=1000)
+    hospital = make_hospital(doctors=2, slot_start=start, slot_days=1)
+
+    response = client.get(
+        f"/api/hospitals/{hospital.id}/free-slots",
+        params={"start": start.isoformat(), "end": start.isoformat()},
+    )
+
+    assert response.status_code == 200
+    assert [len(day["times"]) for day in response.json()["days"]] == [8, 8]
+
+
+def test_opening_slots_skips_existing_ones(client, db, make_hospital, make_user):
+    today = date.today()
+    hospital = make_hospital(doctors=2, slot_start=today, slot_days=1)
+    staff = make_user(is_superuser=True)
+    client.cookies.set("access_token", create_jwt_token(staff.id, staff.email))
+    params = {
+        "start": today.isoformat(),
+        "end": (today + timedelta(days=1)).isoformat(),
+    }
+    free = client.get(f"/api/hospitals/{hospital.id}/free-slots", params=params)
+
+    response = client.post(f"/api/hospitals/{hospital.id}/slots", json=params)
+    again = client.post(f"/api/hospitals/{hospital.id}/slots", json=params)
+    after = client.get(f"/api/hospitals/{hospital.id}/free-slots", params=params)
+
+    assert len(free.json()["days"]) == 2
+    assert response.json() == {"inserted": 16, "skipped": 16}
+    assert again.json() == {"inserted": 0, "skipped": 32}
+    # The slot index picked up the new rows
+    assert len(after.json()["days"]) == 4
+    assert db.scalar(select(func.count()).select_from(Appointment)) == 32
+
+
+def test_opening_slots_is_limited_to_the_callers_hospitals(
+    client, make_hospital, make_user
+):
+    hospital = make_hospital(doctors=1)
+    doctor_id = hospital.doctors[0].id
+    other = make_hospital(doctors=1)
+    other_doctor_id = other.doctors[0].id
+    user = make_user(person_id=doctor_id)
+    client.cookies.set("access_token", create_jwt_token(user.id, user.email))
+    body = {"start": "2025-03-03", "end": "2025-03-03"}
+
+    allowed = client.post(f"/api/hospitals/{hospital.id}/slots", json=body)
+    elsewhere = client.post(f"/api/hospitals/{other.id}/slots", json=body)
+    unknown = client.post(
+        f"/api/hospitals/{hospital.id}/slots",
+        json={**body, "doctor_ids": [other_doctor_id]},
+    )
+
+    assert allowed.json() == {"inserted": 8, "skipped": 0}
+    assert elsewhere.status_code == 403
+    assert unknown.status_code == 404
+
+
+@pytest.mark.benchmark
+def test_opening_a_month_for_a_large_hospital(client, make_hospital, make_user):
+    """A month of slots for 100 doctors is opened within a few seconds."""
+    hospital = make_hospital(doctors=100)
+    admin = make_user(is_superuser=True)
+    client.cookies.set("access_token", create_jwt_token(admin.id, admin.email))
+
+    started = clock.perf_counter()
+    response = client.post(
+        f"/api/hospitals/{hospital.id}/slots",
+        json={"start": "2025-03-01", "end": "2025-03-30"},
+    )
+    elapsed = clock.perf_counter() - started
+
+    inserted = response.json()["inserted"]
+    print(f"opened {inserted} slots in {elapsed:.2f}s ({inserted / elapsed:,.0f}/s)")
+    assert inserted == 100 * 30 * 8
+    assert elapsed < 5
+
+
+def test_earliest_slots_by_specialty(client, db, make_hospital):
+    start = date.today() + timedelta(days=1)
+    hospital = make_hospital(doctors=3, slot_start=start, slot_days=2)
+    cardiologist = hospital.doctors[1].id
+    db.execute(
+        update(Doctor).where(Doctor.id == cardiologist).values(specialty="cardiology")
+    )
+    db.commit()
+
+    response = client.get(
+        f"/api/hospitals/{hospital.id}/earliest-slots",
+        params={"specialty": "cardiology", "limit": 10, "start": start.isoformat()},
+    )
+    missing = client.get("/api/hospitals/0/earliest-slots")
+
+    slots = response.json()["slots"]
+    assert len(slots) == 10
+    assert {slot["doctor_id"] for slot in slots} == {cardiologist}
+    assert slots[0]["time"] == f"{start.isoformat()}T09:00:00"
+    assert slots[-1]["time"] == f"{(start + timedelta(days=1)).isoformat()}T10:00:00"
+    assert missing.status_code == 404
+
+
+@pytest.mark.benchmark
+def test_earliest_slots_at_a_large_hospital(client, make_hospital):
+    """The first 20 slots out of 100 doctors' next month stay well under 50ms."""
+    hospital = make_hospital(doctors=100, slot_start=date.today(), slot_days=30)
+
+    timings = []
+    for _ in range(50):
+        started = clock.perf_counter()
+        response = client.get(
+            f"/api/hospitals/{hospital.id}/earliest-slots", params={"limit": 20}
+        )
+        timings.append(clock.perf_counter() - started)
+    timings.sort()
+
+    p50 = timings[len(timings) // 2]
+    print(f"earliest slots p50={p50 * 1000:.1f}ms max={timings[-1] * 1000:.1f}ms")
+    assert len(response.json()["slots"]) == 20
+    assert p50 < 0.05
+
+
+def test_exporting_a_hospitals_appointments(client, make_hospital, make_user):
+    hospital = make_hospital(doctors=2, slot_start=date(2025, 3, 3), slot_days=2)
+    doctor_id = hospital.doctors[0].id
+    other = make_hospital(doctors=1)
+    user = make_user(person_id=doctor_id)
+    client.cookies.set("access_token", create_jwt_token(user.id, user.email))
+    url = f"/api/hospitals/{hospital.id}/appointments/export"
+    params = {"start": "2025-03-03", "end": "2025-03-04"}
+
+    ndjson = client.get(url, params=params)
+    table = client.get(url, params={**params, "format": "csv"})
+    elsewhere = client.get(
+        f"/api/hospitals/{other.id}/appointments/export", params=params
+    )
+    backwards = client.get(url, params={"start": "2025-03-04", "end": "2025-03-03"})
+
+    assert ndjson.headers["content-type"] == "application/x-ndjson"
+    assert len(ndjson.text.splitlines()) == 32
+    assert table.headers["content-type"].startswith("text/csv")
+    filename = f"appointments-{hospital.id}-2025-03-03-2025-03-04.csv"
+    assert filename in table.headers["content-disposition"]
+    assert len(table.text.splitlines()) == 33
+    assert elsewhere.status_code == 403
+    assert backwards.status_code == 400
+
+
+def test_conflicts_after_an_hours_change(client, db, make_hospital, make_user):
+    start = date.today() + timedelta(days=2)
+    hospital = make_hospital(doctors=1, slot_start=start, slot_days=1)
+    doctor_id = hospital.doctors[0].id
+    other = make_hospital(doctors=1)
+    patient = Patient(name="Pat")
+    db.add(patient)
+    db.flush()
+    db.execute(update(Appointment).values(patient_id=patient.id))
+    hospital.close_time = time(16)
+    db.commit()
+    revalidate(db, batch_size=100)
+    user = make_user(person_id=doctor_id)
+    client.cookies.set("access_token", create_jwt_token(user.id, user.email))
+
+    response = client.get(f"/api/hospitals/{hospital.id}/conflicts")
+    elsewhere = client.get(f"/api/hospitals/{other.id}/conflicts")
+
+    (conflict,) = response.json()
+    assert conflict["patient_id"] == patient.id
+    assert conflict["time"] == f"{start.isoformat()}T16:00:00"
+    assert conflict["reason"] == "outside_hours"
+    assert elsewhere.status_code == 403
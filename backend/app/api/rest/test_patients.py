@@ -0,0 +1,31 @@
+from app.core.auth import create_jwt_token
+from app.models import Patient, Staff
+
+
+def test_staff_find_patients_as_they_type(client, db, make_hospital, make_user):
+    hospital = make_hospital(doctors=1)
+    staff = Staff(name="Staff", hospital_id=hospital.id)
+    db.add_all(
+        [
+            staff,
+            Patient(name="Jane Doe", phone="555-0123", email="jane@example.com"),
+            Patient(name="Janet Dolan"),
+        ]
+    )
+    db.commit()
+    user = make_user(person_id=staff.id)
+    outsider = make_user("outsider@test.com")
+
+    client.cookies.set("access_token", create_jwt_token(user.id, user.email))
+    found = client.get("/api/patients", params={"q": "jan do"})
+    first = client.get("/api/patients", params={"q": "jan", "limit": 1})
+    too_short = client.get("/api/patients", params={"q": "j"})
+    client.cookies.set("access_token", create_jwt_token(outsider.id, outsider.email))
+    forbidden = client.get("/api/patients", params={"q": "jan"})
+
+    assert found.status_code == 200
+    assert [p["name"] for p in found.json()] == ["Jane Doe", "Janet Dolan"]
+    assert found.json()[0]["phone"] == "555-0123"
+    assert [p["name"] for p in first.json()] == ["Jane Doe"]
+    assert too_short.status_code == 422
+    assert forbidden.status_code == 403
@@ -0,0 +1,78 @@
+from datetime import date
+
+from sqlalchemy import event, select
+
+from app.api.rest.test_appointments import _login, _patient
+from app.models import Appointment
+
+
+def test_websocket_pushes_bookings_for_the_hospital(
+    client, db, make_hospital, make_user
+):
+    hospital = make_hospital(doctors=2, slot_start=date(2025, 3, 3), slot_days=1)
+    first, second = (doctor.id for doctor in hospital.doctors)
+    slot_id = db.scalars(
+        select(Appointment.id)
+        .where(Appointment.doctor_id == second)
+        .order_by(Appointment.appointment_time)
+    ).first()
+    patient_id = _patient(db)
+    _login(client, make_user(person_id=first))
+
+    url = f"/api/hospitals/{hospital.id}/slot-events/ws"
+    with client.websocket_connect(url) as websocket:
+        assert websocket.receive_json() == {
+            "type": "subscribed",
+            "doctor_ids": [first, second],
+        }
+        client.post(f"/api/appointments/{slot_id}/reservation")
+        client.post(
+            f"/api/appointments/{slot_id}/booking", json={"patient_id": patient_id}
+        )
+        message = websocket.receive_json()
+
+    assert message == {
+        "type": "slots",
+        "changes": [
+            {"doctor_id": second, "time": "2025-03-03T14:00:00", "state": "booked"}
+        ],
+    }
+
+
+def test_slot_events_reject_unknown_hospitals_and_doctors(
+    client, make_hospital, make_user
+):
+    hospital = make_hospital(doctors=1)
+    other_doctor = make_hospital(doctors=1).doctors[0].id
+    url = f"/api/hospitals/{hospital.id}/slot-events"
+
+    anonymous = client.get(url)
+    _login(client, make_user(person_id=other_doctor))
+    elsewhere = client.get(url)
+    _login(client, make_user(email="admin@test.com", is_superuser=True))
+    missing = client.get("/api/hospitals/999/slot-events")
+    foreign = client.get(url, params={"doctor": [other_doctor]})
+
+    assert anonymous.status_code == 401
+    assert elsewhere.status_code == 403
+    assert missing.status_code == 404
+    assert foreign.json() == {"detail": "Doctor not found"}
+
+
+def test_open_streams_dont_hold_a_connection(
+    client, async_session_factory, make_hospital, make_user
+):
+    hospital = make_hospital(doctors=1)
+    _login(client, make_user(is_superuser=True))
+    checked_out = []
+    engine = async_session_factory.kw["bind"].sync_engine
+    event.listen(engine, "checkout", lambda *_: checked_out.append(1))
+    event.listen(engine, "checkin", lambda *_: checked_out.pop())
+
+    url = f"/api/hospitals/{hospital.id}/slot-events/ws"
+    with client.websocket_connect(url) as websocket:
+        subscribed = websocket.receive_json()
+        held = len(checked_out)
+
+    assert subscribed["type"] == "subscribed"
+    assert held == 0
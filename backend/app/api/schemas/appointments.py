@@ -0,0 +1,44 @@
+from datetime import date, datetime, time
+
+from pydantic import BaseModel
+
+
+class SlotInfo(BaseModel):
+    appointment_id: int
+    time: time
+    duration: int = 60
+    bookable: bool
+    patient_id: int | None = None
+    reserved: bool = False
+
+
+class DoctorDayInfo(BaseModel):
+    doctor_id: int
+    date: date
+    available_slots: list[SlotInfo]
+
+
+class CalendarInfo(BaseModel):
+    start: date
+    end: date
+    days: list[DoctorDayInfo]
+
+
+class ReservationInfo(BaseModel):
+    appointment_id: int
+    expires_in: int
+
+
+class BookingInfo(BaseModel):
+    patient_id: int
+
+
+class AppointmentInfo(BaseModel):
+    id: int
+    doctor_id: int
+    appointment_time: datetime
+    patient_id: int | None
+
+
+class PatientAppointmentInfo(AppointmentInfo):
+    hospital_id: int
@@ -6,11 +6,13 @@ class LoginInfo(BaseModel):
     password: str
 
     @field_validator("email")
-    def normalize_email(self, v: str) -> str:
+    @classmethod
+    def normalize_email(cls, v: str) -> str:
         return v.lower().strip()
 
     @field_validator("password")
-    def validate_password(self, v: str) -> str:
+    @classmethod
+    def validate_password(cls, v: str) -> str:
         if not v or v.isspace():
             raise ValueError("Password must not be empty")
         if len(v) < 8:
@@ -0,0 +1,51 @@
+from datetime import date, datetime, time
+
+from pydantic import BaseModel
+
+
+class FreeDayInfo(BaseModel):
+    doctor_id: int
+    date: date
+    times: list[time]
+
+
+class FreeSlotsInfo(BaseModel):
+    hospital_id: int
+    start: date
+    end: date
+    days: list[FreeDayInfo]
+
+
+class OpenSlotsInfo(BaseModel):
+    start: date
+    end: date
+    # Every doctor at the hospital when left out
+    doctor_ids: list[int] | None = None
+
+
+class OpenedSlotsInfo(BaseModel):
+    inserted: int
+    skipped: int
+
+
+class EarliestSlotInfo(BaseModel):
+    appointment_id: int
+    doctor_id: int
+    # Local time at the hospital
+    time: datetime
+
+
+class EarliestSlotsInfo(BaseModel):
+    hospital_id: int
+    specialty: str | None
+    slots: list[EarliestSlotInfo]
+
+
+class ConflictInfo(BaseModel):
+    appointment_id: int
+    doctor_id: int
+    patient_id: int
+    # Local time at the hospital
+    time: datetime
+    reason: str
+    detected_at: datetime
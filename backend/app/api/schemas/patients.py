@@ -0,0 +1,8 @@
+from pydantic import BaseModel
+
+
+class PatientInfo(BaseModel):
+    id: int
+    name: str
+    phone: str | None
+    email: str | None
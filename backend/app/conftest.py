@@ -0,0 +1,493 @@
+"""
+Shared pytest fixtures.
+
+Tests run against a throwaway SQLite database file so they don't need the docker
+PostgreSQL service. The sync and async (aiosqlite) engines share that file.
+"""
+
+# pylint: disable=redefined-outer-name
+
+from __future__ import annotations
+
+import fnmatch
+import queue
+import threading
+import time as clock
+from contextlib import AbstractContextManager, contextmanager
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Iterator, cast
+from zoneinfo import ZoneInfo
+
+import bcrypt
+import pytest
+import redis
+from fastapi.testclient import TestClient
+from sqlalchemy import Engine, create_engine, event, insert, select
+from sqlalchemy.ext.asyncio import (
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import NullPool
+
+from app.core.archive import appointment_archive
+from app.core.availability import to_utc
+from app.core.cache import SWAP_SCRIPT, RedisBackend, availability_cache
+from app.core.calendar_versions import calendar_versions
+from app.core.config import settings
+from app.core.database import (
+    ShardMap,
+    get_async_db,
+    get_async_hospital_read_db,
+    get_async_read_db,
+    get_async_shards,
+    get_db,
+    get_hospital_db,
+    get_hospital_read_db,
+    get_read_db,
+)
+from app.core.metrics import registry
+from app.core.patient_index import patient_index
+from app.core.refresh_tokens import refresh_tokens
+from app.core.reservations import (
+    CLAIM_SCRIPT,
+    EXTEND_SCRIPT,
+    RELEASE_SCRIPT,
+    reservations,
+)
+from app.core.security import principal_cache
+from app.core.slot_index import slot_index
+from app.main import app
+from app.models import Appointment, Base, Doctor, Hospital, User, with_profile
+
+
+class FakeRedis:
+    """
+    In-process stand-in for the subset of the redis-py client the app uses, so tests
+    can exercise the Redis backends without a server.
+    """
+
+    def __init__(self) -> None:
+        self.data: dict[str, tuple[float | None, bytes]] = {}
+        # Hashes don't expire here; callers only expire them as a cleanup
+        self.hashes: dict[str, dict[bytes, bytes]] = {}
+        self.subscribers: list[FakePubSub] = []
+        # Scripts run atomically, as on a server
+        self._scripts = threading.Lock()
+
+    @staticmethod
+    def _encode(value: Any) -> bytes:
+        return value if isinstance(value, bytes) else str(value).encode()
+
+    def _live(self, name: str) -> bytes | None:
+        entry = self.data.get(name)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires is not None and expires <= clock.monotonic():
+            del self.data[name]
+            return None
+        return value
+
+    def get(self, name: str) -> bytes | None:
+        return self._live(name)
+
+    def mget(self, names: list[str]) -> list[bytes | None]:
+        return [self._live(name) for name in names]
+
+    def set(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        name: str,
+        value: Any,
+        ex: int | None = None,
+        px: int | None = None,
+        nx: bool = False,
+    ) -> bool | None:
+        if nx and self._live(name) is not None:
+            return None
+        expires = None
+        if ex is not None:
+            expires = clock.monotonic() + ex
+        elif px is not None:
+            expires = clock.monotonic() + px / 1000
+        self.data[name] = (expires, self._encode(value))
+        return True
+
+    def incr(self, name: str) -> int:
+        value = int(self._live(name) or 0) + 1
+        expires = self.data.get(name, (None, b""))[0]
+        self.data[name] = (expires, self._encode(value))
+        return value
+
+    def expire(self, name: str, seconds: int) -> bool:
+        value = self._live(name)
+        if value is None:
+            return name in self.hashes
+        self.data[name] = (clock.monotonic() + seconds, value)
+        return True
+
+    def hset(self, name: str, key: Any, value: Any) -> int:
+        fields = self.hashes.setdefault(name, {})
+        added = self._encode(key) not in fields
+        fields[self._encode(key)] = self._encode(value)
+        return int(added)
+
+    def hdel(self, name: str, *keys: Any) -> int:
+        fields = self.hashes.get(name, {})
+        return sum(fields.pop(self._encode(key), None) is not None for key in keys)
+
+    def hgetall(self, name: str) -> dict[bytes, bytes]:
+        return dict(self.hashes.get(name, {}))
+
+    def delete(self, *names: str) -> int:
+        return sum(
+            (self.data.pop(name, None) or self.hashes.pop(name, None)) is not None
+            for name in names
+        )
+
+    def eval(self, script: str, numkeys: int, *keys_and_args: Any) -> int:
+        """Run one of the app's Lua scripts, recognised by its source."""
+        keys, args = keys_and_args[:numkeys], keys_and_args[numkeys:]
+        with self._scripts:
+            if script == CLAIM_SCRIPT:
+                return self._claim(*keys, *args)
+            if self._live(keys[0]) != self._encode(args[0]):
+                return 0
+            if script == EXTEND_SCRIPT:
+                expires = int(args[2]) + int(args[1])
+                self.hset(keys[1], keys[0], expires)
+                self.data[keys[0]] = (
+                    clock.monotonic() + int(args[1]) / 1000,
+                    self.data[keys[0]][1],
+                )
+                return 1
+            if script == RELEASE_SCRIPT:
+                self.hdel(keys[1], keys[0])
+                return self.delete(keys[0])
+            if script == SWAP_SCRIPT:
+                self.set(keys[0], args[1], ex=int(args[2]))
+                return 1
+        raise NotImplementedError(script)
+
+    def _claim(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self, name: str, claims: str, holder: Any, ttl: str, now: str, limit: str
+    ) -> int:
+        current = self._live(name)
+        if current is not None and current != self._encode(holder):
+            return 0
+        held = 0
+        for key, expires in self.hgetall(claims).items():
+            if int(expires) <= int(now):
+                self.hdel(claims, key)
+            elif key != self._encode(name):
+                held += 1
+        if held >= int(limit):
+            return -1
+        self.set(name, holder, px=int(ttl))
+        self.hset(claims, name, int(now) + int(ttl))
+        return 1
+
+    def scan_iter(self, match: str = "*") -> Iterator[str]:
+        names = [*self.data, *self.hashes]
+        return iter([name for name in names if fnmatch.fnmatch(name, match)])
+
+    def pipeline(self, transaction: bool = True) -> "FakePipeline":
+        # pylint: disable=unused-argument
+        return FakePipeline(self)
+
+    def publish(self, channel: str, message: Any) -> int:
+        receivers = [sub for sub in self.subscribers if channel in sub.channels]
+        for subscriber in receivers:
+            subscriber.messages.put(
+                {"type": "message", "channel": channel, "data": self._encode(message)}
+            )
+        return len(receivers)
+
+    def pubsub(self, ignore_subscribe_messages: bool = False) -> "FakePubSub":
+        # pylint: disable=unused-argument
+        subscriber = FakePubSub()
+        self.subscribers.append(subscriber)
+        return subscriber
+
+
+class FakePubSub:
+    def __init__(self) -> None:
+        self.channels: set[str] = set()
+        self.messages: queue.Queue[dict | Exception] = queue.Queue()
+
+    def subscribe(self, *channels: str) -> None:
+        self.channels.update(channels)
+
+    def get_message(self, timeout: float = 0.0) -> dict | None:
+        try:
+            message = self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        # Tests queue an exception to simulate a dropped connection
+        if isinstance(message, Exception):
+            raise message
+        return message
+
+
+class FakePipeline:
+    def __init__(self, client: FakeRedis) -> None:
+        self.client = client
+        self.calls: list[tuple[str, tuple, dict]] = []
+
+    def __enter__(self) -> "FakePipeline":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.calls.clear()
+
+    def __getattr__(self, name: str) -> Callable[..., "FakePipeline"]:
+        def queue(*args: Any, **kwargs: Any) -> "FakePipeline":
+            self.calls.append((name, args, kwargs))
+            return self
+
+        return queue
+
+    def execute(self) -> list[Any]:
+        calls, self.calls = self.calls, []
+        return [
+            getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in calls
+        ]
+
+
+@pytest.fixture
+def fake_redis() -> FakeRedis:
+    return FakeRedis()
+
+
+@pytest.fixture(autouse=True)
+def refresh_token_redis(monkeypatch: pytest.MonkeyPatch) -> FakeRedis:
+    """Refresh tokens are kept in Redis by default, so tests use a fake one."""
+    client = FakeRedis()
+    backend = RedisBackend(cast(redis.Redis, client), prefix="auth:")
+    monkeypatch.setattr(refresh_tokens, "backend", backend)
+    return client
+
+
+@pytest.fixture(autouse=True)
+def reset_shared_state(  # pylint: disable=unused-argument
+    refresh_token_redis: FakeRedis,
+) -> Iterator[None]:
+    """Every test gets a fresh database, so nothing indexed or cached can carry over."""
+    slot_index.clear()
+    availability_cache.clear()
+    calendar_versions.clear()
+    refresh_tokens.backend.clear()
+    principal_cache.clear()
+    reservations.clear()
+    registry.clear()
+    patient_index.clear()
+    yield
+    slot_index.clear()
+    availability_cache.clear()
+    calendar_versions.clear()
+    refresh_tokens.backend.clear()
+    principal_cache.clear()
+    reservations.clear()
+    registry.clear()
+    patient_index.clear()
+
+
+@pytest.fixture(autouse=True)
+def archive_root(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[Path]:
+    """An empty archive per test, whose watermark is read afresh every time."""
+    root = tmp_path / "archive"
+    monkeypatch.setattr(appointment_archive, "root", root)
+    monkeypatch.setattr(appointment_archive, "watermark_ttl", 0)
+    appointment_archive.clear()
+    yield root
+    appointment_archive.clear()
+
+
+@pytest.fixture
+def database_path(tmp_path: Path) -> Path:
+    return tmp_path / "test.db"
+
+
+@pytest.fixture
+def engine(database_path: Path) -> Iterator[Engine]:
+    engine = create_engine(
+        f"sqlite:///{database_path}", connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def session_factory(engine: Engine) -> sessionmaker:
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+@pytest.fixture
+def async_session_factory(  # pylint: disable=unused-argument
+    engine: Engine, database_path: Path
+) -> async_sessionmaker[AsyncSession]:
+    """Sessions on the same database file; ``engine`` has created the tables."""
+    # Connections aren't pooled, since each TestClient runs its own event loop
+    async_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{database_path}", poolclass=NullPool
+    )
+    return async_sessionmaker(
+        autoflush=False, expire_on_commit=False, bind=async_engine
+    )
+
+
+@pytest.fixture
+def db(session_factory: sessionmaker) -> Iterator[Session]:
+    with session_factory() as session:
+        yield session
+
+
+@pytest.fixture
+def client(
+    session_factory: sessionmaker,
+    async_session_factory: async_sessionmaker[AsyncSession],
+    monkeypatch: pytest.MonkeyPatch,
+) -> Iterator[TestClient]:
+    def override_get_db() -> Iterator[Session]:
+        with session_factory() as session:
+            yield session
+
+    async def override_get_async_db() -> AsyncIterator[AsyncSession]:
+        async with async_session_factory() as session:
+            yield session
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    app.dependency_overrides[get_async_read_db] = override_get_async_db
+    # Everything is on the one test database
+    app.dependency_overrides[get_hospital_db] = override_get_db
+    app.dependency_overrides[get_hospital_read_db] = override_get_db
+    app.dependency_overrides[get_async_hospital_read_db] = override_get_async_db
+    app.dependency_overrides[get_async_shards] = lambda: ShardMap(
+        async_session_factory, []
+    )
+    # The index is built by the first search, from the test database
+    monkeypatch.setattr(settings, "patient_index_warm", False)
+    # Tests come and go, so their objects are left to the collector
+    monkeypatch.setattr(settings, "gc_freeze_at_startup", False)
+    with TestClient(app) as test_client:
+        yield test_client
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def statements() -> Iterator[list[str]]:
+    """Statements run by every engine, including the app's async one."""
+    executed: list[str] = []
+
+    def record(_conn: Any, _cursor: Any, statement: str, *_args: Any) -> None:
+        executed.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", record)
+    yield executed
+    event.remove(Engine, "before_cursor_execute", record)
+
+
+@pytest.fixture
+def query_budget(
+    statements: list[str],
+) -> Callable[[int], AbstractContextManager[list[str]]]:
+    """
+    Fail the test when a block runs more statements than its budget::
+
+        with query_budget(2):
+            client.get(...)
+
+    The block gets the list of statements it ran, filled in when it ends.
+    """
+
+    @contextmanager
+    def _query_budget(limit: int) -> Iterator[list[str]]:
+        ran: list[str] = []
+        start = len(statements)
+        yield ran
+        ran.extend(statements[start:])
+        if len(ran) > limit:
+            pytest.fail(
+                f"{len(ran)} statements over a budget of {limit}:\n" + "\n".join(ran),
+                pytrace=False,
+            )
+
+    return _query_budget
+
+
+@pytest.fixture
+def make_hospital(db: Session) -> Callable[..., Hospital]:
+    """Create a hospital with doctors, and optionally open slots for every day."""
+
+    def _make_hospital(  # pylint: disable=too-many-arguments
+        *,
+        doctors: int = 1,
+        timezone: str = "America/New_York",
+        open_time: time = time(9),
+        close_time: time = time(17),
+        slot_start: date | None = None,
+        slot_days: int = 0,
+    ) -> Hospital:
+        hospital = Hospital(
+            name="Test Hospital",
+            address="1 Test Street",
+            timezone=ZoneInfo(timezone),
+            open_time=open_time,
+            close_time=close_time,
+            doctors=[Doctor(name=f"Doctor {i}") for i in range(doctors)],
+        )
+        db.add(hospital)
+        db.flush()
+
+        if slot_start is not None:
+            rows = [
+                {
+                    "doctor_id": doctor.id,
+                    "hospital_id": hospital.id,
+                    "appointment_time": to_utc(
+                        datetime.combine(slot_start + timedelta(days=day), time(hour)),
+                        hospital.timezone,
+                    ),
+                    "created_by": doctor.id,
+                }
+                for doctor in hospital.doctors
+                for day in range(slot_days)
+                for hour in range(open_time.hour, close_time.hour)
+            ]
+            if rows:
+                db.execute(insert(Appointment), rows)
+        db.commit()
+        # Relationships don't lazy load, so the doctors are loaded again after commit
+        return db.scalars(
+            with_profile(
+                select(Hospital).where(Hospital.id == hospital.id), "hospital roster"
+            )
+        ).one()
+
+    return _make_hospital
+
+
+@pytest.fixture
+def make_user(db: Session) -> Callable[..., User]:
+    """Create a user, hashing the password with a low bcrypt cost to keep tests fast."""
+
+    def _make_user(
+        email: str = "staff@test.com", password: str = "password", **fields: Any
+    ) -> User:
+        user = User(
+            email=email,
+            hashed_password=bcrypt.hashpw(
+                password.encode("utf-8"), bcrypt.gensalt(rounds=4)
+            ).decode("utf-8"),
+            **fields,
+        )
+        db.add(user)
+        db.commit()
+        return user
+
+    return _make_user
@@ -0,0 +1,347 @@
+"""
+Hot/cold archival of past appointments.
+
+Appointments older than ``archive_horizon_days`` are moved out of the
+``appointments`` table into gzip compressed NDJSON segments under ``archive_dir``,
+partitioned by hospital and (UTC) month::
+
+    hospital=12/month=2025-03/1041-58812.ndjson.gz
+
+A run of the archival job
+
+1. copies every appointment still in the table before the new watermark (midnight
+   UTC, the horizon ago), ``archive_batch_size`` rows at a time, one segment per
+   hospital and month in each batch,
+2. publishes the watermark,
+3. waits ``archive_watermark_ttl`` seconds, as long as readers may keep using the
+   previous watermark, and
+4. deletes everything before the watermark from the hot table in batches of the
+   same size. Each batch is locked, and its rows inserted or updated since the copy
+   began are copied again, so nothing changed meanwhile is deleted unarchived.
+
+Reads split at the published watermark: instants before it are served from the
+archive and only the rest is queried, so hot calendar queries stay in the recent
+window. A run that stops part way is finished by the next one. Segments written
+before a crash may be written again under another name, and rows copied again hold
+a later version, so readers keep the latest ``updated_at`` of each appointment id.
+
+Archived appointments are history and aren't expected to change. Nothing is
+published to ``slot_events`` when they leave the table, since calendars read them
+from the archive unchanged.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gzip
+import os
+import tempfile
+import threading
+import time as clock
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from datetime import UTC, datetime, time, timedelta
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Sequence
+
+import orjson
+from sqlalchemy import Select, delete, select, tuple_
+from sqlalchemy.orm import Session
+
+from app.models import Appointment
+
+from .config import settings
+from .database import SessionLocal
+
+WATERMARK_FILE = "watermark.json"
+# Writers' clocks may be this far behind the archival job's
+CLOCK_SKEW = timedelta(minutes=5)
+
+
+@dataclass(frozen=True, slots=True)
+class ArchivedAppointment:  # pylint: disable=too-many-instance-attributes
+    """An appointment as it was when it left the hot table. Times are naive UTC."""
+
+    id: int
+    hospital_id: int
+    doctor_id: int
+    patient_id: int | None
+    appointment_time: datetime
+    created_by: int
+    created_at: datetime
+    updated_at: datetime
+
+    def to_json(self) -> bytes:
+        return orjson.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, line: bytes) -> ArchivedAppointment:
+        fields = orjson.loads(line)
+        for name in ("appointment_time", "created_at", "updated_at"):
+            fields[name] = datetime.fromisoformat(fields[name])
+        return cls(**fields)
+
+
+@dataclass(frozen=True)
+class ArchiveRun:
+    watermark: datetime
+    archived: int
+    deleted: int
+    segments: int
+
+
+def _month(value: datetime) -> str:
+    return f"{value.year:04d}-{value.month:02d}"
+
+
+def month_windows(lower: datetime, upper: datetime) -> list[tuple[datetime, datetime]]:
+    """Split the half open range ``lower``..``upper`` at the start of each month."""
+    windows = []
+    while lower < upper:
+        month_start = datetime(lower.year, lower.month, 1)
+        next_month = (month_start + timedelta(days=32)).replace(day=1)
+        windows.append((lower, min(next_month, upper)))
+        lower = next_month
+    return windows
+
+
+class AppointmentArchive:
+    """
+    Segments of archived appointments in a directory, shared by every worker, and
+    the watermark below which reads are served from them.
+    """
+
+    def __init__(self, root: Path, watermark_ttl: int) -> None:
+        self.root = root
+        self.watermark_ttl = watermark_ttl
+        # (watermark, when it was read), so reads don't stat the file every time
+        self._cached: tuple[datetime | None, float] | None = None
+        self._lock = threading.Lock()
+
+    def partition(self, hospital_id: int, month: str) -> Path:
+        return self.root / f"hospital={hospital_id}" / f"month={month}"
+
+    def read_watermark(self) -> datetime | None:
+        """The published watermark, read from the directory."""
+        try:
+            value = orjson.loads((self.root / WATERMARK_FILE).read_bytes())
+        except FileNotFoundError:
+            return None
+        return datetime.fromisoformat(value["watermark"])
+
+    def watermark(self) -> datetime | None:
+        """
+        The published watermark as last read, at most ``watermark_ttl`` seconds
+        ago. ``None`` until something has been archived.
+        """
+        now = clock.monotonic()
+        with self._lock:
+            if self._cached is None or now >= self._cached[1] + self.watermark_ttl:
+                self._cached = (self.read_watermark(), now)
+            return self._cached[0]
+
+    @staticmethod
+    def _write_atomically(path: Path, data: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(file.name, path)
+
+    def publish(self, watermark: datetime) -> None:
+        self._write_atomically(
+            self.root / WATERMARK_FILE,
+            orjson.dumps({"watermark": watermark.isoformat()}),
+        )
+
+    def write(
+        self, appointments: Sequence[ArchivedAppointment], suffix: str = ""
+    ) -> int:
+        """Write appointments to one new segment per partition; return how many."""
+        partitions: dict[tuple[int, str], list[ArchivedAppointment]] = defaultdict(list)
+        for appointment in appointments:
+            month = _month(appointment.appointment_time)
+            partitions[appointment.hospital_id, month].append(appointment)
+        for (hospital_id, month), rows in partitions.items():
+            ids = [row.id for row in rows]
+            name = f"{min(ids)}-{max(ids)}{suffix}.ndjson.gz"
+            data = b"".join(row.to_json() + b"\n" for row in rows)
+            self._write_atomically(
+                self.partition(hospital_id, month) / name,
+                gzip.compress(data, compresslevel=6),
+            )
+        return len(partitions)
+
+    def _segment_rows(
+        self, hospital_id: int, lower: datetime, upper: datetime
+    ) -> Iterator[ArchivedAppointment]:
+        """Every row of a hospital's segments in the months ``lower``..``upper``."""
+        for start, _ in month_windows(lower, upper):
+            partition = self.partition(hospital_id, _month(start))
+            for path in sorted(partition.glob("*.gz")):
+                for line in gzip.decompress(path.read_bytes()).splitlines():
+                    yield ArchivedAppointment.from_json(line)
+
+    def read(
+        self,
+        hospital_ids: Iterable[int],
+        lower: datetime,
+        upper: datetime,
+        doctor_ids: Iterable[int] | None = None,
+    ) -> list[ArchivedAppointment]:
+        """
+        Archived appointments of the hospitals from naive UTC ``lower`` up to
+        ``upper``, optionally only the given doctors', by doctor and time.
+        """
+        doctors = None if doctor_ids is None else set(doctor_ids)
+        found: dict[int, ArchivedAppointment] = {}
+        for hospital_id in set(hospital_ids):
+            for row in self._segment_rows(hospital_id, lower, upper):
+                if lower <= row.appointment_time < upper and (
+                    doctors is None or row.doctor_id in doctors
+                ):
+                    seen = found.get(row.id)
+                    if seen is None or seen.updated_at <= row.updated_at:
+                        found[row.id] = row
+        return sorted(found.values(), key=lambda r: (r.doctor_id, r.appointment_time))
+
+    async def read_async(
+        self,
+        hospital_ids: Iterable[int],
+        lower: datetime,
+        upper: datetime,
+        doctor_ids: Iterable[int] | None = None,
+    ) -> list[ArchivedAppointment]:
+        """``read`` in a worker thread, so the event loop isn't blocked on files."""
+        return await asyncio.to_thread(
+            self.read, list(hospital_ids), lower, upper, doctor_ids
+        )
+
+    def clear(self) -> None:
+        """Forget the cached watermark."""
+        with self._lock:
+            self._cached = None
+
+
+def _archived_rows(upper: datetime) -> Select:
+    """The appointments before ``upper``, with the columns archived."""
+    return select(
+        Appointment.id,
+        Appointment.hospital_id,
+        Appointment.doctor_id,
+        Appointment.patient_id,
+        Appointment.appointment_time,
+        Appointment.created_by,
+        Appointment.created_at,
+        Appointment.updated_at,
+    ).where(Appointment.appointment_time < upper)
+
+
+def _copy(
+    db: Session, archive: AppointmentArchive, upper: datetime, batch_size: int
+) -> tuple[int, int]:
+    """Copy the appointments before ``upper`` into the archive."""
+    order = (
+        Appointment.hospital_id,
+        Appointment.doctor_id,
+        Appointment.appointment_time,
+    )
+    query = _archived_rows(upper).order_by(*order).limit(batch_size)
+
+    archived = segments = 0
+    after: tuple[Any, ...] | None = None
+    while True:
+        batch = query if after is None else query.where(tuple_(*order) > after)
+        rows = [ArchivedAppointment(*row) for row in db.execute(batch)]
+        if not rows:
+            return archived, segments
+        segments += archive.write(rows)
+        archived += len(rows)
+        last = rows[-1]
+        after = (last.hospital_id, last.doctor_id, last.appointment_time)
+
+
+def _purge(
+    db: Session,
+    archive: AppointmentArchive,
+    upper: datetime,
+    since: datetime,
+    batch_size: int,
+) -> tuple[int, int]:
+    """
+    Delete the appointments before ``upper`` from the hot table in batches. Rows
+    updated from ``since`` (naive UTC) on may have changed after they were copied, so
+    they're copied again, while locked, in the transaction that deletes them.
+    """
+    deleted = segments = 0
+    query = (
+        _archived_rows(upper)
+        .order_by(Appointment.doctor_id, Appointment.appointment_time)
+        .limit(batch_size)
+        .with_for_update()
+    )
+    while True:
+        rows = [ArchivedAppointment(*row) for row in db.execute(query)]
+        if not rows:
+            return deleted, segments
+        changed = [row for row in rows if row.updated_at >= since]
+        if changed:
+            # Named apart from the segments they may share their first and last id with
+            segments += archive.write(changed, suffix="-changed")
+        db.execute(delete(Appointment).where(Appointment.id.in_([r.id for r in rows])))
+        db.commit()
+        deleted += len(rows)
+
+
+def archive_appointments(
+    db: Session,
+    archive: AppointmentArchive,
+    horizon_days: int,
+    batch_size: int,
+    now: datetime | None = None,
+) -> ArchiveRun:
+    """Move the appointments older than the horizon into the archive."""
+    now = now or datetime.now(UTC).replace(tzinfo=None)
+    watermark = datetime.combine((now - timedelta(days=horizon_days)).date(), time())
+    previous = archive.read_watermark()
+    if previous is not None:
+        watermark = max(watermark, previous)
+    since = datetime.now(UTC).replace(tzinfo=None) - CLOCK_SKEW
+    # Everything below the watermark still in the table, which after a complete run
+    # is just what the watermark moved past
+    archived, segments = _copy(db, archive, watermark, batch_size)
+    db.rollback()
+    if watermark != previous:
+        archive.publish(watermark)
+        # Readers still on the previous watermark query the hot table below this one
+        clock.sleep(archive.watermark_ttl)
+    deleted, copied_again = _purge(db, archive, watermark, since, batch_size)
+    return ArchiveRun(watermark, archived, deleted, segments + copied_again)
+
+
+appointment_archive = AppointmentArchive(
+    Path(settings.archive_dir), settings.archive_watermark_ttl
+)
+
+
+def main(argv: Sequence[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Move past appointments into the archive."
+    )
+    parser.add_argument(
+        "--horizon-days", type=int, default=settings.archive_horizon_days
+    )
+    parser.add_argument("--batch-size", type=int, default=settings.archive_batch_size)
+    args = parser.parse_args(argv)
+
+    with SessionLocal() as db:
+        run = archive_appointments(
+            db, appointment_archive, args.horizon_days, args.batch_size
+        )
+    print(run)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,16 @@
 from __future__ import annotations
 
 from datetime import datetime, timedelta
+from uuid import uuid4
 from zoneinfo import ZoneInfo
 
 import bcrypt
 import jwt
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
+from app.core.hashing import password_hasher
 from app.models.users import User
 
 """
@@ -24,15 +27,21 @@ Authentication and authorization utilities.
      automatically by the frontend when API calls return 401 errors by calling 
      the /refresh endpoint. If the refresh token is expired or invalid, the user 
      must log in again.
-     - Store the hashed refresh token in the database for validation
-  5. Security: Refresh tokens are hashed before database storage and rotated on use
+     - Store a keyed digest of the refresh token for validation (see
+       app.core.refresh_tokens)
+  5. Security: Refresh tokens are digested before storage and rotated on use
 """
 
 
-def authenticate_user(db: Session, email: str, password: str) -> None | User:
+async def authenticate_user(db: AsyncSession, email: str, password: str) -> None | User:
     """Validate credentials and return user object if valid."""
-    user = db.query(User).filter(User.email == email).first()
-    if user is None or not verify_password(password, user.hashed_password):
+    result = await db.execute(select(User).where(User.email == email))
+    user = result.scalars().first()
+    # bcrypt is deliberately slow, keep it off the event loop. Raises HasherBusy
+    # when too many checks are already waiting.
+    if user is None or not await password_hasher.run(
+        verify_password, password, user.hashed_password
+    ):
         return None
     return user
 
@@ -47,12 +56,21 @@ def create_jwt_token(user_id: str, email: str) -> str:
     return jwt.encode(payload, settings.secret_key, algorithm=settings.algorithm)
 
 
-def create_refresh_token(user_id: str, email: str) -> str:
-    """Generate a refresh token for authenticated user."""
+def create_refresh_token(user_id: str, email: str, family: str) -> str:
+    """Generate a refresh token for authenticated user, as part of a token family."""
     now = datetime.now(ZoneInfo("UTC"))
     expire = now + timedelta(days=settings.refresh_token_expire_days)
 
-    payload = {"sub": user_id, "email": email, "iat": now, "exp": expire}
+    payload = {
+        "sub": user_id,
+        "email": email,
+        "fam": family,
+        # Unique per token, so rotating twice within a second gives distinct tokens
+        "jti": uuid4().hex,
+        # To the microsecond, to compare with the store's revocation cutoffs
+        "iat": now.timestamp(),
+        "exp": expire,
+    }
 
     return jwt.encode(payload, settings.secret_key, algorithm=settings.algorithm)
 
@@ -68,28 +86,6 @@ def verify_jwt_token(token: str) -> dict | None:
         return None
 
 
-def verify_refresh_token(db: Session, token: str) -> dict | None:
-    """Verify the provided refresh token."""
-    try:
-        payload: dict = jwt.decode(
-            token, settings.secret_key, algorithms=[settings.algorithm]
-        )
-        # Check if token exists in database and is not revoked
-        user = db.query(User).filter(User.id == payload.get("sub")).first()
-        if (
-            user is None
-            or user.refresh_token_hash is None  # Revoked or never logged in
-            or not bcrypt.checkpw(
-                token.encode("utf-8"), user.refresh_token_hash.encode("utf-8")
-            )
-        ):
-            return None
-
-        return payload
-    except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
-        return None
-
-
 def hash_password(password: str) -> str:
     """Hash a plaintext password for secure storage."""
     salt = bcrypt.gensalt()
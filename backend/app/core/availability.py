@@ -0,0 +1,298 @@
+"""
+Calendar and availability lookups for doctors.
+
+Appointments are stored as naive UTC datetimes. Each appointment row is a one hour
+slot: rows without a patient are open (bookable) slots and rows with a patient are
+booked. Hospitals keep their hours and timezone, so a calendar is built by converting
+each slot back to the hospital's local time.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from datetime import UTC, date, datetime, time, timedelta
+from typing import Iterable, Sequence
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import ColumnElement, Row, Select, and_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.models import Appointment, Doctor, Hospital
+
+from .archive import ArchivedAppointment, appointment_archive
+from .timezones import local_times, slot_grid
+
+SLOT_DURATION = timedelta(hours=1)
+
+# UTC offsets in use range from -12:00 to +14:00, so these bound the UTC instants
+# that can fall on a given local date in any timezone.
+MAX_UTC_OFFSET = timedelta(hours=14)
+MIN_UTC_OFFSET = timedelta(hours=-12)
+
+
+@dataclass(slots=True)
+class CalendarSlot:
+    """A single one hour slot on a doctor's calendar, in local time."""
+
+    appointment_id: int
+    time: time
+    bookable: bool
+    patient_id: int | None = None
+    # Open but held by someone part way through booking it
+    reserved: bool = False
+
+
+@dataclass(slots=True)
+class CalendarDay:
+    """All the slots for one doctor on one local date."""
+
+    doctor_id: int
+    date: date
+    slots: list[CalendarSlot] = field(default_factory=list)
+
+
+def to_local(value: datetime, tz: ZoneInfo) -> datetime:
+    """Convert a naive UTC datetime into a naive datetime in the given timezone."""
+    return tz.fromutc(value.replace(tzinfo=tz)).replace(tzinfo=None)
+
+
+def to_utc(value: datetime, tz: ZoneInfo) -> datetime:
+    """Convert a naive local datetime in the given timezone into a naive UTC one."""
+    return value.replace(tzinfo=tz).astimezone(UTC).replace(tzinfo=None)
+
+
+def utc_window(start: date, end: date) -> tuple[datetime, datetime]:
+    """
+    Return the half open UTC range covering the local dates ``start``..``end``
+    (inclusive) in every timezone. Rows are narrowed to their local date after the
+    hospital's timezone is known.
+    """
+    lower = datetime.combine(start, time()) - MAX_UTC_OFFSET
+    upper = datetime.combine(end + timedelta(days=1), time()) - MIN_UTC_OFFSET
+    return lower, upper
+
+
+def date_range(start: date, end: date) -> list[date]:
+    """Every date from ``start`` to ``end`` inclusive."""
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def date_range_error(start: date, end: date, max_days: int) -> str | None:
+    """Why the local dates ``start``..``end`` can't be served, or ``None``."""
+    if end < start:
+        return "End date is before start date"
+    if (end - start).days + 1 > max_days:
+        return f"Date range is limited to {max_days} days"
+    return None
+
+
+def opening_hours(
+    tz: ZoneInfo, open_time: time, close_time: time, start: date, end: date
+) -> list[datetime]:
+    """
+    Naive UTC start times of every opening hour on the local dates ``start``..``end``
+    (inclusive).
+    """
+    hours: list[datetime] = slot_grid(tz, open_time, close_time, start, end).tolist()
+    return hours
+
+
+def slots_query(
+    doctor_filter: ColumnElement[bool],
+    start: date,
+    end: date,
+    since: datetime | None = None,
+) -> Select:
+    """
+    Select the doctors matching ``doctor_filter`` with their hospital's timezone and
+    any slots that could fall on the local dates ``start``..``end`` (inclusive),
+    leaving out those before the naive UTC instant ``since``.
+
+    Doctors are outer joined to their appointments so a doctor without any slots in
+    the range still returns a row carrying the hospital timezone. The appointment join
+    is an equality on ``doctor_id`` plus a range on ``appointment_time``, which is
+    answered by ``idx_unique_doctor_timeslot``.
+    """
+    lower, upper = utc_window(start, end)
+    if since is not None:
+        lower = max(lower, since)
+    return (
+        select(
+            Doctor.id,
+            Hospital.timezone,
+            Appointment.id,
+            Appointment.appointment_time,
+            Appointment.patient_id,
+        )
+        .join(Hospital, Doctor.hospital_id == Hospital.id)
+        .outerjoin(
+            Appointment,
+            and_(
+                Appointment.doctor_id == Doctor.id,
+                # Implied by the doctor, but lets a partitioned table be pruned
+                Appointment.hospital_id == Doctor.hospital_id,
+                Appointment.appointment_time >= lower,
+                Appointment.appointment_time < upper,
+            ),
+        )
+        .where(doctor_filter)
+        .order_by(Doctor.id, Appointment.appointment_time)
+    )
+
+
+def calendar_query(
+    doctor_ids: Sequence[int], start: date, end: date, since: datetime | None = None
+) -> Select:
+    """Build the single statement that backs a multi-doctor calendar."""
+    return slots_query(Doctor.id.in_(doctor_ids), start, end, since)
+
+
+def hospitals_query(doctor_ids: Sequence[int]) -> Select:
+    """The hospital of each doctor, to find their archive partitions."""
+    return select(Doctor.hospital_id).where(Doctor.id.in_(doctor_ids)).distinct()
+
+
+def with_archived(
+    rows: Iterable[Row], archived: Iterable[ArchivedAppointment]
+) -> list[tuple]:
+    """
+    Put archived slots in front of the rows of a ``calendar_query`` limited to the
+    instants after them, in the same shape.
+    """
+    rows = list(rows)
+    zones = {row[0]: row[1] for row in rows}
+    return [
+        (
+            slot.doctor_id,
+            zones[slot.doctor_id],
+            slot.id,
+            slot.appointment_time,
+            slot.patient_id,
+        )
+        for slot in archived
+        if slot.doctor_id in zones
+    ] + [tuple(row) for row in rows]
+
+
+def build_calendar(
+    rows: Iterable[Sequence],
+    start: date,
+    end: date,
+    zones: dict[int, ZoneInfo] | None = None,
+) -> list[CalendarDay]:
+    """
+    Turn the rows of ``calendar_query`` into a dense calendar of slots for every
+    doctor and every local date in ``start``..``end`` (inclusive).
+
+    When ``zones`` is given it is updated with each doctor's timezone.
+    """
+    rows = list(rows)
+    locals_ = local_times([(row[1], row[3]) for row in rows])
+    days: dict[int, dict[date, CalendarDay]] = {}
+    for (doctor_id, tz, appointment_id, _, patient_id), local in zip(rows, locals_):
+        if doctor_id not in days:
+            if zones is not None:
+                zones[doctor_id] = tz
+            days[doctor_id] = {
+                day: CalendarDay(doctor_id=doctor_id, date=day)
+                for day in date_range(start, end)
+            }
+        if appointment_id is None or local is None:
+            continue
+
+        if start <= local.date() <= end:
+            days[doctor_id][local.date()].slots.append(
+                CalendarSlot(
+                    appointment_id=appointment_id,
+                    time=local.time(),
+                    bookable=patient_id is None,
+                    patient_id=patient_id,
+                )
+            )
+
+    return [day for doctor_days in days.values() for day in doctor_days.values()]
+
+
+def get_calendar(
+    db: Session,
+    doctor_ids: Iterable[int],
+    start: date,
+    end: date,
+    zones: dict[int, ZoneInfo] | None = None,
+) -> list[CalendarDay]:
+    """
+    Return the calendar of every requested doctor over ``start``..``end``
+    (inclusive), using one round trip to the database.
+
+    Doctors that do not exist are left out of the result. Slots before the archive
+    watermark are read from the archive, with one more round trip.
+    """
+    ids = sorted(set(doctor_ids))
+    if not ids:
+        return []
+    lower, upper = utc_window(start, end)
+    watermark = appointment_archive.watermark()
+    if watermark is None or lower >= watermark:
+        return build_calendar(
+            db.execute(calendar_query(ids, start, end)), start, end, zones
+        )
+    rows = db.execute(calendar_query(ids, start, end, since=watermark))
+    hospital_ids = db.scalars(hospitals_query(ids)).all()
+    archived = appointment_archive.read(hospital_ids, lower, min(upper, watermark), ids)
+    return build_calendar(with_archived(rows, archived), start, end, zones)
+
+
+async def get_calendar_async(
+    db: AsyncSession,
+    doctor_ids: Iterable[int],
+    start: date,
+    end: date,
+    zones: dict[int, ZoneInfo] | None = None,
+) -> list[CalendarDay]:
+    """Async version of ``get_calendar``."""
+    ids = sorted(set(doctor_ids))
+    if not ids:
+        return []
+    lower, upper = utc_window(start, end)
+    watermark = appointment_archive.watermark()
+    if watermark is None or lower >= watermark:
+        result = await db.execute(calendar_query(ids, start, end))
+        return build_calendar(result, start, end, zones)
+    result = await db.execute(calendar_query(ids, start, end, since=watermark))
+    hospital_ids = (await db.scalars(hospitals_query(ids))).all()
+    archived = await appointment_archive.read_async(
+        hospital_ids, lower, min(upper, watermark), ids
+    )
+    return build_calendar(with_archived(result, archived), start, end, zones)
+
+
+def pack_day(day: CalendarDay, patients: bool = True) -> dict:
+    """
+    A calendar day in the compact columnar form: slot start times as minutes after
+    local midnight and appointment ids as parallel lists, bit ``i`` of ``booked`` and
+    ``reserved`` for slot ``i``, and the patients of the booked slots in order (left
+    empty unless ``patients``).
+    """
+    times = []
+    ids = []
+    patient_ids = []
+    booked = reserved = 0
+    for i, slot in enumerate(day.slots):
+        times.append(slot.time.hour * 60 + slot.time.minute)
+        ids.append(slot.appointment_id)
+        if slot.patient_id is not None:
+            booked |= 1 << i
+            if patients:
+                patient_ids.append(slot.patient_id)
+        if slot.reserved:
+            reserved |= 1 << i
+    return {
+        "doctor_id": day.doctor_id,
+        "date": day.date,
+        "times": times,
+        "ids": ids,
+        "booked": booked,
+        "reserved": reserved,
+        "patient_ids": patient_ids,
+    }
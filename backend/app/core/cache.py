@@ -0,0 +1,358 @@
+"""
+Read-through caching for availability lookups.
+
+Calendars are cached per doctor and local date, so booking one slot only invalidates
+that doctor's day. Entries live in a pluggable backend: an in-process LRU store for a
+single worker, or Redis when several workers need to share (and invalidate) entries.
+Every entry also has a TTL, which bounds how long a reader that raced a write can keep
+serving what it read.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time as clock
+from collections import OrderedDict
+from datetime import date, time
+from typing import Iterable, Protocol, Sequence
+from zoneinfo import ZoneInfo
+
+import redis
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .availability import (
+    MAX_UTC_OFFSET,
+    MIN_UTC_OFFSET,
+    CalendarDay,
+    CalendarSlot,
+    date_range,
+    get_calendar,
+    get_calendar_async,
+    to_local,
+)
+from .config import settings
+from .slot_events import SlotChange, on_slot_changes
+
+logger = logging.getLogger(__name__)
+
+# Replace the key's value only while it still holds the expected one
+SWAP_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    redis.call("set", KEYS[1], ARGV[2], "EX", ARGV[3])
+    return 1
+end
+return 0
+"""
+
+
+class CacheBackend(Protocol):
+    """Minimal key/value interface the caches need from a store."""
+
+    def get_many(self, keys: Sequence[str]) -> dict[str, bytes]: ...
+
+    def set_many(self, items: dict[str, bytes], ttl: int) -> None: ...
+
+    def delete_many(self, keys: Iterable[str]) -> None: ...
+
+    def swap(self, key: str, expected: bytes, value: bytes, ttl: int) -> bool: ...
+
+    def clear(self) -> None: ...
+
+
+def redis_client() -> redis.Redis:
+    """A client for ``redis_url`` that gives up on a stalled server."""
+    return redis.Redis.from_url(
+        settings.redis_url,
+        socket_timeout=settings.redis_socket_timeout,
+        socket_connect_timeout=settings.redis_socket_timeout,
+    )
+
+
+class MemoryBackend:
+    """In-process store with LRU eviction and per-entry expiry."""
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: Sequence[str]) -> dict[str, bytes]:
+        now = clock.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                expires, value = entry
+                if expires <= now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = value
+        return found
+
+    def set_many(self, items: dict[str, bytes], ttl: int) -> None:
+        expires = clock.monotonic() + ttl
+        with self._lock:
+            for key, value in items.items():
+                self._entries[key] = (expires, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete_many(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def swap(self, key: str, expected: bytes, value: bytes, ttl: int) -> bool:
+        """Replace a live entry only while its value is still ``expected``."""
+        now = clock.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now or entry[1] != expected:
+                return False
+            self._entries[key] = (now + ttl, value)
+            self._entries.move_to_end(key)
+            return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisBackend:
+    """
+    Store shared by every worker. Redis evicts by TTL (and by its own LRU policy when
+    ``maxmemory`` is set). Errors are logged and treated as misses, since the database
+    can always answer instead.
+    """
+
+    def __init__(self, client: redis.Redis, prefix: str = "cache:") -> None:
+        self.client = client
+        self.prefix = prefix
+
+    def get_many(self, keys: Sequence[str]) -> dict[str, bytes]:
+        if not keys:
+            return {}
+        try:
+            values: list[bytes | None] = self.client.mget(  # type: ignore[assignment]
+                [self.prefix + key for key in keys]
+            )
+        except redis.RedisError:
+            logger.warning("Cache read failed", exc_info=True)
+            return {}
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, items: dict[str, bytes], ttl: int) -> None:
+        if not items:
+            return
+        try:
+            with self.client.pipeline(transaction=False) as pipe:
+                for key, value in items.items():
+                    pipe.set(self.prefix + key, value, ex=ttl)
+                pipe.execute()
+        except redis.RedisError:
+            logger.warning("Cache write failed", exc_info=True)
+
+    def delete_many(self, keys: Iterable[str]) -> None:
+        names = [self.prefix + key for key in keys]
+        if not names:
+            return
+        try:
+            self.client.delete(*names)
+        except redis.RedisError:
+            logger.warning("Cache invalidation failed", exc_info=True)
+
+    def swap(self, key: str, expected: bytes, value: bytes, ttl: int) -> bool:
+        """Replace a key only while its value is still ``expected``, atomically."""
+        try:
+            swapped = self.client.eval(
+                SWAP_SCRIPT,
+                1,
+                self.prefix + key,
+                expected,  # type: ignore[arg-type]
+                value,  # type: ignore[arg-type]
+                str(ttl),
+            )
+        except redis.RedisError:
+            logger.warning("Cache swap failed", exc_info=True)
+            return False
+        return bool(swapped)
+
+    def clear(self) -> None:
+        try:
+            names = list(self.client.scan_iter(match=self.prefix + "*"))
+            if names:
+                self.client.delete(*names)
+        except redis.RedisError:
+            logger.warning("Cache clear failed", exc_info=True)
+
+
+def make_backend(kind: str, max_entries: int, prefix: str = "cache:") -> CacheBackend:
+    """Build the backend named in the settings."""
+    if kind == "redis":
+        return RedisBackend(redis_client(), prefix=prefix)
+    if kind == "memory":
+        return MemoryBackend(max_entries)
+    raise ValueError(f"Unknown cache backend: {kind}")
+
+
+def _encode_day(day: CalendarDay) -> bytes:
+    return json.dumps(
+        [
+            [slot.appointment_id, slot.time.isoformat(), slot.patient_id]
+            for slot in day.slots
+        ],
+        separators=(",", ":"),
+    ).encode()
+
+
+def _decode_day(doctor_id: int, day: date, value: bytes) -> CalendarDay:
+    return CalendarDay(
+        doctor_id=doctor_id,
+        date=day,
+        slots=[
+            CalendarSlot(
+                appointment_id=appointment_id,
+                time=time.fromisoformat(slot_time),
+                bookable=patient_id is None,
+                patient_id=patient_id,
+            )
+            for appointment_id, slot_time, patient_id in json.loads(value)
+        ],
+    )
+
+
+class AvailabilityCache:
+    """Read-through cache of calendar days keyed by (doctor_id, local date)."""
+
+    def __init__(self, backend: CacheBackend, ttl: int) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        # Doctors don't change hospitals, so their timezone can be remembered to turn
+        # a changed slot back into the local date it was cached under.
+        self._zones: dict[int, ZoneInfo] = {}
+
+    @staticmethod
+    def key(doctor_id: int, day: date) -> str:
+        return f"availability:{doctor_id}:{day.isoformat()}"
+
+    def _lookup(
+        self, doctor_ids: Iterable[int], start: date, end: date
+    ) -> tuple[list[tuple[int, date]], dict[str, bytes]]:
+        """Return every wanted (doctor_id, date) and the entries already cached."""
+        wanted = [
+            (doctor_id, day)
+            for doctor_id in sorted(set(doctor_ids))
+            for day in date_range(start, end)
+        ]
+        return wanted, self.backend.get_many([self.key(*pair) for pair in wanted])
+
+    def _missing(
+        self, wanted: list[tuple[int, date]], cached: dict[str, bytes]
+    ) -> tuple[list[tuple[int, date]], set[int], date, date] | None:
+        """Return the missing pairs plus the doctors and dates to load them with."""
+        missing = [pair for pair in wanted if self.key(*pair) not in cached]
+        if not missing:
+            return None
+        return (
+            missing,
+            {doctor_id for doctor_id, _ in missing},
+            min(day for _, day in missing),
+            max(day for _, day in missing),
+        )
+
+    def _store(
+        self, missing: list[tuple[int, date]], calendar: list[CalendarDay]
+    ) -> dict[tuple[int, date], CalendarDay]:
+        loaded = {(day.doctor_id, day.date): day for day in calendar}
+        self.backend.set_many(
+            {
+                self.key(*pair): _encode_day(loaded[pair])
+                for pair in missing
+                if pair in loaded
+            },
+            self.ttl,
+        )
+        return loaded
+
+    def _assemble(
+        self,
+        wanted: list[tuple[int, date]],
+        cached: dict[str, bytes],
+        loaded: dict[tuple[int, date], CalendarDay],
+    ) -> list[CalendarDay]:
+        days = []
+        for doctor_id, day in wanted:
+            value = cached.get(self.key(doctor_id, day))
+            if value is not None:
+                days.append(_decode_day(doctor_id, day, value))
+            elif (doctor_id, day) in loaded:
+                days.append(loaded[(doctor_id, day)])
+        return days
+
+    def get_calendar(
+        self, db: Session, doctor_ids: Iterable[int], start: date, end: date
+    ) -> list[CalendarDay]:
+        """
+        Same result as ``get_calendar``. Only the doctors with missing days are
+        loaded from the database, with one query covering their missing dates.
+        """
+        wanted, cached = self._lookup(doctor_ids, start, end)
+        loaded = {}
+        if missing := self._missing(wanted, cached):
+            pairs, ids, first, last = missing
+            calendar = get_calendar(db, ids, first, last, zones=self._zones)
+            loaded = self._store(pairs, calendar)
+        return self._assemble(wanted, cached, loaded)
+
+    async def get_calendar_async(
+        self, db: AsyncSession, doctor_ids: Iterable[int], start: date, end: date
+    ) -> list[CalendarDay]:
+        """
+        Async version of ``get_calendar``. Only the database load is awaited; cache
+        round trips are short enough to stay inline.
+        """
+        wanted, cached = self._lookup(doctor_ids, start, end)
+        loaded = {}
+        if missing := self._missing(wanted, cached):
+            pairs, ids, first, last = missing
+            calendar = await get_calendar_async(db, ids, first, last, zones=self._zones)
+            loaded = self._store(pairs, calendar)
+        return self._assemble(wanted, cached, loaded)
+
+    def affected_keys(self, change: SlotChange) -> list[str]:
+        """The cache keys a slot change can make stale."""
+        tz = self._zones.get(change.doctor_id)
+        if tz is not None:
+            days = [to_local(change.appointment_time, tz).date()]
+        else:
+            # Without the doctor's timezone, drop every local date the instant can
+            # fall on anywhere.
+            days = date_range(
+                (change.appointment_time + MIN_UTC_OFFSET).date(),
+                (change.appointment_time + MAX_UTC_OFFSET).date(),
+            )
+        return [self.key(change.doctor_id, day) for day in days]
+
+    def invalidate(self, changes: Iterable[SlotChange]) -> None:
+        keys = {key for change in changes for key in self.affected_keys(change)}
+        self.backend.delete_many(keys)
+
+    def clear(self) -> None:
+        self.backend.clear()
+        self._zones.clear()
+
+
+availability_cache = AvailabilityCache(
+    make_backend(
+        settings.availability_cache_backend, settings.availability_cache_max_entries
+    ),
+    ttl=settings.availability_cache_ttl,
+)
+on_slot_changes(availability_cache.invalidate)
@@ -0,0 +1,371 @@
+"""
+Version counters behind calendar ETags.
+
+Every (doctor, local date) has a counter that is bumped whenever one of its slots is
+inserted, updated or deleted (see ``app.core.slot_events``), plus the set of its
+slots that are reserved. A calendar's ETag is a hash of those for the days it shows,
+so a repeated poll can be answered with 304 Not Modified without touching
+appointments. Reservations lapse without anything being written, so they are kept
+with their expiry times and only the live ones are hashed.
+
+Like the availability cache, a change is applied to every local date its instant can
+fall on, since the doctor's timezone isn't known here. Bumping a date that didn't
+change only costs one extra full response.
+
+Two things can make a calendar disagree with its counters for a while:
+
+- A replica may still serve what a day held before a change, so calendars with days
+  changed less than ``read_your_writes_seconds`` ago get no ETag.
+- A calendar cached from a lagging replica can outlive the lag by up to
+  ``availability_cache_ttl``, so days hash differently during that time than after,
+  and such calendars are revalidated once more when it ends.
+
+Counters are kept by a pluggable backend: in-process for a single worker, or Redis
+so every worker sees the same counters. Redis is the default as soon as the cache or
+the reservations are kept there, and in-process tags are reissued as often as the
+availability cache expires, so a worker that missed a change stops answering 304
+when its cached calendars would have been reloaded anyway.
+
+Redis forgets a counter ``ttl`` seconds after its last change, and tags include the
+``ttl`` period they were issued in, so a forgotten counter can't match an older tag. A failed read only costs the ETag; a
+failed write is logged, and tags stop matching at the end of the period.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import math
+import secrets
+import threading
+import time as clock
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Iterable, Protocol, Sequence
+
+import redis
+
+from .availability import MAX_UTC_OFFSET, MIN_UTC_OFFSET, date_range
+from .cache import redis_client
+from .config import settings
+from .slot_events import SlotChange, on_slot_changes
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class DayVersion:
+    """What the ETag of a calendar day depends on."""
+
+    version: int = 0
+    # Wall clock time of the last change, 0 when never changed
+    changed_at: float = 0.0
+    # Appointment ids of the live reservations
+    held: list[int] = field(default_factory=list)
+
+
+class VersionBackend(Protocol):
+    """Counters, change times and reservations per key."""
+
+    # Identifies the counters; changes whenever counters may have been lost
+    epoch: str
+
+    def bump(self, keys: Sequence[str], now: float) -> None: ...
+
+    def hold(self, keys: Sequence[str], appointment_id: int, until: float) -> None: ...
+
+    def unhold(self, keys: Sequence[str], appointment_id: int) -> None: ...
+
+    def read(self, keys: Sequence[str], now: float) -> list[DayVersion] | None: ...
+
+    def clear(self) -> None: ...
+
+
+@dataclass(slots=True)
+class _Day:
+    version: int = 0
+    changed_at: float = 0.0
+    # Reservation expiry times by appointment id
+    held: dict[int, float] = field(default_factory=dict)
+
+
+class MemoryVersions:
+    """
+    In-process counters for a single worker, evicting the least recently changed
+    beyond ``max_entries``. Losing a counter would let it repeat an old value, so
+    an eviction changes the epoch instead, which invalidates every tag once.
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.epoch = secrets.token_hex(8)
+        self._days: OrderedDict[str, _Day] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _touch(self, keys: Sequence[str]) -> list[_Day]:
+        days = []
+        for key in keys:
+            days.append(self._days.setdefault(key, _Day()))
+            self._days.move_to_end(key)
+        if len(self._days) > self.max_entries:
+            while len(self._days) > self.max_entries:
+                self._days.popitem(last=False)
+            self.epoch = secrets.token_hex(8)
+        return days
+
+    def bump(self, keys: Sequence[str], now: float) -> None:
+        with self._lock:
+            for day in self._touch(keys):
+                day.version += 1
+                day.changed_at = now
+
+    def hold(self, keys: Sequence[str], appointment_id: int, until: float) -> None:
+        with self._lock:
+            for day in self._touch(keys):
+                day.held[appointment_id] = until
+
+    def unhold(self, keys: Sequence[str], appointment_id: int) -> None:
+        with self._lock:
+            for key in keys:
+                if key in self._days:
+                    self._days[key].held.pop(appointment_id, None)
+
+    def read(self, keys: Sequence[str], now: float) -> list[DayVersion] | None:
+        found = []
+        with self._lock:
+            for key in keys:
+                day = self._days.get(key)
+                if day is None:
+                    found.append(DayVersion())
+                    continue
+                # Lapsed reservations are dropped as they're seen
+                for lapsed in [i for i, until in day.held.items() if until <= now]:
+                    del day.held[lapsed]
+                found.append(DayVersion(day.version, day.changed_at, sorted(day.held)))
+        return found
+
+    def clear(self) -> None:
+        with self._lock:
+            self._days.clear()
+            self.epoch = secrets.token_hex(8)
+
+
+class RedisVersions:
+    """
+    Counters shared by every worker. Each day has a counter, the time of its last
+    change and a hash of reservation expiry times, all expiring once they no longer
+    matter. Reads take one round trip.
+    """
+
+    epoch = "redis"
+
+    def __init__(
+        self, client: redis.Redis, ttl: int, prefix: str = "calendar-version:"
+    ) -> None:
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def bump(self, keys: Sequence[str], now: float) -> None:
+        try:
+            with self.client.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.incr(self.prefix + key)
+                    pipe.expire(self.prefix + key, self.ttl)
+                    pipe.set(self.prefix + key + ":changed", repr(now), ex=self.ttl)
+                pipe.execute()
+        except redis.RedisError:
+            logger.warning("Calendar version bump failed", exc_info=True)
+
+    def hold(self, keys: Sequence[str], appointment_id: int, until: float) -> None:
+        # Reservations all last as long, so the latest one expires last
+        seconds = max(1, math.ceil(until - clock.time()))
+        try:
+            with self.client.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.hset(
+                        self.prefix + key + ":held", str(appointment_id), repr(until)
+                    )
+                    pipe.expire(self.prefix + key + ":held", seconds)
+                pipe.execute()
+        except redis.RedisError:
+            logger.warning("Calendar reservation update failed", exc_info=True)
+
+    def unhold(self, keys: Sequence[str], appointment_id: int) -> None:
+        try:
+            with self.client.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.hdel(self.prefix + key + ":held", str(appointment_id))
+                pipe.execute()
+        except redis.RedisError:
+            logger.warning("Calendar reservation update failed", exc_info=True)
+
+    def read(self, keys: Sequence[str], now: float) -> list[DayVersion] | None:
+        if not keys:
+            return []
+        try:
+            with self.client.pipeline(transaction=False) as pipe:
+                pipe.mget(
+                    [self.prefix + key + s for key in keys for s in ("", ":changed")]
+                )
+                for key in keys:
+                    pipe.hgetall(self.prefix + key + ":held")
+                values, *held = pipe.execute()
+        except redis.RedisError:
+            logger.warning("Calendar version read failed", exc_info=True)
+            return None
+        return [
+            DayVersion(
+                int(values[2 * i] or 0),
+                float(values[2 * i + 1] or 0.0),
+                sorted(
+                    int(id_) for id_, until in expiries.items() if float(until) > now
+                ),
+            )
+            for i, expiries in enumerate(held)
+        ]
+
+    def clear(self) -> None:
+        try:
+            for name in list(self.client.scan_iter(match=self.prefix + "*")):
+                self.client.delete(name)
+        except redis.RedisError:
+            logger.warning("Calendar version clear failed", exc_info=True)
+
+
+def make_version_backend(kind: str, max_entries: int, ttl: int) -> VersionBackend:
+    """Build the backend named in the settings."""
+    if kind == "redis":
+        return RedisVersions(redis_client(), ttl)
+    if kind == "memory":
+        return MemoryVersions(max_entries)
+    raise ValueError(f"Unknown calendar version backend: {kind}")
+
+
+def version_backend_kind(configured: str, cache: str, reservations: str) -> str:
+    """
+    The backend to keep counters in. Unless one is configured, counters are shared
+    whenever cached calendars or reservations are, as those point to several workers.
+    """
+    if configured:
+        return configured
+    return "redis" if "redis" in (cache, reservations) else "memory"
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Whether an ``If-None-Match`` header lists the tag (compared weakly)."""
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag in tags
+
+
+class CalendarVersions:
+    """Counters per (doctor_id, local date) and the calendar ETags built from them."""
+
+    def __init__(
+        self,
+        backend: VersionBackend,
+        ttl: int,
+        settle_seconds: int,
+        recent_seconds: int,
+    ) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.settle_seconds = settle_seconds
+        self.recent_seconds = recent_seconds
+
+    @staticmethod
+    def key(doctor_id: int, day: date) -> str:
+        return f"{doctor_id}:{day.isoformat()}"
+
+    def keys(self, doctor_id: int, appointment_time: datetime) -> list[str]:
+        """The keys of every local date a naive UTC instant can fall on."""
+        days = date_range(
+            (appointment_time + MIN_UTC_OFFSET).date(),
+            (appointment_time + MAX_UTC_OFFSET).date(),
+        )
+        return [self.key(doctor_id, day) for day in days]
+
+    def changed(self, changes: Iterable[SlotChange]) -> None:
+        keys = {
+            key
+            for change in changes
+            for key in self.keys(change.doctor_id, change.appointment_time)
+        }
+        if keys:
+            self.backend.bump(sorted(keys), clock.time())
+
+    def reserved(
+        self,
+        appointment_id: int,
+        doctor_id: int,
+        appointment_time: datetime,
+        ttl: float,
+    ) -> None:
+        """Record a reservation that lapses after ``ttl`` seconds, or its extension."""
+        keys = self.keys(doctor_id, appointment_time)
+        self.backend.hold(keys, appointment_id, clock.time() + ttl)
+
+    def released(
+        self, appointment_id: int, doctor_id: int, appointment_time: datetime
+    ) -> None:
+        self.backend.unhold(self.keys(doctor_id, appointment_time), appointment_id)
+
+    def etag(
+        self,
+        doctor_ids: Iterable[int],
+        start: date,
+        end: date,
+        reservations: bool = True,
+    ) -> str | None:
+        """
+        The ETag of the doctors' calendars over local dates ``start``..``end``, or
+        ``None`` when they can't be validated yet. Reservations only matter to
+        responses that show them.
+        """
+        doctors = sorted(set(doctor_ids))
+        keys = [self.key(d, day) for d in doctors for day in date_range(start, end)]
+        now = clock.time()
+        days = self.backend.read(keys, now)
+        if days is None:
+            return None
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{self.backend.epoch}:{int(now // self.ttl)}:".encode())
+        digest.update(f"{doctors}:{start}:{end}".encode())
+        for day in days:
+            if now < day.changed_at + self.settle_seconds:
+                return None
+            recent = now < day.changed_at + self.recent_seconds
+            held = day.held if reservations else []
+            digest.update(f";{day.version}:{recent:d}:{held}".encode())
+        return f'"{digest.hexdigest()}"'
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+
+def make_calendar_versions() -> CalendarVersions:
+    """
+    Build the counters from the settings. In-process counters miss other workers'
+    changes, so their tags only last as long as a cached calendar would.
+    """
+    kind = version_backend_kind(
+        settings.calendar_versions_backend,
+        settings.availability_cache_backend,
+        settings.reservation_backend,
+    )
+    ttl = settings.calendar_versions_ttl
+    if kind == "memory":
+        ttl = min(ttl, settings.availability_cache_ttl)
+    return CalendarVersions(
+        make_version_backend(kind, settings.calendar_versions_max_entries, ttl),
+        ttl=ttl,
+        settle_seconds=settings.read_your_writes_seconds,
+        recent_seconds=settings.availability_cache_ttl,
+    )
+
+
+calendar_versions = make_calendar_versions()
+on_slot_changes(calendar_versions.changed)
@@ -1,15 +1,82 @@
 """
 Database connection and session management using SQLAlchemy.
+
+Writes always go to the primary. Routes that only read calendars can use
+``get_read_db``/``get_async_read_db`` instead, which spread sessions across the
+configured read replicas. A client that has just written is kept on the primary for
+``read_your_writes_seconds`` so it doesn't read a replica that hasn't caught up.
+
+Groups of hospitals can be kept on databases of their own (``database_shards``).
+Routes scoped to a hospital use ``get_hospital_db``/``get_hospital_read_db``, which
+open the session on the database holding its rows. Reads spanning hospitals on
+several databases go through ``fan_out``. Replicas are only used for the default
+database. Calendars, GraphQL and slot reservations and bookings aren't routed yet, so
+the app refuses to start with shards configured (see ``check_shards``).
 """
 
+import asyncio
+import itertools
+import time as clock
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Generic,
+    Iterable,
+    Iterator,
+    Sequence,
+    TypeVar,
+)
+
+from fastapi import Request, Response
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import (
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
 from sqlalchemy.orm import sessionmaker
 
 from .config import settings
 
+PRIMARY_READS_COOKIE = "primary_reads_until"
+
+SAFE_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+
+def engine_options() -> dict:
+    """Pool and logging options shared by every engine."""
+    return {
+        "echo": settings.database_echo,
+        "pool_size": settings.database_pool_size,
+        "max_overflow": settings.database_max_overflow,
+        # Check connections before use so a failover or idle timeout doesn't surface
+        # as an error in a request
+        "pool_pre_ping": settings.database_pool_pre_ping,
+        "pool_recycle": settings.database_pool_recycle,
+    }
+
+
+def replica_urls() -> list[str]:
+    return [
+        url.strip() for url in settings.database_replica_urls.split(",") if url.strip()
+    ]
+
+
+def parse_shards(value: str) -> list[tuple[range, str]]:
+    """Parse ``database_shards`` into (hospital ids, URL) pairs."""
+    shards = []
+    for entry in value.split(","):
+        if not entry.strip():
+            continue
+        ids, url = entry.split("=", 1)
+        first, _, last = ids.partition("-")
+        shards.append((range(int(first), int(last or first) + 1), url.strip()))
+    return shards
+
+
 # Create database engine
-# echo=True enables SQL logging (useful for development)
-engine = create_engine(settings.database_url, echo=True)  # Set to False in production
+engine = create_engine(settings.database_url, **engine_options())
 
 # Create SessionLocal class for database sessions
 # Each instance will be a database session
@@ -19,6 +86,195 @@ SessionLocal = sessionmaker(
     bind=engine,  # Bind to our database engine
 )
 
+# Async engine for `async def` routes, so waiting on the database doesn't hold one of
+# Starlette's threadpool workers. psycopg 3 drives both engines from the same URL.
+async_engine = create_async_engine(settings.database_url, **engine_options())
+
+AsyncSessionLocal = async_sessionmaker(
+    autoflush=False,
+    # Attributes stay loaded after commit, since lazy loads can't happen implicitly
+    # in async code
+    expire_on_commit=False,
+    bind=async_engine,
+)
+
+Factory = TypeVar("Factory")
+T = TypeVar("T")
+
+
+class ReadRouter(Generic[Factory]):
+    """Pick a session factory for a read-only request."""
+
+    def __init__(self, primary: Factory, replicas: Sequence[Factory]) -> None:
+        self.primary: Factory = primary
+        self.replicas: list[Factory] = list(replicas)
+        self._replicas: Iterator[Factory] = itertools.cycle(self.replicas)
+
+    def choose(self, request: Request) -> Factory:
+        if not self.replicas or reads_from_primary(request):
+            return self.primary
+        return next(self._replicas)
+
+
+def reads_from_primary(request: Request) -> bool:
+    """Whether a request has to see the latest writes."""
+    if request.method not in SAFE_METHODS:
+        return True
+    try:
+        return float(request.cookies.get(PRIMARY_READS_COOKIE, 0)) > clock.time()
+    except ValueError:
+        return False
+
+
+def stick_to_primary(response: Response) -> None:
+    """Keep the client's following reads on the primary while replicas catch up."""
+    response.set_cookie(
+        key=PRIMARY_READS_COOKIE,
+        value=str(clock.time() + settings.read_your_writes_seconds),
+        httponly=True,
+        secure=False,  # Set to True in production with HTTPS
+        samesite="lax",
+        path="/",
+        max_age=settings.read_your_writes_seconds,
+    )
+
+
+read_router = ReadRouter(
+    SessionLocal,
+    [
+        sessionmaker(
+            autocommit=False,
+            autoflush=False,
+            bind=create_engine(url, **engine_options()),
+        )
+        for url in replica_urls()
+    ],
+)
+
+async_read_router = ReadRouter(
+    AsyncSessionLocal,
+    [
+        async_sessionmaker(
+            autoflush=False,
+            expire_on_commit=False,
+            bind=create_async_engine(url, **engine_options()),
+        )
+        for url in replica_urls()
+    ],
+)
+
+
+class ShardMap(Generic[Factory]):
+    """Pick the session factory of the database a hospital's rows are on."""
+
+    def __init__(
+        self, default: Factory, shards: Sequence[tuple[range, Factory]]
+    ) -> None:
+        self.default: Factory = default
+        self.shards: list[tuple[range, Factory]] = list(shards)
+
+    def for_hospital(self, hospital_id: int) -> Factory:
+        for ids, factory in self.shards:
+            if hospital_id in ids:
+                return factory
+        return self.default
+
+    def all(self) -> list[Factory]:
+        """Every database's factory, the default first."""
+        factories = [self.default]
+        for _, factory in self.shards:
+            if factory not in factories:
+                factories.append(factory)
+        return factories
+
+    def group(self, hospital_ids: Iterable[int]) -> list[tuple[Factory, list[int]]]:
+        """The hospitals on each database, for the databases holding any of them."""
+        groups: list[tuple[Factory, list[int]]] = []
+        for hospital_id in dict.fromkeys(hospital_ids):
+            factory = self.for_hospital(hospital_id)
+            for grouped, ids in groups:
+                if grouped is factory:
+                    ids.append(hospital_id)
+                    break
+            else:
+                groups.append((factory, [hospital_id]))
+        return groups
+
+
+def _shard_factories(make: Callable[[str], Factory]) -> list[tuple[range, Factory]]:
+    """One factory per shard URL, however many hospital ranges share it."""
+    factories: dict[str, Factory] = {}
+    shards = []
+    for ids, url in parse_shards(settings.database_shards):
+        if url not in factories:
+            factories[url] = make(url)
+        shards.append((ids, factories[url]))
+    return shards
+
+
+shard_map = ShardMap(
+    SessionLocal,
+    _shard_factories(
+        lambda url: sessionmaker(
+            autocommit=False,
+            autoflush=False,
+            bind=create_engine(url, **engine_options()),
+        )
+    ),
+)
+
+async_shard_map = ShardMap(
+    AsyncSessionLocal,
+    _shard_factories(
+        lambda url: async_sessionmaker(
+            autoflush=False,
+            expire_on_commit=False,
+            bind=create_async_engine(url, **engine_options()),
+        )
+    ),
+)
+
+
+async def fan_out(
+    shards: ShardMap[async_sessionmaker[AsyncSession]],
+    query: Callable[[AsyncSession, list[int] | None], Awaitable[Iterable[T]]],
+    hospital_ids: Iterable[int] | None = None,
+    key: Callable[[T], Any] | None = None,
+) -> list[T]:
+    """
+    Run a read on every database, or only on those holding ``hospital_ids``, all at
+    once, and merge the results, sorted by ``key`` if given. ``query`` gets a session
+    of its own and the hospitals on its database, or ``None`` for all of them.
+    """
+    if hospital_ids is None:
+        targets: list[tuple[Any, list[int] | None]] = [
+            (factory, None) for factory in shards.all()
+        ]
+    else:
+        targets = list(shards.group(hospital_ids))
+
+    async def run(factory: async_sessionmaker[AsyncSession], ids: list[int] | None):
+        async with factory() as session:
+            return list(await query(session, ids))
+
+    results = await asyncio.gather(*(run(factory, ids) for factory, ids in targets))
+    merged = [item for result in results for item in result]
+    return merged if key is None else sorted(merged, key=key)
+
+
+def check_shards() -> None:
+    """
+    Refuse to run with ``database_shards`` set. Calendars, GraphQL and slot
+    reservations and bookings are keyed by doctor or appointment id, which don't say
+    which database a row is on, and appointment ids are only unique within one
+    database, so those routes would read and write the default database only.
+    """
+    if parse_shards(settings.database_shards):
+        raise RuntimeError(
+            "database_shards is not supported yet: calendar, GraphQL and booking "
+            "routes only use the default database"
+        )
+
 
 def get_db():
     """
@@ -31,3 +287,76 @@ def get_db():
         yield db  # FastAPI will inject this session
     finally:
         db.close()  # Always close the session
+
+
+async def get_async_db():
+    """
+    Dependency function to get an async database session for `async def` routes.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def get_read_db(request: Request):
+    """
+    Dependency function to get a session for a read-only route, from a replica when
+    one is configured.
+    """
+    db = read_router.choose(request)()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db(request: Request):
+    """
+    Async version of `get_read_db`.
+    """
+    async with async_read_router.choose(request)() as db:
+        yield db
+
+
+def get_hospital_db(hospital_id: int):
+    """
+    Dependency function to get a session on the database of the hospital in the
+    route's path.
+    """
+    db = shard_map.for_hospital(hospital_id)()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_hospital_read_db(request: Request, hospital_id: int):
+    """
+    Read-only version of `get_hospital_db`, from a replica when the hospital is on
+    the default database and one is configured.
+    """
+    factory = shard_map.for_hospital(hospital_id)
+    if factory is shard_map.default:
+        factory = read_router.choose(request)
+    db = factory()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_hospital_read_db(request: Request, hospital_id: int):
+    """
+    Async version of `get_hospital_read_db`.
+    """
+    factory = async_shard_map.for_hospital(hospital_id)
+    if factory is async_shard_map.default:
+        factory = async_read_router.choose(request)
+    async with factory() as db:
+        yield db
+
+
+def get_async_shards() -> ShardMap[async_sessionmaker[AsyncSession]]:
+    """
+    Dependency function to get the async shard map for reads that `fan_out`.
+    """
+    return async_shard_map
@@ -0,0 +1,192 @@
+"""
+Streaming export of a hospital's appointments.
+
+An export can cover millions of rows, so it is never loaded at once: the query is
+read through a server-side cursor ``export_batch_size`` rows at a time
+(``yield_per``, which implies ``stream_results``) and each batch is encoded and
+handed to the response before the next one is fetched. Memory stays flat however
+long the range is.
+
+The doctor's, patient's and creator's names are joined into that one query rather
+than loaded through the relationships, which would cost a query per row.
+
+Appointments before the archive watermark (see ``app.core.archive``) are read from
+the archive a month at a time and come first, with their names looked up in one
+query per batch; the query only covers the rest.
+"""
+
+from __future__ import annotations
+
+import csv
+import io
+from datetime import date, datetime, time, timedelta
+from typing import Any, Iterable, Iterator, Sequence, cast
+from zoneinfo import ZoneInfo
+
+import orjson
+from sqlalchemy import Select, Table, select
+from sqlalchemy.orm import Session, aliased
+
+from app.models import Appointment, Doctor
+from app.models.people import Person
+
+from .archive import ArchivedAppointment, appointment_archive, month_windows
+from .availability import to_local, to_utc
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+CSV_MEDIA_TYPE = "text/csv"
+
+EXPORT_COLUMNS = (
+    "id",
+    "appointment_time",
+    "appointment_time_utc",
+    "doctor_id",
+    "doctor_name",
+    "specialty",
+    "patient_id",
+    "patient_name",
+    "created_by",
+    "created_by_name",
+    "created_at",
+    "updated_at",
+)
+
+
+def export_query(hospital_id: int, start: datetime, end: datetime) -> Select:
+    """Every appointment of a hospital from naive UTC ``start`` up to ``end``."""
+    patient = aliased(Person, name="patient")
+    creator = aliased(Person, name="creator")
+    return (
+        select(
+            Appointment.id,
+            Appointment.appointment_time,
+            Appointment.doctor_id,
+            Doctor.name,
+            Doctor.specialty,
+            Appointment.patient_id,
+            patient.name,
+            Appointment.created_by,
+            creator.name,
+            Appointment.created_at,
+            Appointment.updated_at,
+        )
+        .join(Doctor, Appointment.doctor_id == Doctor.id)
+        .outerjoin(patient, Appointment.patient_id == patient.id)
+        .join(creator, Appointment.created_by == creator.id)
+        .where(
+            Appointment.hospital_id == hospital_id,
+            Appointment.appointment_time >= start,
+            Appointment.appointment_time < end,
+        )
+        # The order of the unique (doctor_id, appointment_time) index, so rows can be
+        # streamed without sorting the whole range first
+        .order_by(Appointment.doctor_id, Appointment.appointment_time)
+    )
+
+
+def _export_row(row: Sequence[Any], tz: ZoneInfo) -> dict[str, Any]:
+    """A row in the order of ``export_query`` as an export record."""
+    return {
+        "id": row[0],
+        "appointment_time": to_local(row[1], tz).isoformat(),
+        "appointment_time_utc": row[1].isoformat() + "Z",
+        "doctor_id": row[2],
+        "doctor_name": row[3],
+        "specialty": row[4],
+        "patient_id": row[5],
+        "patient_name": row[6],
+        "created_by": row[7],
+        "created_by_name": row[8],
+        "created_at": row[9].isoformat(),
+        "updated_at": row[10].isoformat(),
+    }
+
+
+def _archived_rows(
+    db: Session, slots: Sequence[ArchivedAppointment]
+) -> list[tuple[Any, ...]]:
+    """Archived appointments in the order of ``export_query``, names looked up."""
+    ids = {slot.doctor_id for slot in slots} | {slot.created_by for slot in slots}
+    ids |= {slot.patient_id for slot in slots if slot.patient_id is not None}
+    doctors = cast(Table, Doctor.__table__)
+    people = {
+        person_id: (name, specialty)
+        for person_id, name, specialty in db.execute(
+            # The doctors table alone; the Doctor entity would join people again
+            select(Person.id, Person.name, doctors.c.specialty)
+            .outerjoin(doctors, doctors.c.id == Person.id)
+            .where(Person.id.in_(ids))
+        )
+    }
+    unknown = (None, None)
+    return [
+        (
+            slot.id,
+            slot.appointment_time,
+            slot.doctor_id,
+            *people.get(slot.doctor_id, unknown),
+            slot.patient_id,
+            people.get(slot.patient_id or 0, unknown)[0],
+            slot.created_by,
+            people.get(slot.created_by, unknown)[0],
+            slot.created_at,
+            slot.updated_at,
+        )
+        for slot in slots
+    ]
+
+
+def export_batches(  # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    db: Session,
+    hospital_id: int,
+    tz: ZoneInfo,
+    start: date,
+    end: date,
+    batch_size: int,
+) -> Iterator[list[dict[str, Any]]]:
+    """
+    Lazily read a hospital's appointments over the local dates ``start``..``end``
+    (inclusive) in batches of ``batch_size`` rows. Appointment times are given in the
+    hospital's timezone, as elsewhere in the API, and in UTC.
+    """
+    first = to_utc(datetime.combine(start, time()), tz)
+    last = to_utc(datetime.combine(end + timedelta(days=1), time()), tz)
+    watermark = appointment_archive.watermark()
+    if watermark is not None and first < watermark:
+        for lower, upper in month_windows(first, min(last, watermark)):
+            slots = appointment_archive.read([hospital_id], lower, upper)
+            for i in range(0, len(slots), batch_size):
+                archived = _archived_rows(db, slots[i : i + batch_size])
+                yield [_export_row(row, tz) for row in archived]
+        first = max(first, watermark)
+
+    result = db.execute(
+        export_query(hospital_id, first, last),
+        execution_options={"yield_per": batch_size},
+    )
+    try:
+        for rows in result.partitions():
+            yield [_export_row(row, tz) for row in rows]
+    finally:
+        # Also releases the cursor when the client goes away mid-export
+        result.close()
+
+
+def ndjson_chunks(batches: Iterable[Sequence[dict[str, Any]]]) -> Iterator[bytes]:
+    """One JSON object per line, a chunk per batch."""
+    for batch in batches:
+        yield b"".join(orjson.dumps(row) + b"\n" for row in batch)
+
+
+def csv_chunks(batches: Iterable[Sequence[dict[str, Any]]]) -> Iterator[bytes]:
+    """A header line, then a chunk of CSV rows per batch."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, lineterminator="\n")
+    writer.writeheader()
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
@@ -0,0 +1,372 @@
+"""
+Synthetic data generator for load tests at production scale.
+
+``init_db`` creates a small demo data set through the ORM. This module generates as
+much data as asked for (the README targets 10k hospitals with up to 100 doctors and
+100 staff each) by streaming rows to the database in chunks: ``COPY`` on PostgreSQL
+and Core ``executemany`` inserts elsewhere. Hospitals can be split across worker
+processes, each with its own connection.
+
+Primary keys are assigned up front from the current maximum ids, so workers never
+need to read back what another one wrote. On PostgreSQL the id sequences are moved
+past the generated rows afterwards.
+
+Every generated doctor gets one hour slots for each opening hour of ``days`` days
+(see the README's prepopulated ``appointments`` table), and ``density`` of them are
+booked by a random patient.
+
+Usage::
+
+    python -m app.core.generate_data --hospitals 10000 --doctors 100 --staff 100 \\
+        --patients 500000 --days 30 --density 0.3 --workers 8
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import time as clock
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import UTC, date, datetime, time, timedelta
+from typing import Any, Iterator, Sequence, cast
+from zoneinfo import ZoneInfo, available_timezones
+
+from faker import Faker
+from sqlalchemy import (
+    Connection,
+    Engine,
+    Table,
+    create_engine,
+    func,
+    insert,
+    select,
+)
+from sqlalchemy.pool import NullPool
+
+from app.models import Appointment, Doctor, Hospital, Patient, Staff
+from app.models.people import Person
+
+from .availability import opening_hours
+from .config import settings
+
+HOSPITALS = cast(Table, Hospital.__table__)
+PEOPLE = cast(Table, Person.__table__)
+PATIENTS = cast(Table, Patient.__table__)
+DOCTORS = cast(Table, Doctor.__table__)
+STAFF = cast(Table, Staff.__table__)
+APPOINTMENTS = cast(Table, Appointment.__table__)
+
+# Parents come before children, so flushing in this order never breaks a foreign key
+TABLES = [HOSPITALS, PEOPLE, PATIENTS, DOCTORS, STAFF, APPOINTMENTS]
+
+TIMEZONES = sorted(
+    zone
+    for zone in available_timezones()
+    if zone.startswith(("America/", "Europe/", "Asia/", "Australia/", "Pacific/"))
+)
+
+
+@dataclass(frozen=True)
+class Scale:  # pylint: disable=too-many-instance-attributes
+    """How much data to generate."""
+
+    hospitals: int = 10
+    doctors: int = 10  # per hospital
+    staff: int = 20  # per hospital
+    patients: int = 200
+    days: int = 30
+    density: float = 0.3  # fraction of slots that are booked
+    start: date = field(default_factory=lambda: datetime.now(UTC).date())
+    seed: int = 0
+
+
+@dataclass(frozen=True)
+class FirstIds:
+    """The ids just below the generated rows."""
+
+    hospital: int
+    person: int
+
+
+@dataclass
+class Report:
+    rows: Counter[str] = field(default_factory=Counter)
+    seconds: float = 0.0
+
+    @property
+    def total(self) -> int:
+        return sum(self.rows.values())
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.total / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        lines = [f"  {table}: {rows:,}" for table, rows in sorted(self.rows.items())]
+        lines.append(
+            f"{self.total:,} rows in {self.seconds:.1f}s "
+            f"({self.rows_per_second:,.0f} rows/s)"
+        )
+        return "\n".join(lines)
+
+
+class RowWriter:
+    """Buffer rows per table and write them in chunks, each in its own transaction."""
+
+    def __init__(self, engine: Engine, chunk_size: int) -> None:
+        self.engine = engine
+        self.chunk_size = chunk_size
+        self.rows: Counter[str] = Counter()
+        self._buffers: dict[str, list[dict[str, Any]]] = {t.name: [] for t in TABLES}
+
+    def add(self, table: Table, row: dict[str, Any]) -> None:
+        buffer = self._buffers[table.name]
+        buffer.append(row)
+        if len(buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        with self.engine.begin() as connection:
+            for table in TABLES:
+                buffer = self._buffers[table.name]
+                if buffer:
+                    self._write(connection, table, buffer)
+                    self.rows[table.name] += len(buffer)
+                    buffer.clear()
+
+    @staticmethod
+    def _write(
+        connection: Connection, table: Table, rows: Sequence[dict[str, Any]]
+    ) -> None:
+        if connection.dialect.name != "postgresql":
+            connection.execute(insert(table), rows)
+            return
+        columns = list(rows[0])
+        driver_connection: Any = connection.connection.driver_connection
+        with driver_connection.cursor() as cursor:
+            with cursor.copy(
+                f"COPY {table.name} ({', '.join(columns)}) FROM STDIN"
+            ) as copy:
+                for row in rows:
+                    copy.write_row([row[column] for column in columns])
+
+
+class NamePool:
+    """Realistic names without a Faker call per row."""
+
+    def __init__(self, rng: random.Random, size: int = 500) -> None:
+        fake = Faker()
+        fake.seed_instance(rng.random())
+        self.rng = rng
+        self.first = [fake.first_name() for _ in range(size)]
+        self.last = [fake.last_name() for _ in range(size)]
+        self.companies = [fake.company() for _ in range(size)]
+        self.streets = [fake.street_address() for _ in range(size)]
+        self.cities = [fake.city() for _ in range(size)]
+
+    def person(self) -> str:
+        return f"{self.rng.choice(self.first)} {self.rng.choice(self.last)}"
+
+    def phone(self) -> str:
+        return f"({self.rng.randint(200, 999)}) 555-{self.rng.randint(0, 9999):04d}"
+
+    def hospital(self) -> str:
+        return f"{self.rng.choice(self.companies)} Hospital"
+
+    def address(self) -> str:
+        return f"{self.rng.choice(self.streets)}, {self.rng.choice(self.cities)}"
+
+
+def first_ids(engine: Engine) -> FirstIds:
+    with engine.connect() as connection:
+        return FirstIds(
+            hospital=connection.scalar(select(func.max(Hospital.id))) or 0,
+            person=connection.scalar(select(func.max(Person.id))) or 0,
+        )
+
+
+def generate_patients(
+    engine: Engine, scale: Scale, ids: FirstIds, chunk_size: int
+) -> Counter[str]:
+    rng = random.Random(scale.seed)
+    names = NamePool(rng)
+    writer = RowWriter(engine, chunk_size)
+    for person_id in range(ids.person + 1, ids.person + scale.patients + 1):
+        name = names.person()
+        # Numbered, so emails stay unique however many patients share a name
+        email = f"{name.replace(' ', '.').lower()}.{person_id}@example.com"
+        writer.add(
+            PEOPLE,
+            {"id": person_id, "name": name, "phone": names.phone(), "email": email},
+        )
+        writer.add(PATIENTS, {"id": person_id})
+    writer.flush()
+    return writer.rows
+
+
+def _hospital_rows(
+    scale: Scale, ids: FirstIds, index: int, names: NamePool, rng: random.Random
+) -> Iterator[tuple[Table, dict[str, Any]]]:
+    """Rows for one hospital: the hospital, its people and its doctors' slots."""
+    hospital_id = ids.hospital + index + 1
+    tz = ZoneInfo(rng.choice(TIMEZONES))
+    open_time, close_time = time(rng.randint(6, 9)), time(rng.randint(17, 22))
+    yield HOSPITALS, {
+        "id": hospital_id,
+        "name": names.hospital(),
+        "address": names.address(),
+        "timezone": str(tz),
+        "open_time": open_time,
+        "close_time": close_time,
+    }
+
+    # People ids: all the patients first, then each hospital's doctors and staff
+    per_hospital = scale.doctors + scale.staff
+    first_person = ids.person + scale.patients + index * per_hospital + 1
+    times = opening_hours(
+        tz, open_time, close_time, scale.start, scale.start + timedelta(scale.days - 1)
+    )
+    for offset in range(per_hospital):
+        person_id = first_person + offset
+        yield PEOPLE, {"id": person_id, "name": names.person()}
+        if offset >= scale.doctors:
+            yield STAFF, {"id": person_id, "hospital_id": hospital_id}
+            continue
+        yield DOCTORS, {"id": person_id, "hospital_id": hospital_id, "specialty": None}
+        for row in _slot_rows(scale, ids, person_id, hospital_id, times, rng):
+            yield APPOINTMENTS, row
+
+
+def _slot_rows(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    scale: Scale,
+    ids: FirstIds,
+    doctor_id: int,
+    hospital_id: int,
+    times: list[datetime],
+    rng: random.Random,
+) -> Iterator[dict[str, Any]]:
+    now = datetime.now(UTC).replace(tzinfo=None)
+    for appointment_time in times:
+        booked = scale.patients and rng.random() < scale.density
+        yield {
+            "doctor_id": doctor_id,
+            "hospital_id": hospital_id,
+            "patient_id": (
+                ids.person + rng.randint(1, scale.patients) if booked else None
+            ),
+            "appointment_time": appointment_time,
+            "created_at": now,
+            "updated_at": now,
+            "created_by": doctor_id,
+        }
+
+
+def generate_hospitals(
+    url: str,
+    scale: Scale,
+    ids: FirstIds,
+    indexes: range,
+    chunk_size: int,
+) -> Counter[str]:
+    """Generate the hospitals at ``indexes``. Runs in a worker process."""
+    engine = create_engine(url, poolclass=NullPool)
+    rng = random.Random(f"{scale.seed}:{indexes.start}")
+    names = NamePool(rng)
+    writer = RowWriter(engine, chunk_size)
+    for index in indexes:
+        for table, row in _hospital_rows(scale, ids, index, names, rng):
+            writer.add(table, row)
+    writer.flush()
+    engine.dispose()
+    return writer.rows
+
+
+def _reset_sequences(engine: Engine) -> None:
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as connection:
+        for table in ("hospitals", "people", "appointments"):
+            connection.exec_driver_sql(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"(SELECT coalesce(max(id), 1) FROM {table}))"
+            )
+
+
+def generate(
+    url: str, scale: Scale, workers: int = 1, chunk_size: int = 10_000
+) -> Report:
+    """Add ``scale`` worth of data to the database at ``url``."""
+    started = clock.perf_counter()
+    engine = create_engine(url, poolclass=NullPool)
+    ids = first_ids(engine)
+    report = Report()
+    report.rows.update(generate_patients(engine, scale, ids, chunk_size))
+
+    # Contiguous blocks of hospitals, a few per worker so uneven ones balance out
+    blocks = max(1, min(scale.hospitals, workers * 4))
+    bounds = [scale.hospitals * i // blocks for i in range(blocks + 1)]
+    ranges = [range(lo, hi) for lo, hi in zip(bounds, bounds[1:]) if hi > lo]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(generate_hospitals, url, scale, ids, indexes, chunk_size)
+                for indexes in ranges
+            ]
+            for future in futures:
+                report.rows.update(future.result())
+    else:
+        for indexes in ranges:
+            report.rows.update(generate_hospitals(url, scale, ids, indexes, chunk_size))
+
+    _reset_sequences(engine)
+    engine.dispose()
+    report.seconds = clock.perf_counter() - started
+    return report
+
+
+def main(argv: Sequence[str] | None = None) -> None:
+    defaults = Scale()
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic data at production scale."
+    )
+    parser.add_argument("--database-url", default=settings.database_url)
+    parser.add_argument("--hospitals", type=int, default=defaults.hospitals)
+    parser.add_argument(
+        "--doctors", type=int, default=defaults.doctors, help="per hospital"
+    )
+    parser.add_argument(
+        "--staff", type=int, default=defaults.staff, help="per hospital"
+    )
+    parser.add_argument("--patients", type=int, default=defaults.patients)
+    parser.add_argument("--days", type=int, default=defaults.days)
+    parser.add_argument(
+        "--density",
+        type=float,
+        default=defaults.density,
+        help="fraction of slots that are booked",
+    )
+    parser.add_argument("--start", type=date.fromisoformat, default=defaults.start)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--chunk-size", type=int, default=10_000)
+    args = parser.parse_args(argv)
+
+    scale = Scale(
+        hospitals=args.hospitals,
+        doctors=args.doctors,
+        staff=args.staff,
+        patients=args.patients,
+        days=args.days,
+        density=args.density,
+        start=args.start,
+        seed=args.seed,
+    )
+    print(f"Generating {scale}...")
+    report = generate(args.database_url, scale, args.workers, args.chunk_size)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
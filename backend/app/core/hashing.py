@@ -0,0 +1,66 @@
+"""
+Bounded executor for password hashing.
+
+bcrypt is deliberately slow (about 250ms of CPU per check at cost 12). Running it on
+Starlette's shared threadpool lets a burst of logins occupy every worker, and then
+unrelated sync routes and dependencies queue behind them. Checks run on a small
+dedicated pool instead, and once ``max_pending`` checks are running or queued new ones
+are rejected immediately rather than waiting, so callers can answer 503 and the client
+can retry.
+
+bcrypt releases the GIL while hashing, so threads use every core without the cost of
+pickling arguments to worker processes.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+from .config import settings
+
+T = TypeVar("T")
+
+
+class HasherBusy(Exception):
+    """Too many password checks are already running or queued."""
+
+
+class PasswordHasher:
+    """Run bcrypt on ``workers`` threads with at most ``max_pending`` calls admitted."""
+
+    def __init__(self, workers: int, max_pending: int) -> None:
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="bcrypt"
+        )
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """Calls running or waiting for a worker."""
+        return self._pending
+
+    def _done(self, _: Future) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, func: Callable[..., T], *args: object) -> T:
+        """Run ``func(*args)`` on the pool, or raise ``HasherBusy`` if it's full."""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise HasherBusy(f"{self._pending} password checks pending")
+            self._pending += 1
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(self._done)
+        return await asyncio.wrap_future(future)
+
+
+password_hasher = PasswordHasher(
+    workers=settings.password_hash_workers,
+    max_pending=settings.password_hash_max_pending,
+)
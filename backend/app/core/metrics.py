@@ -0,0 +1,341 @@
+"""
+Request and SQL instrumentation, exposed at ``/metrics`` in the Prometheus text format.
+
+``MetricsMiddleware`` times every request and labels it with its route template (not
+the raw path, so ids don't multiply the series). While a request runs, SQLAlchemy
+cursor events count its queries and the time spent in them on a ``RequestStats``
+held in a context variable; FastAPI copies the context into the threadpool and
+SQLAlchemy's async greenlets, so sync and async routes are both covered. A request
+that runs the same statement ``n_plus_one_threshold`` times or more is counted and
+logged as a likely N+1.
+
+Attempts to take a slot that someone else already has are counted by the stage that
+turned them away, including inserts rejected by ``idx_unique_doctor_timeslot``, to
+monitor double-booking attempts.
+
+Metrics are kept per worker process, like the memory cache backends.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time as clock
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Iterator, Sequence
+
+from sqlalchemy import Engine, event
+from sqlalchemy.engine import ExceptionContext
+from sqlalchemy.exc import IntegrityError
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# How the unique index on (doctor_id, appointment_time) shows up in error messages:
+# by name on PostgreSQL, by columns on SQLite
+DOUBLE_BOOKING_MARKERS = (
+    "idx_unique_doctor_timeslot",
+    "appointments.doctor_id, appointments.appointment_time",
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """A monotonically increasing count per set of label values."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *values: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[values] = self._values.get(values, 0.0) + amount
+
+    def value(self, *values: str) -> float:
+        return self._values.get(values, 0.0)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, total in values:
+            yield f"{self.name}{_labels(self.labels, label_values)} {total:g}"
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+@dataclass(slots=True)
+class _Buckets:
+    counts: list[int]
+    total: float = 0.0
+    observations: int = 0
+
+
+class Histogram:
+    """Observations counted into fixed buckets per set of label values."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = SECONDS_BUCKETS,
+    ):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values: dict[tuple[str, ...], _Buckets] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *values: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            buckets = self._values.get(values)
+            if buckets is None:
+                buckets = self._values[values] = _Buckets([0] * (len(self.buckets) + 1))
+            buckets.counts[index] += 1
+            buckets.total += value
+            buckets.observations += 1
+
+    def count(self, *values: str) -> int:
+        buckets = self._values.get(values)
+        return buckets.observations if buckets else 0
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = [
+                (labels, list(b.counts), b.total, b.observations)
+                for labels, b in sorted(self._values.items())
+            ]
+        for label_values, counts, total, observations in values:
+            cumulative = 0
+            bounds = [f"{bound:g}" for bound in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                labels = _labels(self.labels, label_values, f'le="{bound}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {total:g}"
+            yield f"{self.name}_count{labels} {observations}"
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class Registry:
+    """The metrics exposed at ``/metrics``."""
+
+    def __init__(self) -> None:
+        self.metrics: list[Counter | Histogram] = []
+
+    def counter(
+        self, name: str, description: str, labels: Sequence[str] = ()
+    ) -> Counter:
+        metric = Counter(name, description, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        description: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = SECONDS_BUCKETS,
+    ) -> Histogram:
+        metric = Histogram(name, description, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def clear(self) -> None:
+        for metric in self.metrics:
+            metric.clear()
+
+
+registry = Registry()
+
+request_seconds = registry.histogram(
+    "http_request_duration_seconds",
+    "Time to handle a request.",
+    ["method", "route", "status"],
+)
+request_queries = registry.histogram(
+    "http_request_db_queries",
+    "SQL statements executed per request.",
+    ["route"],
+    buckets=QUERY_BUCKETS,
+)
+request_db_seconds = registry.histogram(
+    "http_request_db_seconds",
+    "Time spent executing SQL per request.",
+    ["route"],
+)
+n_plus_one_requests = registry.counter(
+    "http_request_n_plus_one_total",
+    "Requests that ran the same SQL statement n_plus_one_threshold times or more.",
+    ["route"],
+)
+slot_conflicts = registry.counter(
+    "slot_conflicts_total",
+    "Attempts to take a slot someone else already has, by the stage that stopped "
+    "them.",
+    ["stage"],
+)
+
+
+@dataclass(slots=True)
+class RequestStats:
+    """SQL executed while handling one request."""
+
+    queries: int = 0
+    db_seconds: float = 0.0
+    # Executions of each distinct statement
+    statements: dict[str, int] = field(default_factory=dict)
+
+    def most_repeated(self) -> tuple[str, int] | None:
+        if not self.statements:
+            return None
+        statement = max(self.statements, key=self.statements.__getitem__)
+        return statement, self.statements[statement]
+
+
+_request_stats: ContextVar[RequestStats | None] = ContextVar(
+    "request_stats", default=None
+)
+
+
+def current_stats() -> RequestStats | None:
+    """The stats of the request being handled, if any."""
+    return _request_stats.get()
+
+
+def record_request(
+    method: str, route: str, status: int, seconds: float, stats: RequestStats
+) -> None:
+    request_seconds.observe(seconds, method, route, str(status))
+    request_queries.observe(stats.queries, route)
+    request_db_seconds.observe(stats.db_seconds, route)
+    repeated = stats.most_repeated()
+    if repeated is not None and repeated[1] >= settings.n_plus_one_threshold:
+        n_plus_one_requests.inc(route)
+        logger.warning(
+            "Possible N+1 in %s %s: %d executions of %s",
+            method,
+            route,
+            repeated[1],
+            repeated[0][:200],
+        )
+
+
+class MetricsMiddleware:
+    """Time requests and collect the SQL they run."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not settings.metrics_enabled:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        started = clock.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            seconds = clock.perf_counter() - started
+            _request_stats.reset(token)
+            # The router records the matched route on the scope
+            route = getattr(scope.get("route"), "path", "unmatched")
+            record_request(scope["method"], route, status, seconds, stats)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    conn: Any,
+    _cursor: Any,
+    _statement: str,
+    _parameters: Any,
+    _context: Any,
+    _executemany: bool,
+) -> None:
+    if _request_stats.get() is not None:
+        conn.info["query_started"] = clock.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _end_query(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    conn: Any,
+    _cursor: Any,
+    statement: str,
+    _parameters: Any,
+    _context: Any,
+    _executemany: bool,
+) -> None:
+    stats = _request_stats.get()
+    started = conn.info.pop("query_started", None)
+    if stats is None or started is None:
+        return
+    stats.queries += 1
+    stats.db_seconds += clock.perf_counter() - started
+    stats.statements[statement] = stats.statements.get(statement, 0) + 1
+
+
+def is_double_booking(error: BaseException) -> bool:
+    """Whether a database error is a violation of ``idx_unique_doctor_timeslot``."""
+    message = str(error)
+    return any(marker in message for marker in DOUBLE_BOOKING_MARKERS)
+
+
+@event.listens_for(Engine, "handle_error")
+def _count_double_bookings(context: ExceptionContext) -> None:
+    if isinstance(context.sqlalchemy_exception, IntegrityError) and is_double_booking(
+        context.original_exception
+    ):
+        slot_conflicts.inc("unique_index")
@@ -0,0 +1,316 @@
+"""
+Declarative partitioning of ``appointments`` on PostgreSQL.
+
+``Base.metadata`` creates ``appointments`` as a plain table, which is what SQLite
+and small deployments use. ``python -m app.core.partitioning migrate`` turns it
+into this layout::
+
+    appointments                  RANGE (appointment_time)
+      appointments_2025_03        2025-03-01 .. 2025-04-01, HASH (hospital_id)
+        appointments_2025_03_h0   modulus 16, remainder 0
+        ...
+
+A query for one hospital over a window inside one month is pruned to a single leaf.
+Months come first so whole months can be dropped once they are archived (see
+``app.core.archive``).
+
+PostgreSQL wants the partition keys in every unique index of a partitioned table,
+so ``idx_unique_doctor_timeslot`` covers (doctor_id, appointment_time, hospital_id)
+and the primary key is (id, appointment_time, hospital_id). A doctor works at one
+hospital, so neither allows more than before; ids still come from one sequence.
+Each leaf gets its own unique index named ``idx_unique_doctor_timeslot_<leaf>``, so
+double bookings are still recognised by name (see ``app.core.metrics``).
+
+Months are created ``partition_months_ahead`` in advance. ``extend`` has to run
+(monthly, say) before slots are opened further out, or their inserts fail.
+
+The migration keeps the app running until the final swap:
+
+1. ``hospital_id`` is added and backfilled from ``doctors`` in batches if it's
+   missing, and ``idx_unique_doctor_timeslot`` is rebuilt with it, concurrently.
+2. ``appointments_partitioned`` is created with months covering every row.
+3. Rows are copied in id batches. An index on ``updated_at`` keeps track of what
+   changes meanwhile.
+4. One transaction blocks writes (not reads), copies what was inserted or updated
+   since step 3 began again, and swaps the tables. The old table is kept as
+   ``appointments_unpartitioned`` until dropped by hand.
+
+Rows deleted during the copy would come back, so don't run the archival job
+meanwhile.
+"""
+
+from __future__ import annotations
+
+import argparse
+import re
+from datetime import UTC, date, datetime, timedelta
+from typing import Sequence
+
+from sqlalchemy import Connection, Engine, create_engine, inspect, text
+
+from .config import settings
+
+PARENT = "appointments"
+BUILDING = "appointments_partitioned"
+UNPARTITIONED = "appointments_unpartitioned"
+MIGRATION_INDEX = "appointments_migration_updated_at"
+# Writers' clocks may be this far behind the migration's
+CLOCK_SKEW = timedelta(minutes=5)
+
+MONTH_NAME = re.compile(r"^appointments_(\d{4})_(\d{2})$")
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def next_month(month: date) -> date:
+    return (month.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def months_between(first: date, last: date) -> list[date]:
+    """The first day of every month from ``first``'s to ``last``'s."""
+    months = []
+    month = month_start(first)
+    while month <= last:
+        months.append(month)
+        month = next_month(month)
+    return months
+
+
+def month_table(month: date) -> str:
+    return f"appointments_{month.year:04d}_{month.month:02d}"
+
+
+def create_month_sql(parent: str, month: date, modulus: int) -> list[str]:
+    """
+    Statements creating a month's partition and its hash partitions. Leaves are
+    created on their own with their unique index, then attached, so the index gets
+    a name of our choosing rather than a generated one.
+    """
+    table = month_table(month)
+    statements = [
+        f"CREATE TABLE {table} PARTITION OF {parent} "
+        f"FOR VALUES FROM ('{month}') TO ('{next_month(month)}') "
+        "PARTITION BY HASH (hospital_id)"
+    ]
+    for remainder in range(modulus):
+        leaf = f"{table}_h{remainder}"
+        statements += [
+            f"CREATE TABLE {leaf} (LIKE {parent} INCLUDING DEFAULTS)",
+            f"CREATE UNIQUE INDEX idx_unique_doctor_timeslot_{leaf.split('_', 1)[1]} "
+            f"ON {leaf} (doctor_id, appointment_time, hospital_id)",
+            f"ALTER TABLE {table} ATTACH PARTITION {leaf} "
+            f"FOR VALUES WITH (MODULUS {modulus}, REMAINDER {remainder})",
+        ]
+    return statements
+
+
+def create_parent_sql(name: str) -> list[str]:
+    """Statements creating an empty partitioned table shaped like ``appointments``."""
+    return [
+        f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS) "
+        "PARTITION BY RANGE (appointment_time)",
+        f"ALTER TABLE {name} ADD PRIMARY KEY (id, appointment_time, hospital_id)",
+        f"CREATE UNIQUE INDEX {name}_doctor_timeslot "
+        f"ON {name} (doctor_id, appointment_time, hospital_id)",
+        f"CREATE INDEX {name}_id ON {name} (id)",
+        f"CREATE INDEX {name}_patient ON {name} (patient_id, appointment_time)",
+        f"ALTER TABLE {name} ADD FOREIGN KEY (doctor_id) REFERENCES doctors (id)",
+        f"ALTER TABLE {name} ADD FOREIGN KEY (hospital_id) REFERENCES hospitals (id)",
+        f"ALTER TABLE {name} ADD FOREIGN KEY (patient_id) REFERENCES patients (id)",
+        f"ALTER TABLE {name} ADD FOREIGN KEY (created_by) REFERENCES people (id)",
+    ]
+
+
+def is_partitioned(connection: Connection, name: str = PARENT) -> bool:
+    kind: str | None = connection.scalar(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"),
+        {"name": name},
+    )
+    return kind == "p"
+
+
+def existing_months(connection: Connection, parent: str = PARENT) -> set[date]:
+    names = connection.scalars(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:parent)"
+        ),
+        {"parent": parent},
+    )
+    months = set()
+    for name in names:
+        if match := MONTH_NAME.match(name):
+            months.add(date(int(match[1]), int(match[2]), 1))
+    return months
+
+
+def extend(
+    connection: Connection,
+    first: date,
+    last: date,
+    modulus: int,
+    parent: str = PARENT,
+) -> list[date]:
+    """Create the missing months from ``first``'s to ``last``'s; return them."""
+    missing = sorted(
+        set(months_between(first, last)) - existing_months(connection, parent)
+    )
+    for month in missing:
+        for statement in create_month_sql(parent, month, modulus):
+            connection.exec_driver_sql(statement)
+    return missing
+
+
+def add_hospital_id(engine: Engine, batch_size: int) -> bool:
+    """
+    Add and backfill ``appointments.hospital_id`` if it's missing, without blocking
+    the app for longer than a batch. Return whether it was missing.
+    """
+    columns = {column["name"] for column in inspect(engine).get_columns(PARENT)}
+    if "hospital_id" in columns:
+        return False
+
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            f"ALTER TABLE {PARENT} ADD COLUMN hospital_id integer "
+            "REFERENCES hospitals (id)"
+        )
+        last = connection.scalar(text(f"SELECT coalesce(max(id), 0) FROM {PARENT}"))
+    for after in range(0, last, batch_size):
+        with engine.begin() as connection:
+            connection.execute(
+                text(
+                    f"UPDATE {PARENT} a SET hospital_id = d.hospital_id "
+                    "FROM doctors d WHERE d.id = a.doctor_id "
+                    "AND a.id > :after AND a.id <= :until"
+                ),
+                {"after": after, "until": after + batch_size},
+            )
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        # A validated check lets SET NOT NULL skip its scan under an exclusive lock
+        for statement in (
+            f"ALTER TABLE {PARENT} ADD CONSTRAINT appointments_hospital_id_not_null "
+            "CHECK (hospital_id IS NOT NULL) NOT VALID",
+            f"ALTER TABLE {PARENT} VALIDATE CONSTRAINT "
+            "appointments_hospital_id_not_null",
+            f"ALTER TABLE {PARENT} ALTER COLUMN hospital_id SET NOT NULL",
+            f"ALTER TABLE {PARENT} DROP CONSTRAINT appointments_hospital_id_not_null",
+            "CREATE UNIQUE INDEX CONCURRENTLY idx_unique_doctor_timeslot_new "
+            f"ON {PARENT} (doctor_id, appointment_time, hospital_id)",
+            "DROP INDEX CONCURRENTLY idx_unique_doctor_timeslot",
+            "ALTER INDEX idx_unique_doctor_timeslot_new "
+            "RENAME TO idx_unique_doctor_timeslot",
+        ):
+            connection.exec_driver_sql(statement)
+    return True
+
+
+def migrate(  # pylint: disable=too-many-locals
+    engine: Engine, modulus: int, months_ahead: int, batch_size: int
+) -> int | None:
+    """
+    Partition ``appointments``, or only extend it if it already is. Return how many
+    rows were copied, or ``None`` if it was already partitioned.
+    """
+    today = datetime.now(UTC).date()
+    ahead = month_start(today) + timedelta(days=31 * months_ahead)
+    with engine.begin() as connection:
+        if is_partitioned(connection):
+            extend(connection, today, ahead, modulus)
+            return None
+
+    add_hospital_id(engine, batch_size)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.exec_driver_sql(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {MIGRATION_INDEX} "
+            f"ON {PARENT} (updated_at)"
+        )
+
+    started = datetime.now(UTC).replace(tzinfo=None) - CLOCK_SKEW
+    with engine.begin() as connection:
+        last, first_time, last_time = connection.execute(
+            text(
+                f"SELECT coalesce(max(id), 0), min(appointment_time), "
+                f"max(appointment_time) FROM {PARENT}"
+            )
+        ).one()
+        for statement in create_parent_sql(BUILDING):
+            connection.exec_driver_sql(statement)
+        first = min(today, first_time.date()) if first_time else today
+        until = max(ahead, last_time.date()) if last_time else ahead
+        extend(connection, first, until, modulus, parent=BUILDING)
+
+    for after in range(0, last, batch_size):
+        with engine.begin() as connection:
+            connection.execute(
+                text(
+                    f"INSERT INTO {BUILDING} SELECT * FROM {PARENT} "
+                    "WHERE id > :after AND id <= :until"
+                ),
+                {"after": after, "until": after + batch_size},
+            )
+
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f"LOCK TABLE {PARENT} IN EXCLUSIVE MODE")
+        # Slots opened beyond the months created above would have nowhere to go
+        latest = connection.scalar(text(f"SELECT max(appointment_time) FROM {PARENT}"))
+        if latest is not None:
+            extend(connection, first, latest.date(), modulus, parent=BUILDING)
+        changed = {"started": started, "last": last}
+        connection.execute(
+            text(
+                f"DELETE FROM {BUILDING} WHERE id IN "
+                f"(SELECT id FROM {PARENT} WHERE updated_at >= :started)"
+            ),
+            changed,
+        )
+        connection.execute(
+            text(
+                f"INSERT INTO {BUILDING} SELECT * FROM {PARENT} "
+                "WHERE updated_at >= :started OR id > :last"
+            ),
+            changed,
+        )
+        copied = connection.scalar(text(f"SELECT count(*) FROM {BUILDING}"))
+        for statement in (
+            f"ALTER TABLE {PARENT} RENAME TO {UNPARTITIONED}",
+            f"ALTER TABLE {BUILDING} RENAME TO {PARENT}",
+            f"ALTER SEQUENCE {PARENT}_id_seq OWNED BY {PARENT}.id",
+            f"DROP INDEX {MIGRATION_INDEX}",
+        ):
+            connection.exec_driver_sql(statement)
+    return int(copied)
+
+
+def main(argv: Sequence[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Partition the appointments table by month and hospital."
+    )
+    parser.add_argument("command", choices=["migrate", "extend"])
+    parser.add_argument("--database-url", default=settings.database_url)
+    parser.add_argument("--modulus", type=int, default=settings.partition_modulus)
+    parser.add_argument(
+        "--months-ahead", type=int, default=settings.partition_months_ahead
+    )
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    args = parser.parse_args(argv)
+
+    engine = create_engine(args.database_url)
+    if args.command == "migrate":
+        copied = migrate(engine, args.modulus, args.months_ahead, args.batch_size)
+        print("Already partitioned" if copied is None else f"Copied {copied} rows")
+    else:
+        today = datetime.now(UTC).date()
+        ahead = month_start(today) + timedelta(days=31 * args.months_ahead)
+        with engine.begin() as connection:
+            created = extend(connection, today, ahead, args.modulus)
+        print(f"Created {len(created)} months")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
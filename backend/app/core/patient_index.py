@@ -0,0 +1,371 @@
+"""
+In-memory index for finding a patient by name, phone or email while booking.
+
+Each patient is split into tokens: the words of their name and email (``Jane Doe``,
+``jane.doe@example.com`` gives ``jane``, ``doe``, ``example`` and ``com``) and the
+digits of their phone. Text is folded to lower case without accents. A search
+matches the patients having, for every word typed, a token starting with it, so
+``jan do`` finds Jane Doe as it's typed. A query without letters is read as one
+phone number, so ``(555) 01`` matches ``555-0123``. Matches are ranked by name.
+
+The tokens are kept in sorted numpy arrays: each distinct token once in
+``tokens``, and its patients in ``postings[starts[i]:starts[i + 1]]``. The patients
+with a token starting with a word are then one slice of ``postings``, found by
+binary search. Patients are numbered in name order, so a search marks each word's
+slice in an array of flags, one per patient, and the first flags set by every word
+are the first matches by name. Nothing is sorted while searching.
+
+The arrays are built in a background thread when a worker starts (or by the first
+search, if it comes sooner) and rebuilt every ``patient_index_rebuild_seconds``, or sooner after
+``patient_index_max_changes`` changes. In between, patients committed through
+this worker's sessions are kept in a small overlay that searches scan as well, and
+patients added by other workers are picked up by id every
+``patient_index_refresh_seconds``. Other workers' edits show up after the next
+rebuild.
+"""
+
+from __future__ import annotations
+
+import heapq
+import re
+import threading
+import time as clock
+import unicodedata
+from dataclasses import dataclass
+from typing import Any, Iterable
+
+import numpy as np
+from sqlalchemy import Engine, Row, Select, event, inspect, select
+from sqlalchemy.orm import Session
+
+from app.models import Patient
+
+from .config import settings
+
+# Longer tokens and words are cut, which only makes long words match a little more
+MAX_TOKEN = 24
+WORD = re.compile(r"[^\W_]+")
+ASCII_WORD = re.compile(rb"[^\W_]+")
+NON_DIGIT = re.compile(r"\D+")
+PHONE_QUERY = re.compile(r"^[\d\s()+.-]+$")
+
+_PENDING_KEY = "patient_index_changes"
+
+
+def fold(text: str) -> str:
+    """Lower case ``text`` and strip its accents."""
+    if text.isascii():
+        return text.lower()
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def _token(word: str) -> bytes:
+    return word.encode()[:MAX_TOKEN]
+
+
+def query_words(query: str) -> list[bytes]:
+    """The words of a search, each to be matched as the start of a token."""
+    if PHONE_QUERY.match(query):
+        digits = NON_DIGIT.sub("", query)
+        return [_token(digits)] if digits else []
+    return list(dict.fromkeys(_token(word) for word in WORD.findall(fold(query))))
+
+
+@dataclass(frozen=True, slots=True)
+class PatientEntry:
+    """A patient's folded name, to rank by, and tokens."""
+
+    name: str
+    tokens: tuple[bytes, ...]
+
+    @classmethod
+    def of(cls, name: str, phone: str | None, email: str | None) -> PatientEntry:
+        name = fold(name)
+        text = f"{name} {fold(email or '')}"
+        if text.isascii():
+            words = ASCII_WORD.findall(text.encode())
+        else:
+            words = [word.encode() for word in WORD.findall(text)]
+        digits = NON_DIGIT.sub("", phone or "")
+        if digits:
+            words.append(digits.encode())
+        return cls(name, tuple(dict.fromkeys(words)))
+
+    def matches(self, words: Iterable[bytes]) -> bool:
+        return all(any(t.startswith(w) for t in self.tokens) for w in words)
+
+
+def patients_query() -> Select:
+    return select(Patient.id, Patient.name, Patient.phone, Patient.email).order_by(
+        Patient.id
+    )
+
+
+@dataclass
+class Postings:
+    """
+    Sorted token and posting arrays for a snapshot of the patients. Patients are
+    numbered in name order, and postings hold those numbers, so the first matches
+    by number are the first by name.
+    """
+
+    tokens: np.ndarray
+    starts: np.ndarray
+    postings: np.ndarray
+    # The patient id of each number
+    ids: np.ndarray
+    # Patient ids in order, and the number of each
+    sorted_ids: np.ndarray
+    numbers: np.ndarray
+
+    @classmethod
+    def build(cls, rows: Iterable[Row | tuple[int, str, Any, Any]]) -> Postings:
+        entries = sorted(
+            (
+                (PatientEntry.of(name, phone, email), patient_id)
+                for patient_id, name, phone, email in rows
+            ),
+            key=lambda entry: (entry[0].name, entry[1]),
+        )
+        token_list: list[bytes] = []
+        token_numbers: list[int] = []
+        for number, (entry, _) in enumerate(entries):
+            token_list += entry.tokens
+            token_numbers += [number] * len(entry.tokens)
+
+        tokens = np.array(token_list, dtype=f"S{MAX_TOKEN}")
+        # Stable, so each token's patients stay in name order
+        order = np.argsort(tokens, kind="stable")
+        tokens = tokens[order]
+        first = np.ones(len(tokens), dtype=bool)
+        first[1:] = tokens[1:] != tokens[:-1]
+        ids = np.array([patient_id for _, patient_id in entries], dtype=np.int64)
+        by_id = np.argsort(ids)
+        return cls(
+            tokens=tokens[first],
+            starts=np.append(np.flatnonzero(first), len(tokens)),
+            postings=np.array(token_numbers, dtype=np.int32)[order],
+            ids=ids,
+            sorted_ids=ids[by_id],
+            numbers=by_id,
+        )
+
+    @property
+    def last_id(self) -> int:
+        return int(self.sorted_ids[-1]) if len(self.sorted_ids) else 0
+
+    def _slice(self, word: bytes) -> np.ndarray:
+        """The numbers of the patients with a token starting with ``word``."""
+        first = np.searchsorted(self.tokens, word)
+        last = np.searchsorted(self.tokens, word + b"\xff")
+        return self.postings[self.starts[first] : self.starts[last]]
+
+    def top(self, words: list[bytes], limit: int, exclude: Iterable[int]) -> list[int]:
+        """
+        Ids of the first ``limit`` patients by name having a token starting with each
+        word, leaving out the ``exclude`` ids.
+        """
+        matched = np.zeros(len(self.ids), dtype=bool)
+        slices = sorted((self._slice(word) for word in words), key=len)
+        matched[slices[0]] = True
+        for numbers in slices[1:]:
+            also = np.zeros(len(self.ids), dtype=bool)
+            also[numbers] = True
+            matched &= also
+        excluded = np.fromiter(exclude, dtype=np.int64)
+        if len(excluded):
+            found = np.searchsorted(self.sorted_ids, excluded)
+            found = found[found < len(self.sorted_ids)]
+            known = found[np.isin(self.sorted_ids[found], excluded)]
+            matched[self.numbers[known]] = False
+        top: list[int] = self.ids[np.flatnonzero(matched)[:limit]].tolist()
+        return top
+
+
+class PatientIndex:  # pylint: disable=too-many-instance-attributes
+    """Token index over every patient, plus the changes since it was built."""
+
+    # The arrays, the overlay and the timings of their upkeep are one piece of state
+
+    def __init__(
+        self, rebuild_seconds: float, refresh_seconds: float, max_changes: int
+    ) -> None:
+        self.rebuild_seconds = rebuild_seconds
+        self.refresh_seconds = refresh_seconds
+        self.max_changes = max_changes
+        self._postings: Postings | None = None
+        self._built_at = 0.0
+        self._refreshed_at = 0.0
+        # Patient id to (change number, entry), or no entry once deleted
+        self._changes: dict[int, tuple[int, PatientEntry | None]] = {}
+        self._sequence = 0
+        # The highest id read from the database; the overlay's ids don't count, as
+        # other workers may commit lower ones after them
+        self._read_id = 0
+        self._rebuilding: threading.Thread | None = None
+        # Guards the state above; held briefly, never while the database is queried
+        self._lock = threading.RLock()
+        # Held while arrays are built, so a search finding none waits for the build
+        # under way rather than starting another
+        self._building = threading.Lock()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._postings = None
+            self._changes.clear()
+
+    def apply(self, changes: Iterable[tuple[int, PatientEntry | None]]) -> None:
+        """Overlay committed patient changes on the arrays."""
+        with self._lock:
+            for patient_id, entry in changes:
+                self._sequence += 1
+                self._changes[patient_id] = (self._sequence, entry)
+
+    def rebuild(self, bind: Engine) -> None:
+        """Build the arrays afresh and drop the changes they now include."""
+        with self._lock:
+            sequence = self._sequence
+        with Session(bind) as db:
+            result = db.execute(
+                patients_query(), execution_options={"yield_per": 10_000}
+            )
+            postings = Postings.build(result)
+        with self._lock:
+            self._postings = postings
+            self._read_id = postings.last_id
+            self._built_at = self._refreshed_at = clock.monotonic()
+            self._changes = {
+                patient_id: change
+                for patient_id, change in self._changes.items()
+                if change[0] > sequence
+            }
+
+    def _rebuild_in_background(self, bind: Engine) -> None:
+        def run() -> None:
+            try:
+                with self._building:
+                    self.rebuild(bind)
+            finally:
+                self._rebuilding = None
+
+        self._rebuilding = threading.Thread(target=run, daemon=True)
+        self._rebuilding.start()
+
+    def warm(self, bind: Engine) -> None:
+        """Start building the arrays in the background, ahead of the first search."""
+        with self._lock:
+            if self._postings is None and self._rebuilding is None:
+                self._rebuild_in_background(bind)
+
+    def _build_first(self, bind: Engine) -> Postings:
+        """The arrays, built now unless another thread already is or has."""
+        with self._building:
+            if self._postings is None:
+                self.rebuild(bind)
+        assert self._postings is not None
+        return self._postings
+
+    def _refresh(self, db: Session, postings: Postings) -> None:
+        """Pick up patients added since the last look, wherever they were added."""
+        with self._lock:
+            self._refreshed_at = clock.monotonic()
+            last_id = max(self._read_id, postings.last_id)
+        rows = db.execute(patients_query().where(Patient.id > last_id)).all()
+        with self._lock:
+            self._read_id = max(self._read_id, last_id, *(row.id for row in rows))
+            # Patients committed here are already overlaid, perhaps with later edits
+            self.apply(
+                (row.id, PatientEntry.of(*row[1:]))
+                for row in rows
+                if row.id not in self._changes
+            )
+
+    def _current(self, db: Session) -> Postings:
+        bind = db.get_bind()
+        assert isinstance(bind, Engine)
+        postings = self._postings or self._build_first(bind)
+        now = clock.monotonic()
+        if now >= self._refreshed_at + self.refresh_seconds:
+            self._refresh(db, postings)
+        with self._lock:
+            due = now >= self._built_at + self.rebuild_seconds
+            if self._rebuilding is None and (
+                due or len(self._changes) > self.max_changes
+            ):
+                self._rebuild_in_background(bind)
+        return postings
+
+    def search(self, db: Session, query: str, limit: int) -> list[int]:
+        """
+        Ids of up to ``2 * limit`` candidates: the arrays' first ``limit`` matches
+        and the overlay's, each by name. ``search_patients`` merges them.
+        """
+        words = query_words(query)
+        if not words:
+            return []
+        postings = self._current(db)
+        with self._lock:
+            top = postings.top(words, limit, self._changes)
+            overlay = heapq.nsmallest(
+                limit,
+                (
+                    (entry.name, patient_id)
+                    for patient_id, (_, entry) in self._changes.items()
+                    if entry is not None and entry.matches(words)
+                ),
+            )
+        return top + [patient_id for _, patient_id in overlay]
+
+
+def search_patients(
+    db: Session, index: PatientIndex, query: str, limit: int
+) -> list[Row]:
+    """The patients matching a search, first ``limit`` by name."""
+    ids = index.search(db, query, limit)
+    if not ids:
+        return []
+    rows = db.execute(patients_query().where(Patient.id.in_(ids))).all()
+    return sorted(rows, key=lambda row: (fold(row.name), row.id))[:limit]
+
+
+def _entry(patient: Patient) -> PatientEntry:
+    return PatientEntry.of(patient.name, patient.phone, patient.email)
+
+
+@event.listens_for(Session, "after_flush")
+def _record_changed_patients(session: Session, _flush_context: Any) -> None:
+    changes: list[tuple[int, PatientEntry | None]] = []
+    for obj in session.new:
+        if isinstance(obj, Patient):
+            changes.append((obj.id, _entry(obj)))
+    for obj in session.dirty:
+        if isinstance(obj, Patient) and any(
+            inspect(obj).attrs[key].history.has_changes()
+            for key in ("name", "phone", "email")
+        ):
+            changes.append((obj.id, _entry(obj)))
+    for obj in session.deleted:
+        if isinstance(obj, Patient):
+            changes.append((obj.id, None))
+    if changes:
+        session.info.setdefault(_PENDING_KEY, []).extend(changes)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_committed_patients(session: Session) -> None:
+    changes = session.info.pop(_PENDING_KEY, [])
+    if changes:
+        patient_index.apply(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_patients(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+patient_index = PatientIndex(
+    rebuild_seconds=settings.patient_index_rebuild_seconds,
+    refresh_seconds=settings.patient_index_refresh_seconds,
+    max_changes=settings.patient_index_max_changes,
+)
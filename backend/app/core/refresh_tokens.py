@@ -0,0 +1,151 @@
+"""
+Store of live refresh tokens.
+
+Every login starts a token *family*. The store keeps one entry per family holding a
+keyed digest (HMAC-SHA256 with the app secret) of the family's current refresh token,
+so checking a token is a signature check, a digest and a single key lookup rather than
+a bcrypt comparison against the user row. Raw tokens are never stored.
+
+Each refresh rotates the token: the family's entry moves to the new token's digest in
+one compare-and-swap, so of two refreshes racing with the same token only one gets a
+new token. Presenting a token that has already been rotated means it was copied, so
+the whole family is revoked and the holder has to log in again, except for the token
+just replaced, which is only turned away for ``grace`` seconds since it's usually a
+second tab refreshing at the same time. All of a user's families can also be revoked
+at once (e.g. when the account is deactivated) by recording a cutoff before which
+tokens are no longer accepted; tokens carry their issue time to the microsecond, so
+one issued right after the cutoff isn't caught by it.
+
+The store's methods make blocking calls to its backend, so async routes run them in
+the threadpool.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import hmac
+import time as clock
+from typing import Callable
+from uuid import uuid4
+
+from .auth import create_refresh_token, verify_jwt_token
+from .cache import CacheBackend, make_backend
+from .config import settings
+
+
+class RefreshTokenStore:
+    """Issue, rotate and revoke refresh tokens; entries expire after ``ttl`` seconds."""
+
+    def __init__(
+        self, backend: CacheBackend, ttl: int, secret: str, grace: int = 0
+    ) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.grace = grace
+        self._secret = secret.encode("utf-8")
+        self._revoke_listeners: list[Callable[[str], None]] = []
+
+    def on_revoke(self, listener: Callable[[str], None]) -> None:
+        """Call ``listener(user_id)`` whenever some of a user's tokens are revoked."""
+        self._revoke_listeners.append(listener)
+
+    def _revoked(self, user_id: str) -> None:
+        for listener in self._revoke_listeners:
+            listener(user_id)
+
+    def digest(self, token: str) -> str:
+        return hmac.new(self._secret, token.encode("utf-8"), hashlib.sha256).hexdigest()
+
+    @staticmethod
+    def family_key(family: str) -> str:
+        return f"refresh:family:{family}"
+
+    @staticmethod
+    def previous_key(family: str) -> str:
+        return f"refresh:previous:{family}"
+
+    @staticmethod
+    def user_key(user_id: str) -> str:
+        return f"refresh:user:{user_id}"
+
+    def issue(self, user_id: str, email: str, family: str | None = None) -> str:
+        """Create a refresh token, starting a new family unless one is given."""
+        family = family or uuid4().hex
+        token = create_refresh_token(user_id, email, family)
+        self.backend.set_many(
+            {self.family_key(family): self.digest(token).encode()}, self.ttl
+        )
+        return token
+
+    def verify(self, token: str) -> dict | None:
+        """
+        Return the payload of a live refresh token, or ``None``. A token that has been
+        rotated away revokes its whole family, unless it was replaced within the grace
+        period.
+        """
+        payload = verify_jwt_token(token)
+        if not payload or "fam" not in payload:
+            return None
+        family_key = self.family_key(payload["fam"])
+        previous_key = self.previous_key(payload["fam"])
+        user_key = self.user_key(payload["sub"])
+        entries = self.backend.get_many([family_key, previous_key, user_key])
+
+        current = entries.get(family_key)
+        if current is None:  # Logged out, revoked or expired
+            return None
+        digest = self.digest(token).encode()
+        if not hmac.compare_digest(current, digest):
+            if not hmac.compare_digest(entries.get(previous_key, b""), digest):
+                self.revoke_family(payload["fam"], payload["sub"])
+            return None
+        cutoff = entries.get(user_key)
+        if cutoff is not None and payload["iat"] < float(cutoff):
+            return None
+        return payload
+
+    def rotate(self, token: str) -> tuple[dict, str] | None:
+        """Exchange a live refresh token for its payload and the family's next token."""
+        payload = self.verify(token)
+        if payload is None:
+            return None
+        family = payload["fam"]
+        digest = self.digest(token).encode()
+        if self.grace:
+            # Recorded first, so a racing refresh that loses the swap finds it
+            self.backend.set_many({self.previous_key(family): digest}, self.grace)
+        rotated = create_refresh_token(payload["sub"], payload["email"], family)
+        if not self.backend.swap(
+            self.family_key(family), digest, self.digest(rotated).encode(), self.ttl
+        ):
+            return None  # Another refresh rotated this token first
+        return payload, rotated
+
+    def revoke(self, token: str) -> None:
+        """Revoke the family a token belongs to, e.g. on logout."""
+        payload = verify_jwt_token(token)
+        if payload and "fam" in payload:
+            self.revoke_family(payload["fam"], payload["sub"])
+
+    def revoke_family(self, family: str, user_id: str) -> None:
+        self.backend.delete_many([self.family_key(family)])
+        self._revoked(user_id)
+
+    def revoke_user(self, user_id: str) -> None:
+        """Reject every refresh token issued to a user so far."""
+        self.backend.set_many(
+            {self.user_key(user_id): str(clock.time()).encode()}, self.ttl
+        )
+        self._revoked(user_id)
+
+
+refresh_tokens = RefreshTokenStore(
+    make_backend(
+        settings.refresh_token_backend,
+        settings.refresh_token_max_entries,
+        prefix="auth:",
+    ),
+    ttl=settings.refresh_token_expire_days * 24 * 60 * 60,
+    secret=settings.secret_key,
+    grace=settings.refresh_token_grace_seconds,
+)
@@ -0,0 +1,310 @@
+"""
+Short lived reservations on open slots.
+
+When someone starts booking a slot they claim a reservation on it, which expires after
+``reservation_ttl`` seconds unless it is extended. While it is held nobody else can
+claim or book the slot, so two people racing for the same slot find out as soon as
+they click rather than when the second booking hits ``idx_unique_doctor_timeslot``.
+Calendars mark reserved slots as not bookable.
+
+Reservations are keyed by appointment id and hold the id of the user who claimed them.
+Nobody holds more than ``reservation_max_per_user`` at once, so one caller can't take
+a whole calendar out of circulation. Claim, extend and release are each a single
+atomic operation on the backend: an in-process store for a single worker, or Redis so
+every worker sees the same claims.
+"""
+
+from __future__ import annotations
+
+import threading
+import time as clock
+from dataclasses import replace
+from typing import Iterable, Protocol, Sequence
+
+import redis
+
+from .availability import CalendarDay
+from .cache import redis_client
+from .config import settings
+
+# Set the key for the caller unless someone else holds it, or the caller already
+# holds as many other keys as allowed. Each holder's keys are kept in a hash with
+# their expiry times, which also drops the ones that lapsed.
+CLAIM_SCRIPT = """
+local holder = redis.call("get", KEYS[1])
+if holder and holder ~= ARGV[1] then
+    return 0
+end
+local now = tonumber(ARGV[3])
+local held = 0
+local keys = redis.call("hgetall", KEYS[2])
+for i = 1, #keys, 2 do
+    if tonumber(keys[i + 1]) <= now then
+        redis.call("hdel", KEYS[2], keys[i])
+    elseif keys[i] ~= KEYS[1] then
+        held = held + 1
+    end
+end
+if held >= tonumber(ARGV[4]) then
+    return -1
+end
+redis.call("set", KEYS[1], ARGV[1], "px", ARGV[2])
+redis.call("hset", KEYS[2], KEYS[1], now + tonumber(ARGV[2]))
+redis.call("pexpire", KEYS[2], ARGV[2])
+return 1
+"""
+
+# Extend the key's expiry only while it is still held by the caller
+EXTEND_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    redis.call("hset", KEYS[2], KEYS[1], tonumber(ARGV[3]) + tonumber(ARGV[2]))
+    redis.call("pexpire", KEYS[2], ARGV[2])
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Delete the key only while it is still held by the caller
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    redis.call("hdel", KEYS[2], KEYS[1])
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class TooManyReservations(Exception):
+    """The holder already has as many reservations as allowed."""
+
+
+class ReservationBackend(Protocol):
+    """
+    Atomic operations on holder-owned keys that expire. Claiming a key the holder
+    already has extends it, and claiming beyond ``limit`` keys raises
+    ``TooManyReservations``.
+    """
+
+    def claim(self, key: str, holder: str, ttl: float, limit: int) -> bool: ...
+
+    def extend(self, key: str, holder: str, ttl: float) -> bool: ...
+
+    def release(self, key: str, holder: str) -> bool: ...
+
+    def holders(self, keys: Sequence[str]) -> dict[str, str]: ...
+
+    def clear(self) -> None: ...
+
+
+class MemoryReservations:
+    """In-process reservations, for a single worker."""
+
+    def __init__(self) -> None:
+        self._held: dict[str, tuple[float, str]] = {}
+        # The keys claimed by each holder, some of which may have lapsed since
+        self._claimed: dict[str, set[str]] = {}
+        self._lock = threading.Lock()
+
+    def _holder(self, key: str, now: float) -> str | None:
+        entry = self._held.get(key)
+        if entry is None:
+            return None
+        expires, holder = entry
+        if expires <= now:
+            del self._held[key]
+            return None
+        return holder
+
+    def _count(self, holder: str, now: float) -> int:
+        keys = self._claimed.get(holder, set())
+        keys.difference_update(
+            [key for key in keys if self._holder(key, now) != holder]
+        )
+        if not keys:
+            self._claimed.pop(holder, None)
+        return len(keys)
+
+    def claim(self, key: str, holder: str, ttl: float, limit: int) -> bool:
+        now = clock.monotonic()
+        with self._lock:
+            current = self._holder(key, now)
+            if current is not None and current != holder:
+                return False
+            if current is None and self._count(holder, now) >= limit:
+                raise TooManyReservations
+            self._held[key] = (now + ttl, holder)
+            self._claimed.setdefault(holder, set()).add(key)
+            return True
+
+    def extend(self, key: str, holder: str, ttl: float) -> bool:
+        now = clock.monotonic()
+        with self._lock:
+            if self._holder(key, now) != holder:
+                return False
+            self._held[key] = (now + ttl, holder)
+            return True
+
+    def release(self, key: str, holder: str) -> bool:
+        now = clock.monotonic()
+        with self._lock:
+            if self._holder(key, now) != holder:
+                return False
+            del self._held[key]
+            self._claimed[holder].discard(key)
+            return True
+
+    def holders(self, keys: Sequence[str]) -> dict[str, str]:
+        now = clock.monotonic()
+        with self._lock:
+            found = {key: self._holder(key, now) for key in keys}
+        return {key: holder for key, holder in found.items() if holder is not None}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._held.clear()
+            self._claimed.clear()
+
+
+class RedisReservations:
+    """
+    Reservations shared by every worker. Claim, extend and release run as Lua
+    scripts so checking the holder and changing the keys are one step. Expiry times in
+    the holders' hashes come from the workers' clocks.
+    Unlike the cache, errors propagate: a claim that can't be checked must not succeed.
+    """
+
+    def __init__(self, client: redis.Redis, prefix: str = "reservation:") -> None:
+        self.client = client
+        self.prefix = prefix
+
+    def _keys(self, key: str, holder: str) -> tuple[str, str]:
+        return self.prefix + key, f"{self.prefix}holder:{holder}"
+
+    def claim(self, key: str, holder: str, ttl: float, limit: int) -> bool:
+        claimed = self.client.eval(
+            CLAIM_SCRIPT,
+            2,
+            *self._keys(key, holder),
+            holder,
+            str(int(ttl * 1000)),
+            str(int(clock.time() * 1000)),
+            str(limit),
+        )
+        if claimed == -1:
+            raise TooManyReservations
+        return bool(claimed)
+
+    def extend(self, key: str, holder: str, ttl: float) -> bool:
+        return bool(
+            self.client.eval(
+                EXTEND_SCRIPT,
+                2,
+                *self._keys(key, holder),
+                holder,
+                str(int(ttl * 1000)),
+                str(int(clock.time() * 1000)),
+            )
+        )
+
+    def release(self, key: str, holder: str) -> bool:
+        return bool(
+            self.client.eval(RELEASE_SCRIPT, 2, *self._keys(key, holder), holder)
+        )
+
+    def holders(self, keys: Sequence[str]) -> dict[str, str]:
+        if not keys:
+            return {}
+        values: list[bytes | None] = self.client.mget(  # type: ignore[assignment]
+            [self.prefix + key for key in keys]
+        )
+        return {
+            key: value.decode() for key, value in zip(keys, values) if value is not None
+        }
+
+    def clear(self) -> None:
+        names = list(self.client.scan_iter(match=self.prefix + "*"))
+        if names:
+            self.client.delete(*names)
+
+
+def make_reservation_backend(kind: str) -> ReservationBackend:
+    """Build the backend named in the settings."""
+    if kind == "redis":
+        return RedisReservations(redis_client())
+    if kind == "memory":
+        return MemoryReservations()
+    raise ValueError(f"Unknown reservation backend: {kind}")
+
+
+class Reservations:
+    """Reservations on appointment slots, held by user id."""
+
+    def __init__(self, backend: ReservationBackend, ttl: float, limit: int) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.limit = limit
+
+    @staticmethod
+    def key(appointment_id: int) -> str:
+        return str(appointment_id)
+
+    def claim(self, appointment_id: int, holder: str) -> bool:
+        """
+        Reserve a slot. Claiming a slot you already hold extends it. Raises
+        ``TooManyReservations`` when the holder has ``limit`` other slots reserved.
+        """
+        return self.backend.claim(
+            self.key(appointment_id), holder, self.ttl, self.limit
+        )
+
+    def extend(self, appointment_id: int, holder: str) -> bool:
+        return self.backend.extend(self.key(appointment_id), holder, self.ttl)
+
+    def release(self, appointment_id: int, holder: str) -> bool:
+        return self.backend.release(self.key(appointment_id), holder)
+
+    def holder(self, appointment_id: int) -> str | None:
+        key = self.key(appointment_id)
+        return self.backend.holders([key]).get(key)
+
+    def reserved(self, appointment_ids: Iterable[int]) -> set[int]:
+        """The given appointments that are currently reserved."""
+        ids = list(appointment_ids)
+        held = self.backend.holders(
+            [self.key(appointment_id) for appointment_id in ids]
+        )
+        return {
+            appointment_id for appointment_id in ids if self.key(appointment_id) in held
+        }
+
+    def mark_reserved(self, days: list[CalendarDay]) -> list[CalendarDay]:
+        """Return the calendar with reserved open slots marked as not bookable."""
+        reserved = self.reserved(
+            slot.appointment_id for day in days for slot in day.slots if slot.bookable
+        )
+        if not reserved:
+            return days
+        return [
+            replace(
+                day,
+                slots=[
+                    (
+                        replace(slot, bookable=False, reserved=True)
+                        if slot.appointment_id in reserved
+                        else slot
+                    )
+                    for slot in day.slots
+                ],
+            )
+            for day in days
+        ]
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+
+reservations = Reservations(
+    make_reservation_backend(settings.reservation_backend),
+    ttl=settings.reservation_ttl,
+    limit=settings.reservation_max_per_user,
+)
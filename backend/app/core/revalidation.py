@@ -0,0 +1,338 @@
+"""
+Incremental revalidation of appointments after availability edits.
+
+Rechecking every appointment against its doctor's availability in a nightly scan
+doesn't scale to hundreds of millions of rows a year. Instead each edit that can
+invalidate slots records the range it touched in ``availability_changes``, in the
+same transaction as the edit:
+
+- a hospital's opening hours or timezone changing, for all its doctors from today,
+- a doctor moving to another hospital, for that doctor from today, and
+- a slot being moved to another doctor or time, for that doctor and date.
+
+ORM writes are recorded automatically when the session flushes. Bulk Core
+statements that edit availability call ``record_change`` themselves.
+
+The revalidation worker takes the changes in id order and reads the slots in each
+range, ``revalidation_batch_size`` at a time by doctor and time, checking that each
+is still one of its hospital's opening hours and belongs to the doctor's current
+hospital. A booked slot that doesn't is recorded in ``appointment_conflicts`` for
+staff to reschedule, and an open one is removed so it can't be booked. Each batch
+commits its results together with the change's checkpoint (the last slot checked),
+so a stopped worker carries on where it left off, and a finished change is deleted.
+
+Slots are checked as they are when read, so changes that a pending one already
+covers are dropped before it starts. Run one worker per database.
+"""
+
+from __future__ import annotations
+
+import argparse
+import time as clock
+from dataclasses import dataclass
+from datetime import UTC, date, datetime
+from enum import StrEnum
+from typing import Any, Sequence
+
+from sqlalchemy import (
+    Row,
+    Select,
+    and_,
+    delete,
+    event,
+    insert,
+    inspect,
+    select,
+    tuple_,
+)
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.models import (
+    Appointment,
+    AppointmentConflict,
+    AvailabilityChange,
+    Doctor,
+    Hospital,
+)
+
+from .availability import opening_hours, utc_window
+from .config import settings
+from .database import shard_map
+from .slot_events import SlotChange, SlotState, publish_slot_changes
+from .timezones import local_times
+
+# Hospital columns that decide which slots are open
+HOURS = ("open_time", "close_time", "timezone")
+
+
+class ConflictReason(StrEnum):
+    # No longer one of the hospital's opening hours
+    OUTSIDE_HOURS = "outside_hours"
+    # The doctor has moved to another hospital
+    WRONG_HOSPITAL = "wrong_hospital"
+
+
+@dataclass(frozen=True)
+class RevalidationRun:
+    batches: int
+    checked: int
+    # Booked slots recorded as conflicts, and open ones removed
+    conflicts: int
+    removed: int
+    # Changes finished
+    changes: int
+
+
+def today() -> date:
+    return datetime.now(UTC).date()
+
+
+def record_change(
+    db: Session,
+    *,
+    start: date,
+    end: date | None = None,
+    hospital_id: int | None = None,
+    doctor_id: int | None = None,
+) -> None:
+    """
+    Record that availability over the local dates ``start``..``end`` (inclusive, or
+    from ``start`` on) changed for a doctor or a hospital, as part of the session's
+    transaction.
+    """
+    if hospital_id is None and doctor_id is None:
+        raise ValueError("A change needs a hospital or a doctor")
+    db.add(
+        AvailabilityChange(
+            hospital_id=hospital_id, doctor_id=doctor_id, start_date=start, end_date=end
+        )
+    )
+
+
+def _changed(obj: Any, keys: Sequence[str]) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[key].history.has_changes() for key in keys)
+
+
+@event.listens_for(Session, "before_flush")
+def _record_availability_changes(
+    session: Session, _flush_context: Any, _instances: Any
+) -> None:
+    for obj in list(session.dirty):
+        if isinstance(obj, Hospital) and _changed(obj, HOURS):
+            record_change(session, start=today(), hospital_id=obj.id)
+        elif isinstance(obj, Doctor) and _changed(obj, ("hospital_id",)):
+            record_change(session, start=today(), doctor_id=obj.id)
+        elif isinstance(obj, Appointment) and _changed(
+            obj, ("doctor_id", "appointment_time")
+        ):
+            day = obj.appointment_time.date()
+            record_change(session, start=day, end=day, doctor_id=obj.doctor_id)
+
+
+def _covered(change: AvailabilityChange) -> Any:
+    """The later changes of the same doctor or hospital that a change covers."""
+    covered = and_(
+        AvailabilityChange.id > change.id,
+        AvailabilityChange.after_doctor_id.is_(None),
+        AvailabilityChange.hospital_id.is_not_distinct_from(change.hospital_id),
+        AvailabilityChange.doctor_id.is_not_distinct_from(change.doctor_id),
+        AvailabilityChange.start_date >= change.start_date,
+    )
+    if change.end_date is not None:
+        covered &= AvailabilityChange.end_date <= change.end_date
+    return covered
+
+
+def slots_query(change: AvailabilityChange, limit: int) -> Select:
+    """
+    The next ``limit`` slots of a change after its checkpoint, with what they're
+    checked against: the doctor's current hospital and its hours.
+    """
+    lower, upper = utc_window(change.start_date, change.end_date or change.start_date)
+    query = (
+        select(
+            Appointment.id,
+            Appointment.doctor_id,
+            Appointment.hospital_id,
+            Appointment.patient_id,
+            Appointment.appointment_time,
+            Doctor.hospital_id.label("doctor_hospital_id"),
+            Hospital.timezone,
+            Hospital.open_time,
+            Hospital.close_time,
+        )
+        .join(Doctor, Appointment.doctor_id == Doctor.id)
+        .join(Hospital, Doctor.hospital_id == Hospital.id)
+        .where(Appointment.appointment_time >= lower)
+        .order_by(Appointment.doctor_id, Appointment.appointment_time)
+        .limit(limit)
+    )
+    if change.end_date is not None:
+        query = query.where(Appointment.appointment_time < upper)
+    if change.hospital_id is not None:
+        query = query.where(Appointment.hospital_id == change.hospital_id)
+    if change.doctor_id is not None:
+        query = query.where(Appointment.doctor_id == change.doctor_id)
+    if change.after_doctor_id is not None:
+        query = query.where(
+            tuple_(Appointment.doctor_id, Appointment.appointment_time)
+            > (change.after_doctor_id, change.after_time)
+        )
+    return query
+
+
+def check_slots(rows: Sequence[Row]) -> list[ConflictReason | None]:
+    """Why each slot no longer fits its doctor's availability, or ``None``."""
+    locals_ = local_times([(row.timezone, row.appointment_time) for row in rows])
+    hours: dict[tuple[int, date], set[datetime]] = {}
+    reasons: list[ConflictReason | None] = []
+    for row, local in zip(rows, locals_):
+        if row.hospital_id != row.doctor_hospital_id:
+            reasons.append(ConflictReason.WRONG_HOSPITAL)
+            continue
+        assert local is not None
+        key = (row.doctor_hospital_id, local.date())
+        if key not in hours:
+            hours[key] = set(
+                opening_hours(
+                    row.timezone, row.open_time, row.close_time, key[1], key[1]
+                )
+            )
+        fits = row.appointment_time in hours[key]
+        reasons.append(None if fits else ConflictReason.OUTSIDE_HOURS)
+    return reasons
+
+
+def _apply(
+    db: Session, rows: Sequence[Row], reasons: list[ConflictReason | None]
+) -> tuple[list[dict[str, Any]], list[SlotChange]]:
+    """Record the batch's conflicts and remove its stale open slots."""
+    booked = [row for row in rows if row.patient_id is not None]
+    conflicts = [
+        {
+            "appointment_id": row.id,
+            "hospital_id": row.hospital_id,
+            "doctor_id": row.doctor_id,
+            "patient_id": row.patient_id,
+            "appointment_time": row.appointment_time,
+            "reason": reason,
+        }
+        for row, reason in zip(rows, reasons)
+        if reason is not None and row.patient_id is not None
+    ]
+    stale = [
+        row.id
+        for row, reason in zip(rows, reasons)
+        if reason is not None and row.patient_id is None
+    ]
+    # Checked again, so earlier records of these are replaced or resolved
+    if booked:
+        db.execute(
+            delete(AppointmentConflict).where(
+                AppointmentConflict.appointment_id.in_([row.id for row in booked])
+            )
+        )
+    if conflicts:
+        db.execute(insert(AppointmentConflict), conflicts)
+    removed: list[SlotChange] = []
+    if stale:
+        # Unless booked since they were read
+        deleted = db.execute(
+            delete(Appointment)
+            .where(Appointment.id.in_(stale), Appointment.patient_id.is_(None))
+            .returning(Appointment.doctor_id, Appointment.appointment_time)
+        )
+        removed = [
+            SlotChange(doctor_id, appointment_time, SlotState.REMOVED)
+            for doctor_id, appointment_time in deleted
+        ]
+    return conflicts, removed
+
+
+def hospital_conflicts(
+    db: Session, hospital_id: int, after: datetime, limit: int
+) -> list[AppointmentConflict]:
+    """A hospital's conflicts from the naive UTC instant ``after`` on, soonest first."""
+    conflicts: list[AppointmentConflict] = list(
+        db.scalars(
+            select(AppointmentConflict)
+            .where(
+                AppointmentConflict.hospital_id == hospital_id,
+                AppointmentConflict.appointment_time >= after,
+            )
+            .order_by(AppointmentConflict.appointment_time, AppointmentConflict.id)
+            .limit(limit)
+        )
+    )
+    return conflicts
+
+
+def revalidate(
+    db: Session, batch_size: int, max_batches: int | None = None
+) -> RevalidationRun:
+    """
+    Revalidate the slots of the recorded changes, a batch at a time, until there
+    are none left or ``max_batches`` have run.
+    """
+    batches = checked = conflicts = removed = changes = 0
+    while max_batches is None or batches < max_batches:
+        change = db.scalars(
+            select(AvailabilityChange).order_by(AvailabilityChange.id).limit(1)
+        ).first()
+        if change is None:
+            break
+        if change.after_doctor_id is None:
+            db.execute(delete(AvailabilityChange).where(_covered(change)))
+        rows = db.execute(slots_query(change, batch_size)).all()
+        found, gone = _apply(db, rows, check_slots(rows))
+        if len(rows) < batch_size:
+            db.delete(change)
+            changes += 1
+        else:
+            change.after_doctor_id = rows[-1].doctor_id
+            change.after_time = rows[-1].appointment_time
+        db.commit()
+        publish_slot_changes(gone)
+        batches += 1
+        checked += len(rows)
+        conflicts += len(found)
+        removed += len(gone)
+    return RevalidationRun(batches, checked, conflicts, removed, changes)
+
+
+def run_worker(
+    factories: Sequence[sessionmaker], batch_size: int, poll_seconds: float
+) -> None:
+    """Revalidate every database's changes, then look for more every so often."""
+    while True:
+        for factory in factories:
+            with factory() as db:
+                revalidate(db, batch_size)
+        clock.sleep(poll_seconds)
+
+
+def main(argv: Sequence[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Revalidate appointments in the ranges where availability changed."
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=settings.revalidation_batch_size
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running, looking for changes every revalidation_poll_seconds",
+    )
+    args = parser.parse_args(argv)
+
+    if args.watch:
+        run_worker(shard_map.all(), args.batch_size, settings.revalidation_poll_seconds)
+        return
+    for factory in shard_map.all():
+        with factory() as db:
+            print(revalidate(db, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+FastAPI dependencies for authenticated routes.
+
+``current_user`` identifies the caller from the access token cookie
+(``current_streaming_user`` for long-lived responses, and ``optional_user`` for
+routes anonymous callers may use too). What routes need
+to know about the caller (a ``Principal``) is cached for ``principal_cache_ttl``
+seconds, so authenticated requests don't query the database just to identify who is
+calling. Entries are dropped when the user logs out, when a committed change touches
+the user, and when the user's refresh tokens are revoked. Requests that miss the cache
+for the same user at once share one load, so a burst of them after an invalidation
+doesn't queue one query each for the connection pool.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from dataclasses import asdict, dataclass
+from typing import Any, Awaitable, Callable, Iterable
+
+from fastapi import Cookie, Depends, HTTPException
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import Session
+
+from app.models import Doctor, Staff, User
+
+from .auth import verify_jwt_token
+from .cache import CacheBackend, make_backend
+from .config import settings
+from .database import (
+    ShardMap,
+    get_async_db,
+    get_async_read_db,
+    get_async_shards,
+)
+from .refresh_tokens import refresh_tokens
+
+_CHANGED_USERS_KEY = "changed_users"
+
+_DEACTIVATED_USERS_KEY = "deactivated_users"
+
+
+@dataclass(frozen=True, slots=True)
+class Principal:
+    """The authenticated caller."""
+
+    id: str
+    email: str
+    is_active: bool
+    is_superuser: bool
+    person_id: int | None
+    # Hospitals the user works at as a doctor or staff member
+    hospital_ids: tuple[int, ...]
+
+    def sees_patients(self, hospital_id: int) -> bool:
+        """Whether the user may see who booked a hospital's slots."""
+        return self.is_superuser or hospital_id in self.hospital_ids
+
+
+class PrincipalCache:
+    """TTL cache of principals keyed by user id."""
+
+    def __init__(self, backend: CacheBackend, ttl: int) -> None:
+        self.backend = backend
+        self.ttl = ttl
+
+    @staticmethod
+    def key(user_id: str) -> str:
+        return f"principal:{user_id}"
+
+    def get(self, user_id: str) -> Principal | None:
+        value = self.backend.get_many([self.key(user_id)]).get(self.key(user_id))
+        if value is None:
+            return None
+        fields = json.loads(value)
+        fields["hospital_ids"] = tuple(fields["hospital_ids"])
+        return Principal(**fields)
+
+    def set(self, principal: Principal) -> None:
+        self.backend.set_many(
+            {self.key(principal.id): json.dumps(asdict(principal)).encode()}, self.ttl
+        )
+
+    def invalidate(self, user_ids: Iterable[str]) -> None:
+        self.backend.delete_many(self.key(user_id) for user_id in user_ids)
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+
+async def load_principal(db: AsyncSession, user_id: str) -> Principal | None:
+    """Load a user and the hospitals they work at in one query."""
+    doctors, staff = Doctor.__table__, Staff.__table__
+    rows = (
+        await db.execute(
+            select(
+                User.id,
+                User.email,
+                User.is_active,
+                User.is_superuser,
+                User.person_id,
+                doctors.c.hospital_id,
+                staff.c.hospital_id,
+            )
+            .outerjoin(doctors, doctors.c.id == User.person_id)
+            .outerjoin(staff, staff.c.id == User.person_id)
+            .where(User.id == user_id)
+        )
+    ).all()
+    if not rows:
+        return None
+    user_id, email, is_active, is_superuser, person_id, *_ = rows[0]
+    hospital_ids = {
+        hospital_id
+        for row in rows
+        for hospital_id in row[5:]
+        if hospital_id is not None
+    }
+    return Principal(
+        id=user_id,
+        email=email,
+        is_active=is_active,
+        is_superuser=is_superuser,
+        person_id=person_id,
+        hospital_ids=tuple(sorted(hospital_ids)),
+    )
+
+
+# Principals being loaded, so concurrent misses for a user wait on the same query
+_loading: dict[str, asyncio.Task[Principal | None]] = {}
+
+
+async def _load_once(
+    user_id: str, load: Callable[[str], Awaitable[Principal | None]]
+) -> Principal | None:
+    task = _loading.get(user_id)
+    if task is None or task.get_loop() is not asyncio.get_running_loop():
+        task = asyncio.ensure_future(load(user_id))
+        _loading[user_id] = task
+
+        def done(finished: asyncio.Task[Principal | None]) -> None:
+            if _loading.get(user_id) is finished:
+                del _loading[user_id]
+
+        task.add_done_callback(done)
+    # A caller that goes away mustn't cancel the load for the others
+    return await asyncio.shield(task)
+
+
+async def authenticate(
+    access_token: str | None, load: Callable[[str], Awaitable[Principal | None]]
+) -> Principal:
+    """The active user an access token belongs to, using ``load`` on a cache miss."""
+    if not access_token:
+        raise HTTPException(status_code=401, detail="No access token provided")
+
+    # Verify and decode the JWT token
+    payload = verify_jwt_token(access_token)
+    if not payload:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+
+    user_id = payload["sub"]
+    principal = principal_cache.get(user_id)
+    if principal is None:
+        principal = await _load_once(user_id, load)
+        if principal is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        principal_cache.set(principal)
+    if not principal.is_active:
+        raise HTTPException(status_code=403, detail="Inactive user")
+    return principal
+
+
+async def current_user(
+    db: AsyncSession = Depends(get_async_db), access_token: str | None = Cookie(None)
+) -> Principal:
+    """Dependency returning the caller, for routes that need an active user."""
+    # The session only connects on a cache miss
+    return await authenticate(access_token, lambda user_id: load_principal(db, user_id))
+
+
+async def optional_user(
+    db: AsyncSession = Depends(get_async_read_db),
+    access_token: str | None = Cookie(None),
+) -> Principal | None:
+    """Dependency returning the caller, or ``None`` unless an active user is logged in."""
+    if not access_token:
+        return None
+    try:
+        return await current_user(db, access_token)
+    except HTTPException:
+        return None
+
+
+async def current_streaming_user(
+    shards: ShardMap[async_sessionmaker[AsyncSession]] = Depends(get_async_shards),
+    access_token: str | None = Cookie(None),
+) -> Principal:
+    """
+    ``current_user`` for streams. A dependency's session stays open as long as its
+    response, so this one only holds a connection while it looks the user up.
+    """
+
+    async def load(user_id: str) -> Principal | None:
+        async with shards.default() as db:
+            return await load_principal(db, user_id)
+
+    return await authenticate(access_token, load)
+
+
+principal_cache = PrincipalCache(
+    make_backend(
+        settings.principal_cache_backend,
+        settings.principal_cache_max_entries,
+        prefix="auth:",
+    ),
+    ttl=settings.principal_cache_ttl,
+)
+refresh_tokens.on_revoke(lambda user_id: principal_cache.invalidate([user_id]))
+
+
+def _deactivated(user: User) -> bool:
+    was_active = any(inspect(user).attrs.is_active.history.deleted)
+    return was_active and not user.is_active
+
+
+@event.listens_for(Session, "after_flush")
+def _record_changed_users(session: Session, _flush_context: Any) -> None:
+    changed, deactivated = set(), set()
+    for obj in session.dirty:
+        if isinstance(obj, User) and session.is_modified(obj):
+            changed.add(obj.id)
+            if _deactivated(obj):
+                deactivated.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            changed.add(obj.id)
+            deactivated.add(obj.id)
+    if changed:
+        session.info.setdefault(_CHANGED_USERS_KEY, set()).update(changed)
+    if deactivated:
+        session.info.setdefault(_DEACTIVATED_USERS_KEY, set()).update(deactivated)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_users(session: Session) -> None:
+    principal_cache.invalidate(session.info.pop(_CHANGED_USERS_KEY, set()))
+    for user_id in session.info.pop(_DEACTIVATED_USERS_KEY, set()):
+        refresh_tokens.revoke_user(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_users(session: Session) -> None:
+    session.info.pop(_CHANGED_USERS_KEY, None)
+    session.info.pop(_DEACTIVATED_USERS_KEY, None)
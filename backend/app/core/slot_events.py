@@ -0,0 +1,140 @@
+"""
+Notifications for changes to appointment slots.
+
+Anything that keeps derived state about the ``appointments`` table (indexes, caches,
+subscribers) registers a listener here instead of hooking every write path itself.
+
+ORM writes are picked up automatically: changes are collected when a session flushes
+and dispatched once the transaction commits, so listeners never see rolled back work.
+Bulk Core statements bypass the ORM and must call ``publish_slot_changes`` with what
+they wrote.
+"""
+
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from enum import StrEnum
+from typing import Any, Callable, Iterable
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app.models import Appointment
+
+logger = logging.getLogger(__name__)
+
+SlotListener = Callable[[list["SlotChange"]], None]
+
+_listeners: list[SlotListener] = []
+
+_PENDING_KEY = "pending_slot_changes"
+
+
+class SlotState(StrEnum):
+    OPEN = "open"
+    BOOKED = "booked"
+    REMOVED = "removed"
+
+
+@dataclass(frozen=True, slots=True)
+class SlotChange:
+    """The new state of one doctor's slot, ``appointment_time`` is naive UTC."""
+
+    doctor_id: int
+    appointment_time: datetime
+    state: SlotState
+    patient_id: int | None = None
+
+    @classmethod
+    def for_row(
+        cls, doctor_id: int, appointment_time: datetime, patient_id: int | None
+    ) -> SlotChange:
+        state = SlotState.OPEN if patient_id is None else SlotState.BOOKED
+        return cls(doctor_id, appointment_time, state, patient_id)
+
+
+def on_slot_changes(listener: SlotListener) -> SlotListener:
+    """Register a listener for committed slot changes. Usable as a decorator."""
+    if listener not in _listeners:
+        _listeners.append(listener)
+    return listener
+
+
+def remove_slot_listener(listener: SlotListener) -> None:
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def publish_slot_changes(changes: Iterable[SlotChange]) -> None:
+    """Send committed slot changes to every listener."""
+    changes = list(changes)
+    if not changes:
+        return
+    for listener in list(_listeners):
+        try:
+            listener(changes)
+        except Exception:  # pylint: disable=broad-exception-caught
+            # A broken listener must not fail a write that has already committed
+            logger.exception("Slot change listener %r failed", listener)
+
+
+def _old_value(state: Any, key: str) -> Any:
+    history = state.attrs[key].history
+    return history.deleted[0] if history.deleted else state.attrs[key].value
+
+
+def _collect(appointment: Appointment, deleted: bool = False) -> list[SlotChange]:
+    if deleted:
+        state = inspect(appointment)
+        return [
+            SlotChange(
+                _old_value(state, "doctor_id"),
+                _old_value(state, "appointment_time"),
+                SlotState.REMOVED,
+            )
+        ]
+
+    current = SlotChange.for_row(
+        appointment.doctor_id, appointment.appointment_time, appointment.patient_id
+    )
+    state = inspect(appointment)
+    if state.pending or state.transient:
+        return [current]
+
+    keys = ("doctor_id", "appointment_time", "patient_id")
+    if not any(state.attrs[key].history.has_changes() for key in keys):
+        return []
+    old_doctor = _old_value(state, "doctor_id")
+    old_time = _old_value(state, "appointment_time")
+    if (old_doctor, old_time) != (current.doctor_id, current.appointment_time):
+        # The appointment moved, so its previous slot is no longer there
+        return [SlotChange(old_doctor, old_time, SlotState.REMOVED), current]
+    return [current]
+
+
+@event.listens_for(Session, "after_flush")
+def _record_flushed_changes(session: Session, _flush_context: Any) -> None:
+    changes: list[SlotChange] = []
+    for obj in session.new:
+        if isinstance(obj, Appointment):
+            changes.extend(_collect(obj))
+    for obj in session.dirty:
+        if isinstance(obj, Appointment):
+            changes.extend(_collect(obj))
+    for obj in session.deleted:
+        if isinstance(obj, Appointment):
+            changes.extend(_collect(obj, deleted=True))
+    if changes:
+        session.info.setdefault(_PENDING_KEY, []).extend(changes)
+
+
+@event.listens_for(Session, "after_commit")
+def _dispatch_committed_changes(session: Session) -> None:
+    publish_slot_changes(session.info.pop(_PENDING_KEY, []))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_changes(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
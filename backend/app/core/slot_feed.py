@@ -0,0 +1,286 @@
+"""
+Live slot changes for open calendars (server-sent events and websockets).
+
+Committed slot changes (see ``app.core.slot_events``) are turned into compact deltas
+of ``(doctor_id, time, state)`` and fanned out to subscribers, each watching a set of
+doctors (usually every doctor of a hospital). Patients are never included.
+
+Each subscriber has its own pending set rather than a queue: a later change to the
+same slot replaces an earlier one, and the consumer receives everything pending as
+one batch after waiting ``coalesce_seconds`` for a burst to settle. The pending set
+is bounded. A consumer that falls ``max_pending`` slots behind is dropped to a single
+``resync`` notice, after which it should reload its calendars.
+
+With the memory broker changes reach the subscribers of the worker that committed
+them. The Redis broker publishes every batch on a channel that each worker listens
+to, so subscribers see changes committed by any worker. If the listener loses its
+connection, its subscribers get a ``resync`` once it is back.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time as clock
+from collections.abc import Collection
+from contextlib import suppress
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Protocol
+
+import redis
+
+from .config import settings
+from .slot_events import SlotChange, SlotState, on_slot_changes
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class SlotDelta:
+    """The new state of a doctor's slot starting at ``time`` (naive UTC)."""
+
+    doctor_id: int
+    time: datetime
+    state: SlotState
+
+    @classmethod
+    def from_change(cls, change: SlotChange) -> SlotDelta:
+        return cls(change.doctor_id, change.appointment_time, change.state)
+
+    def to_dict(self) -> dict:
+        return {
+            "doctor_id": self.doctor_id,
+            "time": self.time.isoformat(),
+            "state": str(self.state),
+        }
+
+    @classmethod
+    def from_dict(cls, value: dict) -> SlotDelta:
+        return cls(
+            value["doctor_id"],
+            datetime.fromisoformat(value["time"]),
+            SlotState(value["state"]),
+        )
+
+
+class Overflowed(Exception):
+    """The subscriber fell too far behind and has to reload its calendars."""
+
+
+class Subscription:  # pylint: disable=too-many-instance-attributes
+    """Changes to a set of doctors' slots, waiting to be consumed."""
+
+    def __init__(
+        self,
+        doctor_ids: Collection[int],
+        max_pending: int,
+        coalesce_seconds: float,
+    ) -> None:
+        self.doctor_ids = frozenset(doctor_ids)
+        self.max_pending = max_pending
+        self.coalesce_seconds = coalesce_seconds
+        self._pending: dict[tuple[int, datetime], SlotDelta] = {}
+        self._overflowed = False
+        self._lock = threading.Lock()
+        self._loop = asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+
+    def offer(self, deltas: list[SlotDelta]) -> None:
+        """Add changes from any thread; the ones for other doctors are ignored."""
+        with self._lock:
+            added = False
+            for delta in deltas:
+                if delta.doctor_id in self.doctor_ids and not self._overflowed:
+                    self._pending[delta.doctor_id, delta.time] = delta
+                    added = True
+            if len(self._pending) > self.max_pending:
+                self._pending.clear()
+                self._overflowed = True
+        if added:
+            # The subscriber's loop may have closed before it unsubscribed
+            with suppress(RuntimeError):
+                self._loop.call_soon_threadsafe(self._ready.set)
+
+    def overflow(self) -> None:
+        """Drop what is pending and have the consumer resync, from any thread."""
+        with self._lock:
+            self._pending.clear()
+            self._overflowed = True
+        with suppress(RuntimeError):
+            self._loop.call_soon_threadsafe(self._ready.set)
+
+    async def next_batch(self, timeout: float | None = None) -> list[SlotDelta]:
+        """
+        Wait for changes and return them once a burst has settled, or an empty list
+        after ``timeout`` seconds without any. Raises ``Overflowed`` when changes
+        were dropped.
+        """
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        await asyncio.sleep(self.coalesce_seconds)
+        self._ready.clear()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            overflowed, self._overflowed = self._overflowed, False
+        if overflowed:
+            raise Overflowed
+        return sorted(pending.values(), key=lambda delta: (delta.time, delta.doctor_id))
+
+
+class SlotBroker(Protocol):
+    """Delivers published deltas to this worker's subscriptions."""
+
+    def publish(self, deltas: list[SlotDelta]) -> None: ...
+
+    def subscribe(self, subscription: Subscription) -> None: ...
+
+    def unsubscribe(self, subscription: Subscription) -> None: ...
+
+
+class MemoryBroker:
+    """Fan-out to the subscriptions of this worker."""
+
+    def __init__(self) -> None:
+        self._subscriptions: set[Subscription] = set()
+        self._lock = threading.Lock()
+
+    def publish(self, deltas: list[SlotDelta]) -> None:
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription.offer(deltas)
+
+    def subscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscriptions.add(subscription)
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def overflow(self) -> None:
+        """Tell every subscription to resync."""
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription.overflow()
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscriptions)
+
+
+class RedisBroker:
+    """
+    Publishes deltas on a Redis channel and delivers what arrives on it to this
+    worker's subscriptions. Both directions run on their own threads, started when
+    first needed, so a slow or unreachable Redis never holds up a commit or the
+    event loop. Changes published while the listener was cut off are lost, so once
+    it is back every subscription is told to resync.
+    """
+
+    retry_seconds = 1.0
+
+    def __init__(self, client: redis.Redis, channel: str = "slot-changes") -> None:
+        self.client = client
+        self.channel = channel
+        self.local = MemoryBroker()
+        self._outbox: queue.SimpleQueue[str] = queue.SimpleQueue()
+        self._sender: threading.Thread | None = None
+        self._listener: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def publish(self, deltas: list[SlotDelta]) -> None:
+        self._outbox.put(json.dumps([delta.to_dict() for delta in deltas]))
+        with self._lock:
+            if self._sender is None:
+                self._sender = threading.Thread(
+                    target=self._send, name="slot-changes-publish", daemon=True
+                )
+                self._sender.start()
+
+    def subscribe(self, subscription: Subscription) -> None:
+        self.local.subscribe(subscription)
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(
+                    target=self._listen, name="slot-changes", daemon=True
+                )
+                self._listener.start()
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self.local.unsubscribe(subscription)
+
+    def _send(self) -> None:
+        while True:
+            message = self._outbox.get()
+            try:
+                self.client.publish(self.channel, message)
+            except redis.RedisError:
+                logger.warning("Slot change publish failed", exc_info=True)
+
+    def _listen(self) -> None:
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        lost = False
+        while True:
+            try:
+                message = pubsub.get_message(timeout=1.0)
+            except redis.RedisError:
+                logger.warning("Slot change subscription failed", exc_info=True)
+                lost = True
+                clock.sleep(self.retry_seconds)
+                continue
+            if lost:
+                # Resubscribed, but whatever was published in between is gone
+                self.local.overflow()
+                lost = False
+            if message is not None:
+                deltas = [SlotDelta.from_dict(d) for d in json.loads(message["data"])]
+                self.local.publish(deltas)
+
+
+def make_slot_broker(kind: str) -> SlotBroker:
+    """Build the broker named in the settings."""
+    if kind == "redis":
+        return RedisBroker(redis.Redis.from_url(settings.redis_url))
+    if kind == "memory":
+        return MemoryBroker()
+    raise ValueError(f"Unknown slot feed broker: {kind}")
+
+
+class SlotFeed:
+    """Subscriptions to committed slot changes."""
+
+    def __init__(
+        self, broker: SlotBroker, max_pending: int, coalesce_seconds: float
+    ) -> None:
+        self.broker = broker
+        self.max_pending = max_pending
+        self.coalesce_seconds = coalesce_seconds
+
+    def publish(self, changes: list[SlotChange]) -> None:
+        self.broker.publish([SlotDelta.from_change(change) for change in changes])
+
+    def subscribe(self, doctor_ids: Collection[int]) -> Subscription:
+        """Start collecting changes to the doctors' slots. Call from the event loop."""
+        subscription = Subscription(doctor_ids, self.max_pending, self.coalesce_seconds)
+        self.broker.subscribe(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self.broker.unsubscribe(subscription)
+
+
+slot_feed = SlotFeed(
+    make_slot_broker(settings.slot_feed_broker),
+    max_pending=settings.slot_feed_max_pending,
+    coalesce_seconds=settings.slot_feed_coalesce_seconds,
+)
+on_slot_changes(slot_feed.publish)
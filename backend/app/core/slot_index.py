@@ -0,0 +1,406 @@
+"""
+In-memory bitmap index of doctors' slots.
+
+Appointments are one hour long and start on the hour, so a doctor's local day fits in
+a 24-bit mask (bit ``n`` is the slot starting at ``n:00`` local time). Each loaded
+hospital keeps two ``(doctors, days)`` arrays of those masks: one for slots that exist
+(``available``) and one for slots that have a patient (``booked``). Free-slot searches
+across a whole hospital then become bitwise operations over the arrays instead of
+scans of the ``appointments`` table.
+
+The window starts ``past_days`` before today and moves on with the date. Hospitals are
+loaded from the database the first time they are queried and kept current from the
+slot changes this process commits (see ``app.core.slot_events``). Other processes'
+changes aren't seen that way, so once a hospital is ``ttl`` seconds old the slots
+updated since it was last read (by ``updated_at``) are read again. Slots other
+processes delete or move away are only cleared by a full load, which happens every
+``reload`` seconds and when the window has moved. The least recently queried
+hospitals are dropped once ``max_hospitals`` are loaded.
+
+Loads run outside the index lock, so commits and queries for other hospitals don't
+wait on them. Changes committed while a hospital loads are kept and applied on top
+once it's done, since the load may have read the rows before they changed.
+
+On the day clocks are turned back the repeated local hour shares one bit, so two slots
+in that hour are indistinguishable here.
+"""
+
+from __future__ import annotations
+
+import threading
+import time as clock
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import UTC, date, datetime, time, timedelta
+from typing import Iterable, Sequence
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from sqlalchemy import Row, select
+from sqlalchemy.orm import Session
+
+from app.models import Appointment, Doctor
+
+from .availability import slots_query, utc_window
+from .config import settings
+from .slot_events import SlotChange, SlotState, on_slot_changes
+from .timezones import local_times
+
+HOURS = np.arange(24, dtype=np.uint32)
+
+# How far back a refresh reads from its previous one, for writes whose transactions
+# committed after that read but stamped ``updated_at`` before it
+REFRESH_OVERLAP = timedelta(minutes=5)
+
+
+class OutsideIndexWindow(ValueError):
+    """The requested dates are not covered by the index."""
+
+
+def today() -> date:
+    return datetime.now(UTC).date()
+
+
+@dataclass
+class HospitalBitmaps:  # pylint: disable=too-many-instance-attributes
+    """Slot bitmaps for every doctor at one hospital, with day 0 at ``epoch``."""
+
+    timezone: ZoneInfo
+    doctor_ids: list[int]
+    available: np.ndarray
+    booked: np.ndarray
+    epoch: date
+    # When they were loaded and last refreshed, by the monotonic clock
+    loaded_at: float
+    refreshed_at: float
+    # Naive UTC time the last load or refresh started reading, for the next refresh
+    read_at: datetime
+
+    def __post_init__(self) -> None:
+        self.rows = {doctor_id: row for row, doctor_id in enumerate(self.doctor_ids)}
+
+
+class SlotIndex:  # pylint: disable=too-many-instance-attributes
+    """
+    Per doctor availability and booked bitmaps covering ``days`` local dates from
+    ``past_days`` before today, refreshed once ``ttl`` seconds old and loaded again
+    every ``reload`` seconds.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        days: int,
+        max_hospitals: int,
+        past_days: int = 0,
+        ttl: float = 60,
+        reload: float = 3600,
+    ) -> None:
+        self.days = days
+        self.max_hospitals = max_hospitals
+        self.past_days = past_days
+        self.ttl = ttl
+        self.reload = reload
+        self._hospitals: OrderedDict[int, HospitalBitmaps] = OrderedDict()
+        self._doctor_hospital: dict[int, int] = {}
+        self._unresolved: set[int] = set()
+        self._lock = threading.RLock()
+        # One lock per hospital, held while it loads, so it's only loaded once
+        self._loading: dict[int, threading.Lock] = {}
+        # Changes committed while each hospital loads
+        self._buffered: dict[int, list[SlotChange]] = {}
+
+    @property
+    def epoch(self) -> date:
+        """The first date of the index window."""
+        return today() - timedelta(days=self.past_days)
+
+    @property
+    def end(self) -> date:
+        """The first date after the index window."""
+        return self.epoch + timedelta(days=self.days)
+
+    def covers(self, start: date, end: date) -> bool:
+        return self.epoch <= start <= end < self.end
+
+    def clear(self) -> None:
+        with self._lock:
+            self._hospitals.clear()
+            self._doctor_hospital.clear()
+            self._unresolved.clear()
+            self._loading.clear()
+
+    @staticmethod
+    def _locate(
+        bitmaps: HospitalBitmaps, appointment_time: datetime
+    ) -> tuple[int, int]:
+        """Return the (day offset, hour) of a naive UTC time in local time."""
+        tz = bitmaps.timezone
+        local = tz.fromutc(appointment_time.replace(tzinfo=tz))
+        return (local.date() - bitmaps.epoch).days, local.hour
+
+    def _load(self, db: Session, hospital_id: int) -> HospitalBitmaps | None:
+        epoch, loaded_at = self.epoch, clock.monotonic()
+        read_at = datetime.now(UTC).replace(tzinfo=None)
+        rows = db.execute(
+            slots_query(
+                Doctor.hospital_id == hospital_id,
+                epoch,
+                epoch + timedelta(days=self.days - 1),
+            )
+        ).all()
+        if not rows:
+            return None
+
+        doctor_ids = list(dict.fromkeys(row[0] for row in rows))
+        bitmaps = HospitalBitmaps(
+            timezone=rows[0].timezone,
+            doctor_ids=doctor_ids,
+            available=np.zeros((len(doctor_ids), self.days), dtype=np.uint32),
+            booked=np.zeros((len(doctor_ids), self.days), dtype=np.uint32),
+            epoch=epoch,
+            loaded_at=loaded_at,
+            refreshed_at=loaded_at,
+            read_at=read_at,
+        )
+
+        self._fill(bitmaps, rows)
+        return bitmaps
+
+    def _refresh(
+        self, db: Session, hospital_id: int, bitmaps: HospitalBitmaps
+    ) -> HospitalBitmaps | None:
+        """
+        Read the slots updated since the bitmaps were last read and set their bits, or
+        return ``None`` when a doctor has joined and the hospital has to be loaded.
+        """
+        refreshed_at = clock.monotonic()
+        read_at = datetime.now(UTC).replace(tzinfo=None)
+        lower, upper = utc_window(
+            bitmaps.epoch, bitmaps.epoch + timedelta(days=self.days - 1)
+        )
+        rows = db.execute(
+            select(
+                Appointment.doctor_id,
+                Appointment.appointment_time,
+                Appointment.patient_id,
+            ).where(
+                Appointment.hospital_id == hospital_id,
+                Appointment.updated_at >= bitmaps.read_at - REFRESH_OVERLAP,
+                Appointment.appointment_time >= lower,
+                Appointment.appointment_time < upper,
+            )
+        ).all()
+        if any(row.doctor_id not in bitmaps.rows for row in rows):
+            return None
+        with self._lock:
+            for row in rows:
+                self._set(
+                    bitmaps,
+                    SlotChange.for_row(
+                        row.doctor_id, row.appointment_time, row.patient_id
+                    ),
+                )
+            bitmaps.refreshed_at, bitmaps.read_at = refreshed_at, read_at
+        return bitmaps
+
+    def _fill(self, bitmaps: HospitalBitmaps, rows: Sequence[Row]) -> None:
+        """Set the bits for every slot row in a single vectorized pass."""
+        located = []
+        locals_ = local_times([(row[1], row[3]) for row in rows])
+        for (doctor_id, _, _, _, patient_id), local in zip(rows, locals_):
+            if local is not None:
+                day, hour = (local.date() - bitmaps.epoch).days, local.hour
+                if 0 <= day < self.days:
+                    located.append(
+                        (bitmaps.rows[doctor_id], day, hour, patient_id is not None)
+                    )
+        if located:
+            doctor_rows, days, hours, booked = (np.array(c) for c in zip(*located))
+            bits = np.left_shift(np.uint32(1), hours.astype(np.uint32))
+            np.bitwise_or.at(bitmaps.available, (doctor_rows, days), bits)
+            np.bitwise_or.at(
+                bitmaps.booked,
+                (doctor_rows[booked], days[booked]),
+                bits[booked],
+            )
+
+    def _resolve_unknown_doctors(self, db: Session) -> None:
+        """
+        Changes for doctors that aren't loaded are usually for hospitals nobody has
+        queried, but they can be for a doctor added to a loaded hospital. In that case
+        the hospital is dropped and reloaded on its next query.
+        """
+        with self._lock:
+            unresolved, self._unresolved = self._unresolved, set()
+        if not unresolved:
+            return
+        hospital_ids = db.scalars(
+            select(Doctor.hospital_id).where(Doctor.id.in_(unresolved)).distinct()
+        ).all()
+        with self._lock:
+            for hospital_id in hospital_ids:
+                self._drop(hospital_id)
+
+    def _drop(self, hospital_id: int) -> None:
+        bitmaps = self._hospitals.pop(hospital_id, None)
+        if bitmaps is not None:
+            for doctor_id in bitmaps.doctor_ids:
+                self._doctor_hospital.pop(doctor_id, None)
+
+    def _current(self, bitmaps: HospitalBitmaps) -> bool:
+        return (
+            bitmaps.epoch == self.epoch
+            and clock.monotonic() - bitmaps.refreshed_at < self.ttl
+        )
+
+    def _refreshable(self, bitmaps: HospitalBitmaps) -> bool:
+        return (
+            bitmaps.epoch == self.epoch
+            and clock.monotonic() - bitmaps.loaded_at < self.reload
+        )
+
+    def hospital(self, db: Session, hospital_id: int) -> HospitalBitmaps | None:
+        """Return the bitmaps for a hospital, loading or refreshing them if needed."""
+        self._resolve_unknown_doctors(db)
+        with self._lock:
+            loaded = self._hospitals.get(hospital_id)
+            if loaded is not None and self._current(loaded):
+                self._hospitals.move_to_end(hospital_id)
+                return loaded
+            loading = self._loading.setdefault(hospital_id, threading.Lock())
+
+        with loading:
+            with self._lock:
+                # Another query may have loaded it while this one waited
+                loaded = self._hospitals.get(hospital_id)
+                if loaded is not None and self._current(loaded):
+                    return loaded
+                self._buffered[hospital_id] = []
+            try:
+                bitmaps = None
+                if loaded is not None and self._refreshable(loaded):
+                    bitmaps = self._refresh(db, hospital_id, loaded)
+                if bitmaps is None:
+                    bitmaps = self._load(db, hospital_id)
+            finally:
+                with self._lock:
+                    changes = self._buffered.pop(hospital_id)
+            with self._lock:
+                self._install(hospital_id, bitmaps, changes)
+            return bitmaps
+
+    def _install(
+        self,
+        hospital_id: int,
+        bitmaps: HospitalBitmaps | None,
+        changes: list[SlotChange],
+    ) -> None:
+        """Index loaded bitmaps, replaying the changes committed while they loaded."""
+        if self._hospitals.get(hospital_id) is not bitmaps:
+            self._drop(hospital_id)
+        if bitmaps is None:
+            return
+        for change in changes:
+            if change.doctor_id in bitmaps.rows:
+                self._set(bitmaps, change)
+        self._hospitals[hospital_id] = bitmaps
+        self._hospitals.move_to_end(hospital_id)
+        self._doctor_hospital.update(
+            (doctor_id, hospital_id) for doctor_id in bitmaps.doctor_ids
+        )
+        # Changes that arrived before its doctors were known are applied by now
+        self._unresolved.difference_update(bitmaps.doctor_ids)
+        while len(self._hospitals) > self.max_hospitals:
+            self._drop(next(iter(self._hospitals)))
+
+    def _set(self, bitmaps: HospitalBitmaps, change: SlotChange) -> None:
+        day, hour = self._locate(bitmaps, change.appointment_time)
+        if not 0 <= day < self.days:
+            return
+        row = bitmaps.rows[change.doctor_id]
+        bit = np.uint32(1 << hour)
+        if change.state == SlotState.REMOVED:
+            bitmaps.available[row, day] &= ~bit
+        else:
+            bitmaps.available[row, day] |= bit
+        if change.state == SlotState.BOOKED:
+            bitmaps.booked[row, day] |= bit
+        else:
+            bitmaps.booked[row, day] &= ~bit
+
+    def apply(self, changes: Iterable[SlotChange]) -> None:
+        """Keep loaded hospitals current with committed slot changes."""
+        changes = list(changes)
+        with self._lock:
+            for buffered in self._buffered.values():
+                buffered.extend(changes)
+            for change in changes:
+                hospital_id = self._doctor_hospital.get(change.doctor_id)
+                if hospital_id is None:
+                    self._unresolved.add(change.doctor_id)
+                else:
+                    self._set(self._hospitals[hospital_id], change)
+
+    def free_masks(
+        self, db: Session, hospital_id: int, start: date, end: date
+    ) -> tuple[list[int], np.ndarray] | None:
+        """
+        Return the hospital's doctor ids and a ``(doctors, days)`` array of free slot
+        masks for ``start``..``end`` (inclusive), or ``None`` for an unknown hospital.
+        """
+        if not self.covers(start, end):
+            raise OutsideIndexWindow(f"{start}..{end} is outside the slot index")
+        bitmaps = self.hospital(db, hospital_id)
+        if bitmaps is None:
+            return None
+
+        first, last = (start - bitmaps.epoch).days, (end - bitmaps.epoch).days + 1
+        if first < 0:  # The window moved on since it was checked
+            raise OutsideIndexWindow(f"{start}..{end} is outside the slot index")
+        with self._lock:
+            free = bitmaps.available[:, first:last] & ~bitmaps.booked[:, first:last]
+            return list(bitmaps.doctor_ids), free
+
+    def free_slots(
+        self, db: Session, hospital_id: int, start: date, end: date
+    ) -> dict[int, dict[date, list[time]]] | None:
+        """
+        Return every free slot at a hospital over ``start``..``end`` (inclusive),
+        grouped by doctor and local date, or ``None`` for an unknown hospital.
+        """
+        result = self.free_masks(db, hospital_id, start, end)
+        if result is None:
+            return None
+        doctor_ids, free = result
+
+        rows, days, hours = np.nonzero((free[:, :, np.newaxis] >> HOURS) & 1)
+        slots: dict[int, dict[date, list[time]]] = {}
+        for row, day, hour in zip(rows.tolist(), days.tolist(), hours.tolist()):
+            slots.setdefault(doctor_ids[row], {}).setdefault(
+                start + timedelta(days=day), []
+            ).append(time(hour))
+        return slots
+
+    def free_counts(
+        self, db: Session, hospital_id: int, start: date, end: date
+    ) -> np.ndarray | None:
+        """
+        Return a ``(days, 24)`` array with the number of doctors free in each hour at
+        a hospital, or ``None`` for an unknown hospital.
+        """
+        result = self.free_masks(db, hospital_id, start, end)
+        if result is None:
+            return None
+        _, free = result
+        counts: np.ndarray = ((free[:, :, np.newaxis] >> HOURS) & 1).sum(axis=0)
+        return counts
+
+
+slot_index = SlotIndex(
+    days=settings.slot_index_days,
+    max_hospitals=settings.slot_index_max_hospitals,
+    past_days=settings.slot_index_past_days,
+    ttl=settings.slot_index_ttl,
+    reload=settings.slot_index_reload,
+)
+on_slot_changes(slot_index.apply)
@@ -0,0 +1,165 @@
+"""
+Earliest available slots across a hospital's doctors.
+
+"The first N open slots with any cardiologist at this hospital" is answered without
+building anybody's calendar. Each matching doctor contributes a lazy stream of their
+open slots in time order, read from ``idx_unique_doctor_timeslot`` a page at a time,
+and the streams are merged with a heap. The merge stops as soon as ``limit`` slots
+are found, so a doctor with months of open slots costs at most a page.
+
+The first page of every doctor comes from a single round trip; later pages are
+only fetched for the doctors whose slots are actually being used. Slots that are
+reserved (see ``app.core.reservations``) are skipped.
+"""
+
+from __future__ import annotations
+
+import heapq
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from itertools import islice
+from typing import Any, Iterator, Sequence
+
+from sqlalchemy import CompoundSelect, Select, bindparam, select, union_all
+from sqlalchemy.orm import Session
+
+from app.models import Appointment, Doctor
+
+from .reservations import reservations
+
+# Doctors per UNION ALL, well inside SQLite's limit of 500 compound SELECTs
+FIRST_PAGES_BATCH = 200
+
+
+@dataclass(frozen=True, order=True, slots=True)
+class OpenSlot:
+    """An open slot, at a naive UTC time. Slots sort by time, then doctor."""
+
+    appointment_time: datetime
+    doctor_id: int
+    appointment_id: int
+
+
+def _open_slots(hospital_id: Any, after: Any) -> Select:
+    # The hospital lets a partitioned table be pruned to its partitions
+    return select(
+        Appointment.appointment_time, Appointment.doctor_id, Appointment.id
+    ).where(
+        Appointment.hospital_id == hospital_id,
+        Appointment.patient_id.is_(None),
+        Appointment.appointment_time >= after,
+    )
+
+
+def _page(hospital_id: Any, doctor_id: Any, after: Any, page_size: Any) -> Select:
+    return (
+        _open_slots(hospital_id, after)
+        .where(Appointment.doctor_id == doctor_id)
+        .order_by(Appointment.appointment_time)
+        .limit(page_size)
+    )
+
+
+@lru_cache(maxsize=FIRST_PAGES_BATCH)
+def _first_pages_query(doctors: int) -> CompoundSelect:
+    """
+    ``UNION ALL`` of one page per doctor, each an index range scan. Built once per
+    number of doctors and bound to parameters, so it is also compiled only once.
+    """
+    hospital_id: Any = bindparam("hospital_id")
+    after: Any = bindparam("after")
+    page_size: Any = bindparam("page_size")
+    return union_all(
+        *(
+            _page(hospital_id, bindparam(f"doctor_{i}"), after, page_size)
+            .subquery()
+            .select()
+            for i in range(doctors)
+        )
+    )
+
+
+def first_pages(
+    db: Session,
+    hospital_id: int,
+    doctor_ids: Sequence[int],
+    after: datetime,
+    page_size: int,
+) -> dict[int, list[OpenSlot]]:
+    """
+    The first ``page_size`` open slots from ``after`` on of every doctor at the
+    hospital, in one round trip per ``FIRST_PAGES_BATCH`` doctors.
+    """
+    pages: dict[int, list[OpenSlot]] = {doctor_id: [] for doctor_id in doctor_ids}
+    for first in range(0, len(doctor_ids), FIRST_PAGES_BATCH):
+        batch = doctor_ids[first : first + FIRST_PAGES_BATCH]
+        params = {f"doctor_{i}": doctor_id for i, doctor_id in enumerate(batch)}
+        rows = db.execute(
+            _first_pages_query(len(batch)),
+            {
+                **params,
+                "hospital_id": hospital_id,
+                "after": after,
+                "page_size": page_size,
+            },
+        )
+        for row in rows:
+            pages[row.doctor_id].append(OpenSlot(*row))
+    return pages
+
+
+def doctor_slots(
+    db: Session,
+    hospital_id: int,
+    doctor_id: int,
+    first_page: list[OpenSlot],
+    page_size: int,
+) -> Iterator[OpenSlot]:
+    """A doctor's open slots in time order, fetching the next page when needed."""
+    page = first_page
+    while True:
+        yield from page
+        if len(page) < page_size:
+            return
+        last = page[-1].appointment_time
+        rows = db.execute(
+            _page(hospital_id, doctor_id, last, page_size).where(
+                Appointment.appointment_time > last
+            )
+        ).all()
+        page = [OpenSlot(*row) for row in rows]
+
+
+def earliest_slots(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    db: Session,
+    hospital_id: int,
+    specialty: str | None,
+    after: datetime,
+    limit: int,
+    page_size: int | None = None,
+) -> list[OpenSlot]:
+    """
+    The first ``limit`` open, unreserved slots from ``after`` (naive UTC) on with any
+    doctor at the hospital, optionally only doctors with ``specialty``.
+    """
+    query = select(Doctor.id).where(Doctor.hospital_id == hospital_id)
+    if specialty is not None:
+        query = query.where(Doctor.specialty == specialty)
+    doctor_ids = db.scalars(query).all()
+    if not doctor_ids or limit < 1:
+        return []
+
+    page_size = page_size or limit
+    pages = first_pages(db, hospital_id, doctor_ids, after, page_size)
+    streams = [
+        doctor_slots(db, hospital_id, doctor_id, page, page_size)
+        for doctor_id, page in pages.items()
+    ]
+    merged = heapq.merge(*streams)
+    found: list[OpenSlot] = []
+    # Reserved slots are dropped a batch at a time, usually in a single lookup
+    while batch := list(islice(merged, limit - len(found))):
+        held = reservations.reserved(slot.appointment_id for slot in batch)
+        found.extend(slot for slot in batch if slot.appointment_id not in held)
+    return found
@@ -0,0 +1,144 @@
+"""
+Bulk materialization of open slots.
+
+Availability is stored as prepopulated ``appointments`` rows without a patient (see
+the README). Opening a date range for many doctors generates one row per doctor and
+opening hour of their hospital, in the hospital's timezone, and writes them in chunks
+of ``INSERT ... ON CONFLICT DO NOTHING``. Slots that already exist, open or booked,
+are left alone and counted as skipped, so opening a range again is harmless.
+
+Databases without ``ON CONFLICT`` read each chunk's existing slots first and insert
+the rest. There, opening the same slots at the same time from two sessions can fail
+on ``idx_unique_doctor_timeslot``; opening the range again then finishes it.
+
+The inserts bypass the ORM, so the new slots are published to ``slot_events`` once
+they are committed.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import date, datetime
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator
+
+from sqlalchemy import Insert, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.models import Appointment, Doctor, Hospital
+
+from .availability import opening_hours
+from .slot_events import SlotChange, publish_slot_changes
+
+
+@dataclass(frozen=True)
+class OpenedSlots:
+    inserted: int
+    skipped: int
+
+
+def slot_rows(
+    db: Session,
+    doctor_ids: Iterable[int],
+    start: date,
+    end: date,
+    created_by: int | None,
+) -> Iterator[dict[str, Any]]:
+    """
+    Lazily generate a row for every opening hour of each doctor's hospital over the
+    local dates ``start``..``end`` (inclusive). Without ``created_by`` each slot is
+    recorded as created by its doctor.
+    """
+    doctors = db.execute(
+        select(
+            Doctor.id,
+            Hospital.id,
+            Hospital.timezone,
+            Hospital.open_time,
+            Hospital.close_time,
+        )
+        .join(Hospital, Doctor.hospital_id == Hospital.id)
+        .where(Doctor.id.in_(set(doctor_ids)))
+        .order_by(Hospital.id, Doctor.id)
+    ).all()
+    hours: dict[int, list[datetime]] = {}
+    for doctor_id, hospital_id, tz, open_time, close_time in doctors:
+        if hospital_id not in hours:
+            hours[hospital_id] = opening_hours(tz, open_time, close_time, start, end)
+        for appointment_time in hours[hospital_id]:
+            yield {
+                "doctor_id": doctor_id,
+                "hospital_id": hospital_id,
+                "appointment_time": appointment_time,
+                "created_by": created_by or doctor_id,
+            }
+
+
+# The dialects whose inserts can skip conflicting rows themselves
+ON_CONFLICT_INSERTS: dict[str, Callable[..., Any]] = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+def _insert_ignoring_existing(dialect: str) -> Insert | None:
+    make_insert = ON_CONFLICT_INSERTS.get(dialect)
+    if make_insert is None:
+        return None
+    ignoring: Insert = (
+        make_insert(Appointment)
+        .on_conflict_do_nothing(
+            index_elements=["doctor_id", "appointment_time", "hospital_id"]
+        )
+        .returning(Appointment.doctor_id, Appointment.appointment_time)
+    )
+    return ignoring
+
+
+def _insert_missing(
+    db: Session, chunk: list[dict[str, Any]]
+) -> list[tuple[int, datetime]]:
+    """Insert the slots of a chunk that don't exist yet, read first."""
+    times = [row["appointment_time"] for row in chunk]
+    query = select(Appointment.doctor_id, Appointment.appointment_time).where(
+        Appointment.doctor_id.in_({row["doctor_id"] for row in chunk}),
+        Appointment.appointment_time.between(min(times), max(times)),
+    )
+    existing = {tuple(row) for row in db.execute(query)}
+    missing = [
+        row
+        for row in chunk
+        if (row["doctor_id"], row["appointment_time"]) not in existing
+    ]
+    if missing:
+        db.execute(insert(Appointment), missing)
+    return [(row["doctor_id"], row["appointment_time"]) for row in missing]
+
+
+def open_slots(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    db: Session,
+    doctor_ids: Iterable[int],
+    start: date,
+    end: date,
+    created_by: int | None = None,
+    chunk_size: int = 5000,
+) -> OpenedSlots:
+    """Open every missing slot for the doctors over ``start``..``end`` (inclusive)."""
+    statement = _insert_ignoring_existing(db.get_bind().dialect.name)
+    rows = slot_rows(db, doctor_ids, start, end, created_by)
+    inserted: list[SlotChange] = []
+    skipped = 0
+    while chunk := list(islice(rows, chunk_size)):
+        if statement is None:
+            written = _insert_missing(db, chunk)
+        else:
+            written = [tuple(row) for row in db.execute(statement, chunk)]
+        inserted.extend(
+            SlotChange.for_row(doctor_id, appointment_time, None)
+            for doctor_id, appointment_time in written
+        )
+        skipped += len(chunk) - len(written)
+    db.commit()
+    publish_slot_changes(inserted)
+    return OpenedSlots(inserted=len(inserted), skipped=skipped)
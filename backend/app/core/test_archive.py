@@ -0,0 +1,165 @@
+# pylint: disable=not-callable
+
+import asyncio
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+from sqlalchemy import func, select, update
+
+import app.core.archive
+from app.core.archive import appointment_archive, archive_appointments
+from app.core.availability import get_calendar, get_calendar_async
+from app.core.exports import export_batches
+from app.models import Appointment, Patient
+
+NEW_YORK = ZoneInfo("America/New_York")
+START = date(2025, 1, 30)
+# Midnight UTC on 2025-02-01 is the watermark, a year after this
+NOW = datetime(2026, 2, 1, 12)
+
+
+def _count(db) -> int:
+    count: int = db.scalar(select(func.count()).select_from(Appointment))
+    return count
+
+
+def _run(db, batch_size: int = 5):
+    return archive_appointments(db, appointment_archive, 365, batch_size, NOW)
+
+
+def test_archiving_moves_past_appointments(db, make_hospital, archive_root):
+    make_hospital(doctors=2, slot_start=START, slot_days=4)
+    make_hospital(doctors=1, slot_start=START, slot_days=4)
+    before = _count(db)
+
+    run = _run(db)
+    again = _run(db)
+
+    # 8 slots a day: the last two days stay, from 09:00 New York (14:00 UTC)
+    assert run.watermark == datetime(2025, 2, 1)
+    assert (run.archived, run.deleted) == (3 * 2 * 8, 3 * 2 * 8)
+    assert _count(db) == before - run.deleted
+    assert db.scalar(select(func.min(Appointment.appointment_time))) == datetime(
+        2025, 2, 1, 14
+    )
+    partitions = sorted(p.parent.name for p in archive_root.glob("*/*/*.gz"))
+    assert set(partitions) == {"month=2025-01"}
+    assert len(list(archive_root.glob("hospital=*"))) == 2
+    assert (again.archived, again.deleted, again.segments) == (0, 0, 0)
+
+
+def test_interrupted_runs_are_finished_without_duplicates(
+    db, make_hospital, monkeypatch
+):
+    hospital = make_hospital(doctors=2, slot_start=START, slot_days=4)
+
+    def crash(*_args):
+        raise RuntimeError("connection lost")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(app.core.archive, "_purge", crash)
+        with pytest.raises(RuntimeError):
+            _run(db)
+    run = _run(db, batch_size=7)
+
+    archived = appointment_archive.read(
+        [hospital.id], datetime(2025, 1, 1), datetime(2025, 2, 1)
+    )
+    assert run.archived == run.deleted == 2 * 2 * 8
+    assert len({slot.id for slot in archived}) == len(archived) == 2 * 2 * 8
+
+
+def test_changes_made_while_archiving_are_archived(db, make_hospital, monkeypatch):
+    hospital = make_hospital(doctors=1, slot_start=START, slot_days=2)
+    doctor_id = hospital.doctors[0].id
+    patient = Patient(name="Pat")
+    db.add(patient)
+    db.commit()
+    booked, added = datetime(2025, 1, 30, 14), datetime(2025, 1, 30, 23)
+    publish = appointment_archive.publish
+
+    def change_then_publish(watermark):
+        # Another session books a copied slot and opens a new one below the watermark
+        db.execute(
+            update(Appointment)
+            .where(Appointment.appointment_time == booked)
+            .values(patient_id=patient.id)
+        )
+        db.add(
+            Appointment(
+                doctor_id=doctor_id,
+                hospital_id=hospital.id,
+                appointment_time=added,
+                created_by=doctor_id,
+            )
+        )
+        db.commit()
+        publish(watermark)
+
+    monkeypatch.setattr(appointment_archive, "publish", change_then_publish)
+    run = _run(db)
+
+    archived = {
+        slot.appointment_time: slot
+        for slot in appointment_archive.read(
+            [hospital.id], datetime(2025, 1, 1), datetime(2025, 2, 1)
+        )
+    }
+    assert (run.archived, run.deleted) == (2 * 8, 2 * 8 + 1)
+    assert archived[booked].patient_id == patient.id
+    assert added in archived
+    assert len(archived) == run.deleted
+
+
+def _book_everything(db) -> int:
+    patient = Patient(name="Pat")
+    db.add(patient)
+    db.flush()
+    db.execute(update(Appointment).values(patient_id=patient.id))
+    db.commit()
+    return patient.id
+
+
+def test_calendars_read_archived_days_transparently(
+    db, async_session_factory, make_hospital, statements
+):
+    hospital = make_hospital(doctors=2, slot_start=START, slot_days=4)
+    doctor_ids = [doctor.id for doctor in hospital.doctors]
+    patient_id = _book_everything(db)
+    end = date(2025, 2, 2)
+    calendar = get_calendar(db, doctor_ids, START, end)
+    _run(db)
+
+    statements.clear()
+    recent = get_calendar(db, doctor_ids, end, end)
+    recent_statements = len(statements)
+    archived = get_calendar(db, doctor_ids, START, end)
+
+    async def read_async():
+        async with async_session_factory() as session:
+            return await get_calendar_async(session, doctor_ids, START, end)
+
+    assert archived == asyncio.run(read_async()) == calendar
+    assert {slot.patient_id for day in archived for slot in day.slots} == {patient_id}
+    assert recent == [day for day in calendar if day.date == end]
+    # None of those days are archived, so only the calendar query runs
+    assert recent_statements == 1
+
+
+def test_exports_read_archived_appointments(db, make_hospital):
+    hospital = make_hospital(doctors=2, slot_start=START, slot_days=4)
+    hospital_id = hospital.id
+    _book_everything(db)
+    end = date(2025, 2, 2)
+
+    def export():
+        batches = export_batches(db, hospital_id, NEW_YORK, START, end, 10)
+        return [row for batch in batches for row in batch]
+
+    before = export()
+    _run(db)
+    after = export()
+
+    assert len(after) == 64
+    assert sorted(after, key=lambda row: row["id"]) == before
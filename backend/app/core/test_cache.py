@@ -0,0 +1,113 @@
+# pylint: disable=redefined-outer-name
+
+from datetime import date
+
+import pytest
+import redis
+from sqlalchemy import event
+
+from app.core.cache import AvailabilityCache, MemoryBackend, RedisBackend
+from app.core.slot_events import on_slot_changes, remove_slot_listener
+from app.models import Appointment, Patient
+
+
+@pytest.fixture(params=["memory", "redis"])
+def cache(request, fake_redis):
+    if request.param == "memory":
+        backend = MemoryBackend(max_entries=1000)
+    else:
+        backend = RedisBackend(fake_redis)
+    availability = AvailabilityCache(backend, ttl=60)
+    on_slot_changes(availability.invalidate)
+    yield availability
+    remove_slot_listener(availability.invalidate)
+
+
+@pytest.fixture
+def statements(engine):
+    executed = []
+
+    def record(_conn, _cursor, statement, *_args):
+        executed.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    yield executed
+    event.remove(engine, "before_cursor_execute", record)
+
+
+def test_repeat_reads_are_served_from_the_cache(db, cache, statements, make_hospital):
+    hospital = make_hospital(doctors=2, slot_start=date(2025, 3, 3), slot_days=3)
+    ids = [doctor.id for doctor in hospital.doctors]
+    statements.clear()
+
+    first = cache.get_calendar(db, ids, date(2025, 3, 3), date(2025, 3, 5))
+    queries = len(statements)
+    second = cache.get_calendar(db, ids, date(2025, 3, 3), date(2025, 3, 5))
+
+    assert queries == 1
+    assert len(statements) == 1
+    assert second == first
+    assert len(second) == 6
+
+
+def test_booking_only_invalidates_the_affected_day(db, cache, make_hospital):
+    hospital = make_hospital(doctors=2, slot_start=date(2025, 3, 3), slot_days=2)
+    first, second = (doctor.id for doctor in hospital.doctors)
+    cache.get_calendar(db, [first, second], date(2025, 3, 3), date(2025, 3, 4))
+
+    appointment = (
+        db.query(Appointment)
+        .filter(Appointment.doctor_id == first)
+        .order_by(Appointment.appointment_time.desc())
+        .first()
+    )
+    patient = Patient(name="Pat")
+    db.add(patient)
+    db.flush()
+    appointment.patient_id = patient.id
+    db.commit()
+
+    keys = [
+        cache.key(doctor_id, day)
+        for doctor_id in (first, second)
+        for day in (date(2025, 3, 3), date(2025, 3, 4))
+    ]
+    assert set(cache.backend.get_many(keys)) == set(keys) - {
+        cache.key(first, date(2025, 3, 4))
+    }
+    days = cache.get_calendar(db, [first], date(2025, 3, 4), date(2025, 3, 4))
+    assert [slot.bookable for slot in days[0].slots][-1] is False
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryBackend(max_entries=2)
+    backend.set_many({"a": b"1", "b": b"2"}, ttl=60)
+    backend.get_many(["a"])
+    backend.set_many({"c": b"3"}, ttl=60)
+
+    assert backend.get_many(["a", "b", "c"]) == {"a": b"1", "c": b"3"}
+
+
+def test_memory_backend_expires_entries():
+    backend = MemoryBackend(max_entries=2)
+    backend.set_many({"a": b"1"}, ttl=0)
+
+    assert not backend.get_many(["a"])
+
+
+def test_redis_errors_fall_back_to_the_database(db, make_hospital):
+    class BrokenRedis:
+        def mget(self, _names):
+            raise redis.ConnectionError("down")
+
+        def pipeline(self, **_kwargs):
+            raise redis.ConnectionError("down")
+
+    hospital = make_hospital(doctors=1, slot_start=date(2025, 3, 3), slot_days=1)
+    cache = AvailabilityCache(RedisBackend(BrokenRedis()), ttl=60)
+
+    days = cache.get_calendar(
+        db, [hospital.doctors[0].id], date(2025, 3, 3), date(2025, 3, 3)
+    )
+
+    assert len(days[0].slots) == 8
@@ -0,0 +1,115 @@
+from datetime import date, datetime
+
+import pytest
+
+from app.core.calendar_versions import (
+    CalendarVersions,
+    MemoryVersions,
+    RedisVersions,
+    etag_matches,
+    make_calendar_versions,
+    version_backend_kind,
+)
+from app.core.config import settings
+from app.core.slot_events import SlotChange, SlotState
+
+MONDAY = date(2025, 3, 3)
+
+
+def _versions(backend=None, settle_seconds: int = 0) -> CalendarVersions:
+    return CalendarVersions(
+        backend or MemoryVersions(max_entries=100),
+        ttl=3600,
+        settle_seconds=settle_seconds,
+        recent_seconds=0,
+    )
+
+
+def _booked(doctor_id: int, appointment_time: datetime) -> SlotChange:
+    return SlotChange(doctor_id, appointment_time, SlotState.BOOKED, patient_id=1)
+
+
+@pytest.mark.parametrize("backend", ["memory", "redis"])
+def test_tags_change_only_with_the_days_they_cover(backend, fake_redis):
+    versions = _versions(
+        RedisVersions(fake_redis, ttl=3600) if backend == "redis" else None
+    )
+    monday = versions.etag([1, 2], MONDAY, MONDAY)
+    week = versions.etag([2, 1], MONDAY, date(2025, 3, 9))
+
+    # Two weeks later, and a doctor who isn't shown
+    versions.changed([_booked(1, datetime(2025, 3, 17, 14))])
+    versions.changed([_booked(3, datetime(2025, 3, 3, 14))])
+    assert versions.etag([1, 2], MONDAY, MONDAY) == monday
+
+    versions.changed([_booked(2, datetime(2025, 3, 6, 14))])
+    assert versions.etag([1, 2], MONDAY, MONDAY) == monday
+    assert versions.etag([1, 2], MONDAY, date(2025, 3, 9)) not in (week, None)
+
+    # 02:00 UTC can still be the day before in the Americas
+    versions.changed([_booked(1, datetime(2025, 3, 4, 2))])
+    assert versions.etag([1, 2], MONDAY, MONDAY) != monday
+
+
+def test_recently_changed_days_get_no_tag():
+    versions = _versions(settle_seconds=60)
+    assert versions.etag([1], MONDAY, MONDAY) is not None
+
+    versions.changed([_booked(1, datetime(2025, 3, 3, 14))])
+
+    assert versions.etag([1], MONDAY, MONDAY) is None
+    assert versions.etag([2], MONDAY, MONDAY) is not None
+
+
+@pytest.mark.parametrize("backend", ["memory", "redis"])
+def test_tags_follow_live_reservations(backend, fake_redis):
+    versions = _versions(
+        RedisVersions(fake_redis, ttl=3600) if backend == "redis" else None
+    )
+    before = versions.etag([1], MONDAY, MONDAY)
+    free = versions.etag([1], MONDAY, MONDAY, reservations=False)
+    slot = datetime(2025, 3, 3, 14)
+
+    versions.reserved(7, 1, slot, ttl=60)
+    reserved = versions.etag([1], MONDAY, MONDAY)
+    versions.released(7, 1, slot)
+    released = versions.etag([1], MONDAY, MONDAY)
+    versions.reserved(8, 1, slot, ttl=-1)
+    lapsed = versions.etag([1], MONDAY, MONDAY)
+    versions.reserved(9, 1, slot, ttl=60)
+
+    assert reserved != before
+    assert released == lapsed == before
+    assert versions.etag([1], MONDAY, MONDAY) not in (before, reserved)
+    # Free slot listings don't show reservations
+    assert versions.etag([1], MONDAY, MONDAY, reservations=False) == free
+
+
+def test_evicting_a_counter_invalidates_every_tag():
+    versions = _versions(MemoryVersions(max_entries=3))
+    versions.changed([_booked(1, datetime(2025, 3, 3, 14))])
+    before = versions.etag([1], MONDAY, MONDAY)
+
+    versions.changed([_booked(2, datetime(2025, 3, 10, 14))])
+
+    assert versions.etag([1], MONDAY, MONDAY) != before
+
+
+def test_if_none_match_lists_are_compared_weakly():
+    assert etag_matches('"a", W/"b"', '"b"')
+    assert etag_matches("*", '"b"')
+    assert not etag_matches('"a"', '"b"')
+    assert not etag_matches(None, '"b"')
+
+
+def test_counters_are_shared_when_the_cache_or_reservations_are(monkeypatch):
+    assert version_backend_kind("", "memory", "memory") == "memory"
+    assert version_backend_kind("", "redis", "memory") == "redis"
+    assert version_backend_kind("", "memory", "redis") == "redis"
+    assert version_backend_kind("memory", "redis", "redis") == "memory"
+
+    monkeypatch.setattr(settings, "calendar_versions_backend", "memory")
+    monkeypatch.setattr(settings, "calendar_versions_ttl", 3600)
+    monkeypatch.setattr(settings, "availability_cache_ttl", 300)
+    # In-process counters miss other workers' changes, so their tags expire sooner
+    assert make_calendar_versions().ttl == 300
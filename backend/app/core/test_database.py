@@ -0,0 +1,110 @@
+import asyncio
+import time as clock
+from contextlib import asynccontextmanager
+
+import pytest
+from starlette.requests import Request
+
+from app.core.config import settings
+from app.core.database import (
+    PRIMARY_READS_COOKIE,
+    ReadRouter,
+    ShardMap,
+    check_shards,
+    fan_out,
+    parse_shards,
+)
+
+
+def _request(method: str = "GET", cookie: str | None = None) -> Request:
+    headers = []
+    if cookie is not None:
+        headers.append((b"cookie", f"{PRIMARY_READS_COOKIE}={cookie}".encode()))
+    return Request({"type": "http", "method": method, "headers": headers})
+
+
+def test_reads_are_spread_across_replicas():
+    router = ReadRouter("primary", ["replica-1", "replica-2"])
+
+    chosen = [router.choose(_request()) for _ in range(4)]
+
+    assert chosen == ["replica-1", "replica-2", "replica-1", "replica-2"]
+    assert ReadRouter("primary", []).choose(_request()) == "primary"
+
+
+def test_writes_and_recent_writers_stay_on_the_primary():
+    router = ReadRouter("primary", ["replica"])
+
+    assert router.choose(_request("POST")) == "primary"
+    assert router.choose(_request(cookie=str(clock.time() + 5))) == "primary"
+    assert router.choose(_request(cookie=str(clock.time() - 5))) == "replica"
+    assert router.choose(_request(cookie="garbage")) == "replica"
+
+
+def test_successful_writes_mark_the_client_for_primary_reads(client, make_user):
+    make_user(email="staff@test.com", password="password")
+
+    login = client.post(
+        "/api/auth/login", json={"email": "staff@test.com", "password": "password"}
+    )
+    rejected = client.post(
+        "/api/auth/login", json={"email": "staff@test.com", "password": "incorrect"}
+    )
+
+    assert float(login.cookies[PRIMARY_READS_COOKIE]) > clock.time()
+    assert PRIMARY_READS_COOKIE not in rejected.cookies
+
+
+def test_hospitals_are_routed_to_their_shard():
+    shards = parse_shards("1-100=postgresql://a/db, 101=postgresql://b/db,")
+    shard_map = ShardMap("default", [(ids, url[-4]) for ids, url in shards])
+
+    assert shards[0] == (range(1, 101), "postgresql://a/db")
+    assert [shard_map.for_hospital(i) for i in (1, 100, 101, 102)] == [
+        "a",
+        "a",
+        "b",
+        "default",
+    ]
+    assert shard_map.all() == ["default", "a", "b"]
+    assert shard_map.group([102, 5, 101, 7, 5]) == [
+        ("default", [102]),
+        ("a", [5, 7]),
+        ("b", [101]),
+    ]
+
+
+def _factory(name: str):
+    @asynccontextmanager
+    async def session():
+        yield name
+
+    return session
+
+
+def test_shards_are_refused_until_every_route_is_routed(monkeypatch):
+    check_shards()
+    monkeypatch.setattr(settings, "database_shards", "1-10=sqlite://")
+
+    with pytest.raises(RuntimeError, match="database_shards is not supported"):
+        check_shards()
+
+
+def test_fan_out_queries_shards_at_once():
+    shards = ShardMap(_factory("default"), [(range(1, 3), _factory("a"))])
+    seen = []
+
+    async def query(session, hospital_ids):
+        seen.append((session, hospital_ids))
+        await asyncio.sleep(0.2)
+        return [(hospital_id, session) for hospital_id in hospital_ids or [0]]
+
+    started = clock.perf_counter()
+    rows = asyncio.run(fan_out(shards, query, [5, 2, 1], key=lambda row: row[0]))
+    elapsed = clock.perf_counter() - started
+    everywhere = asyncio.run(fan_out(shards, query))
+
+    assert rows == [(1, "a"), (2, "a"), (5, "default")]
+    assert elapsed < 0.35
+    assert everywhere == [(0, "default"), (0, "a")]
+    assert seen[-2:] == [("default", None), ("a", None)]
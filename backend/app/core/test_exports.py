@@ -0,0 +1,97 @@
+import csv
+import io
+import json
+import time as clock
+import tracemalloc
+from datetime import date, timedelta
+from zoneinfo import ZoneInfo
+
+import pytest
+from sqlalchemy import select
+
+from app.core.exports import (
+    EXPORT_COLUMNS,
+    csv_chunks,
+    export_batches,
+    ndjson_chunks,
+)
+from app.models import Appointment, Patient
+
+MONDAY = date(2025, 3, 3)
+NEW_YORK = ZoneInfo("America/New_York")
+
+
+def test_exports_join_names_in_one_query(db, make_hospital, statements):
+    hospital = make_hospital(doctors=2, slot_start=MONDAY, slot_days=2)
+    doctor_ids = {doctor.id for doctor in hospital.doctors}
+    # Another hospital's slots at the same times are left out
+    make_hospital(doctors=1, slot_start=MONDAY, slot_days=1)
+    patient = Patient(name="Pat")
+    db.add(patient)
+    db.flush()
+    booked = db.scalars(select(Appointment).order_by(Appointment.id)).first()
+    booked.patient_id = patient.id
+    db.commit()
+    hospital_id = hospital.id
+    statements.clear()
+
+    batches = list(export_batches(db, hospital_id, NEW_YORK, MONDAY, MONDAY, 5))
+
+    assert len(statements) == 1
+    assert [len(batch) for batch in batches] == [5, 5, 5, 1]
+    rows = [row for batch in batches for row in batch]
+    assert {row["doctor_id"] for row in rows} == doctor_ids
+    first = rows[0]
+    assert first["id"] == booked.id
+    assert first["appointment_time"] == "2025-03-03T09:00:00"
+    assert first["appointment_time_utc"] == "2025-03-03T14:00:00Z"
+    assert first["doctor_name"] == "Doctor 0"
+    assert (first["patient_id"], first["patient_name"]) == (patient.id, "Pat")
+    assert first["created_by_name"] == "Doctor 0"
+    assert rows[1]["patient_name"] is None
+
+
+def test_exports_encode_as_ndjson_and_csv(db, make_hospital):
+    hospital = make_hospital(doctors=1, slot_start=MONDAY, slot_days=1)
+
+    def batches(start: date = MONDAY):
+        return export_batches(db, hospital.id, NEW_YORK, start, start, 3)
+
+    lines = b"".join(ndjson_chunks(batches())).decode().splitlines()
+    table = list(csv.DictReader(io.StringIO(b"".join(csv_chunks(batches())).decode())))
+    empty = b"".join(csv_chunks(batches(MONDAY + timedelta(days=1)))).decode()
+
+    assert len(table) == len(lines) == 8
+    assert list(table[0]) == list(json.loads(lines[0])) == list(EXPORT_COLUMNS)
+    assert [row["id"] for row in table] == [str(json.loads(l)["id"]) for l in lines]
+    assert empty == ",".join(EXPORT_COLUMNS) + "\n"
+
+
+def _export_peak(db, hospital_id: int, days: int) -> tuple[int, int]:
+    """Size and peak traced memory of an NDJSON export of ``days`` days."""
+    end = MONDAY + timedelta(days=days - 1)
+    tracemalloc.start()
+    try:
+        batches = export_batches(db, hospital_id, NEW_YORK, MONDAY, end, 1000)
+        size = sum(len(chunk) for chunk in ndjson_chunks(batches))
+        return size, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.benchmark
+def test_export_memory_stays_flat(db, make_hospital):
+    """A month of 100 doctors' slots peaks no higher than a week of them."""
+    hospital_id = make_hospital(doctors=100, slot_start=MONDAY, slot_days=30).id
+
+    week, week_peak = _export_peak(db, hospital_id, 7)
+    started = clock.perf_counter()
+    month, month_peak = _export_peak(db, hospital_id, 30)
+    elapsed = clock.perf_counter() - started
+
+    print(
+        f"exported {month / 2**20:.1f}MiB in {elapsed:.2f}s, "
+        f"peak {month_peak / 2**20:.1f}MiB (a week: {week_peak / 2**20:.1f}MiB)"
+    )
+    assert month > 4 * week
+    assert month_peak < 1.5 * week_peak
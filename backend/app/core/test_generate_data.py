@@ -0,0 +1,62 @@
+# pylint: disable=not-callable
+
+from datetime import date
+
+import pytest
+from sqlalchemy import func, select
+
+from app.core.availability import get_calendar, to_local
+from app.core.generate_data import Scale, generate
+from app.models import (
+    Appointment,
+    Doctor,
+    Hospital,
+    Patient,
+    Staff,
+    with_profile,
+)
+
+SCALE = Scale(
+    hospitals=3,
+    doctors=2,
+    staff=1,
+    patients=20,
+    days=3,
+    density=0.5,
+    start=date(2025, 3, 8),
+)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_generated_data_fills_every_opening_hour(
+    db, database_path, make_hospital, workers
+):
+    existing = make_hospital(doctors=1)
+
+    report = generate(f"sqlite:///{database_path}", SCALE, workers, chunk_size=50)
+
+    def count(model):
+        return db.scalar(select(func.count()).select_from(model))
+
+    assert count(Hospital) == 4
+    assert count(Doctor) == 7
+    assert count(Staff) == 3
+    assert count(Patient) == 20
+    assert report.rows["appointments"] == count(Appointment)
+    assert report.rows_per_second > 0
+
+    booked = db.scalar(select(func.count()).where(Appointment.patient_id.is_not(None)))
+    assert 0 < booked < count(Appointment)
+    others = select(Hospital).where(Hospital.id != existing.id)
+    for hospital in db.scalars(with_profile(others, "hospital roster")):
+        doctor_ids = [doctor.id for doctor in hospital.doctors]
+        days = get_calendar(db, doctor_ids, SCALE.start, date(2025, 3, 10))
+        hours = range(hospital.open_time.hour, hospital.close_time.hour)
+        for day in days:
+            assert [slot.time.hour for slot in day.slots] == list(hours)
+        first = db.scalar(
+            select(func.min(Appointment.appointment_time)).where(
+                Appointment.doctor_id.in_(doctor_ids)
+            )
+        )
+        assert to_local(first, hospital.timezone).date() == SCALE.start
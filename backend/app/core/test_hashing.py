@@ -0,0 +1,24 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.core.hashing import HasherBusy, PasswordHasher
+
+
+def test_calls_beyond_max_pending_are_rejected():
+    hasher = PasswordHasher(workers=1, max_pending=2)
+    release = threading.Event()
+
+    async def run() -> list:
+        admitted = [asyncio.ensure_future(hasher.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert hasher.pending == 2
+        with pytest.raises(HasherBusy):
+            await hasher.run(release.wait)
+        release.set()
+        return await asyncio.gather(*admitted)
+
+    assert asyncio.run(run()) == [True, True]
+    assert hasher.pending == 0
+    assert asyncio.run(hasher.run(sum, [1, 2])) == 3
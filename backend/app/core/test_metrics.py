@@ -0,0 +1,131 @@
+import logging
+import statistics
+import time as clock
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from app.core.cache import availability_cache
+from app.core.config import settings
+from app.core.metrics import (
+    Counter,
+    Histogram,
+    RequestStats,
+    n_plus_one_requests,
+    record_request,
+    registry,
+    request_queries,
+    request_seconds,
+    slot_conflicts,
+)
+from app.models import Appointment
+
+
+def test_metrics_render_in_prometheus_text_format():
+    requests = Counter("requests_total", "Requests.", ["route"])
+    latency = Histogram("latency_seconds", "Latency.", buckets=(0.1, 1))
+    requests.inc('/a"b')
+    requests.inc('/a"b', amount=2)
+    for value in (0.05, 0.5, 5):
+        latency.observe(value)
+
+    assert list(requests.samples()) == ['requests_total{route="/a\\"b"} 3']
+    assert list(latency.samples()) == [
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        "latency_seconds_sum 5.55",
+        "latency_seconds_count 3",
+    ]
+
+
+def test_requests_are_recorded_by_route_with_their_queries(client, make_hospital):
+    hospital = make_hospital(doctors=1, slot_start=date(2025, 3, 3), slot_days=1)
+    doctor_id = hospital.doctors[0].id
+
+    client.get(
+        "/api/appointments",
+        params={"doctor": [doctor_id], "start": "2025-03-03", "end": "2025-03-03"},
+    )
+    client.get(
+        f"/api/hospitals/{hospital.id}/free-slots",
+        params={"start": "2025-03-03", "end": "2025-03-03"},
+    )
+    client.get("/nowhere")
+    exposed = client.get("/metrics")
+
+    assert request_seconds.count("GET", "/api/appointments", "200") == 1
+    assert request_seconds.count("GET", "/nowhere", "404") == 0
+    assert request_seconds.count("GET", "unmatched", "404") == 1
+    # An async route and a sync route in the threadpool
+    assert request_queries.count("/api/appointments") == 1
+    assert 'http_request_db_queries_bucket{route="/api/appointments",le="0"} 0' in (
+        exposed.text
+    )
+    assert 'route="/api/hospitals/{hospital_id}/free-slots",le="0"} 0' in (exposed.text)
+    assert exposed.headers["content-type"].startswith("text/plain; version=0.0.4")
+
+
+def test_repeated_statements_are_reported_as_n_plus_one(caplog):
+    stats = RequestStats(queries=12, statements={"SELECT 1": 11, "SELECT 2": 1})
+
+    with caplog.at_level(logging.WARNING, logger="app.core.metrics"):
+        record_request("GET", "/things", 200, 0.01, stats)
+        record_request("GET", "/other", 200, 0.01, RequestStats(queries=1))
+
+    assert n_plus_one_requests.value("/things") == 1
+    assert n_plus_one_requests.value("/other") == 0
+    assert "11 executions of SELECT 1" in caplog.text
+
+
+def test_double_bookings_caught_by_the_unique_index_are_counted(db, make_hospital):
+    hospital = make_hospital(doctors=1, slot_start=date(2025, 3, 3), slot_days=1)
+    doctor_id = hospital.doctors[0].id
+
+    db.add(
+        Appointment(
+            doctor_id=doctor_id,
+            hospital_id=hospital.id,
+            appointment_time=datetime(2025, 3, 3, 14),
+            created_by=doctor_id,
+        )
+    )
+    with pytest.raises(IntegrityError):
+        db.commit()
+
+    assert slot_conflicts.value("unique_index") == 1
+    assert "slot_conflicts_total" in registry.render()
+
+
+@pytest.mark.benchmark
+def test_instrumentation_overhead(client, make_hospital, monkeypatch, statements):
+    """Metrics add only a few percent to a calendar request read from the database."""
+    hospital = make_hospital(doctors=20, slot_start=date(2025, 3, 3), slot_days=14)
+    params = {
+        "doctor": [doctor.id for doctor in hospital.doctors],
+        "start": "2025-03-03",
+        "end": "2025-03-16",
+    }
+
+    def timed(enabled):
+        monkeypatch.setattr(settings, "metrics_enabled", enabled)
+        # A cached calendar wouldn't run any SQL for the query hooks to time
+        availability_cache.clear()
+        statements.clear()
+        started = clock.perf_counter()
+        client.get("/api/appointments", params=params)
+        elapsed = clock.perf_counter() - started
+        assert statements
+        return elapsed
+
+    client.get("/api/appointments", params=params)
+    # Interleaved, so drift in the machine's speed affects both alike
+    timings = {True: [], False: []}
+    for _ in range(100):
+        for enabled in (False, True):
+            timings[enabled].append(timed(enabled))
+    off, on = statistics.median(timings[False]), statistics.median(timings[True])
+
+    print(f"median request: {off * 1000:.1f}ms without metrics, {on * 1000:.1f}ms with")
+    assert on < off * 1.05
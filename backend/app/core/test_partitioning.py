@@ -0,0 +1,136 @@
+"""
+The partitioning migration needs PostgreSQL, so these tests run against
+``DATABASE_URL`` in a throwaway schema, and are skipped when it can't be reached.
+"""
+
+# pylint: disable=not-callable,redefined-outer-name
+
+import re
+import secrets
+from datetime import date, datetime, time
+from typing import Iterator
+from zoneinfo import ZoneInfo
+
+import pytest
+from sqlalchemy import Engine, create_engine, func, select, text
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.exports import export_query
+from app.core.metrics import is_double_booking
+from app.core.partitioning import (
+    create_month_sql,
+    is_partitioned,
+    migrate,
+    months_between,
+)
+from app.core.slots import open_slots
+from app.models import Appointment, Base, Doctor, Hospital
+
+LEAF = re.compile(r"appointments_\d{4}_\d{2}_h\d+")
+
+
+def test_months_are_split_into_named_hash_partitions():
+    statements = create_month_sql("appointments", date(2025, 12, 1), 2)
+
+    assert months_between(date(2025, 11, 15), date(2026, 1, 1)) == [
+        date(2025, 11, 1),
+        date(2025, 12, 1),
+        date(2026, 1, 1),
+    ]
+    assert "FROM ('2025-12-01') TO ('2026-01-01')" in statements[0]
+    assert statements[2].startswith(
+        "CREATE UNIQUE INDEX idx_unique_doctor_timeslot_2025_12_h0 "
+    )
+    assert statements[-1].endswith("(MODULUS 2, REMAINDER 1)")
+
+
+@pytest.fixture
+def postgres() -> Iterator[Engine]:
+    """An engine on a schema of its own, dropped afterwards."""
+    if not settings.database_url.startswith("postgresql"):
+        pytest.skip("DATABASE_URL isn't PostgreSQL")
+    schema = f"partitioning_{secrets.token_hex(4)}"
+    admin = create_engine(settings.database_url, connect_args={"connect_timeout": 2})
+    try:
+        with admin.begin() as connection:
+            connection.exec_driver_sql(f"CREATE SCHEMA {schema}")
+    except OperationalError:
+        admin.dispose()
+        pytest.skip("PostgreSQL isn't reachable")
+    engine = create_engine(
+        settings.database_url, connect_args={"options": f"-csearch_path={schema}"}
+    )
+    yield engine
+    engine.dispose()
+    with admin.begin() as connection:
+        connection.exec_driver_sql(f"DROP SCHEMA {schema} CASCADE")
+    admin.dispose()
+
+
+def _leaves(db: Session, statement) -> set[str]:
+    """The leaf partitions PostgreSQL plans to read for a statement."""
+    compiled = statement.compile(
+        dialect=db.get_bind().dialect, compile_kwargs={"literal_binds": True}
+    )
+    plan = "\n".join(db.scalars(text(f"EXPLAIN {compiled}")))
+    return set(LEAF.findall(plan))
+
+
+def test_partitioned_queries_prune_to_one_partition(postgres):
+    Base.metadata.create_all(postgres)
+    with Session(postgres) as db:
+        hospitals = [
+            Hospital(
+                name=f"Hospital {i}",
+                address="1 Test Street",
+                timezone=ZoneInfo("UTC"),
+                open_time=time(9),
+                close_time=time(17),
+            )
+            for i in range(3)
+        ]
+        db.add_all(hospitals)
+        db.flush()
+        db.add_all([Doctor(name="Doctor", hospital_id=h.id) for h in hospitals * 2])
+        db.commit()
+        doctor_ids = db.scalars(select(Doctor.id)).all()
+        open_slots(db, doctor_ids, date(2025, 3, 30), date(2025, 4, 2))
+        hospital_id = hospitals[0].id
+    # The schema before hospital_id
+    with postgres.begin() as connection:
+        connection.exec_driver_sql("ALTER TABLE appointments DROP COLUMN hospital_id")
+        connection.exec_driver_sql(
+            "CREATE UNIQUE INDEX idx_unique_doctor_timeslot "
+            "ON appointments (doctor_id, appointment_time)"
+        )
+
+    copied = migrate(postgres, modulus=4, months_ahead=1, batch_size=7)
+    again = migrate(postgres, modulus=4, months_ahead=1, batch_size=7)
+
+    with Session(postgres) as db:
+        assert is_partitioned(db.connection())
+        assert copied == 6 * 4 * 8 == db.scalar(select(func.count(Appointment.id)))
+        assert again is None
+        one_hospital_in_april = export_query(
+            hospital_id, datetime(2025, 4, 1), datetime(2025, 4, 3)
+        )
+        (leaf,) = _leaves(db, one_hospital_in_april)
+        assert leaf.startswith("appointments_2025_04_h")
+        assert len(_leaves(db, select(Appointment.id))) >= 2 * 4
+
+        # Existing slots are still found by the unique index, through the partitions
+        reopened = open_slots(db, doctor_ids, date(2025, 3, 31), date(2025, 4, 1))
+        assert (reopened.inserted, reopened.skipped) == (0, 6 * 2 * 8)
+        db.add(
+            Appointment(
+                doctor_id=doctor_ids[0],
+                hospital_id=hospital_id,
+                appointment_time=datetime(2025, 4, 1, 9),
+                created_by=doctor_ids[0],
+            )
+        )
+        with pytest.raises(IntegrityError) as error:
+            db.commit()
+        assert is_double_booking(error.value.orig)
@@ -0,0 +1,99 @@
+# pylint: disable=redefined-outer-name
+
+import threading
+import time as clock
+
+import pytest
+
+from app.core.cache import MemoryBackend, RedisBackend
+from app.core.refresh_tokens import RefreshTokenStore
+
+
+@pytest.fixture(params=["memory", "redis"])
+def store(request, fake_redis):
+    if request.param == "memory":
+        backend = MemoryBackend(max_entries=1000)
+    else:
+        backend = RedisBackend(fake_redis, prefix="auth:")
+    return RefreshTokenStore(backend, ttl=60, secret="secret")
+
+
+def test_rotation_replaces_the_token(store):
+    token = store.issue("user-1", "staff@test.com")
+
+    payload, rotated = store.rotate(token)
+
+    assert payload["sub"] == "user-1"
+    assert rotated != token
+    assert store.verify(rotated)["fam"] == payload["fam"]
+
+
+def test_reusing_a_rotated_token_revokes_the_family(store):
+    token = store.issue("user-1", "staff@test.com")
+    other_session = store.issue("user-1", "staff@test.com")
+    _, rotated = store.rotate(token)
+
+    assert store.rotate(token) is None
+    assert store.verify(rotated) is None
+    assert store.verify(other_session) is not None
+
+
+def test_concurrent_refreshes_rotate_once(store):
+    store.grace = 5
+    token = store.issue("user-1", "staff@test.com")
+    start = threading.Barrier(8)
+    results = []
+
+    def refresh():
+        start.wait()
+        results.append(store.rotate(token))
+
+    threads = [threading.Thread(target=refresh) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    winners = [result for result in results if result is not None]
+    assert len(winners) == 1
+    assert store.verify(winners[0][1]) is not None
+
+
+def test_the_replaced_token_is_turned_away_quietly_during_the_grace_period(store):
+    store.grace = 5
+    token = store.issue("user-1", "staff@test.com")
+    _, rotated = store.rotate(token)
+
+    assert store.rotate(token) is None
+    assert store.verify(rotated) is not None
+    # Only the token just replaced gets the grace period
+    _, latest = store.rotate(rotated)
+    assert store.rotate(token) is None
+    assert store.verify(latest) is None
+
+
+def test_revocation(store):
+    logged_out = store.issue("user-1", "staff@test.com")
+    store.revoke(logged_out)
+    deactivated = store.issue("user-2", "other@test.com")
+    store.revoke_user("user-2")
+
+    assert store.verify(logged_out) is None
+    assert store.verify(deactivated) is None
+    assert store.verify("not-a-token") is None
+    # Even within the same second as the cutoff
+    assert store.verify(store.issue("user-2", "other@test.com")) is not None
+
+
+@pytest.mark.benchmark
+def test_refresh_cost(store):
+    token = store.issue("user-1", "staff@test.com")
+    rotations = 2000
+
+    started = clock.perf_counter()
+    for _ in range(rotations):
+        _, token = store.rotate(token)
+    per_refresh = (clock.perf_counter() - started) / rotations
+
+    print(f"refresh rotation: {per_refresh * 1e6:.0f}us")
+    assert per_refresh < 0.001
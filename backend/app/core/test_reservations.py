@@ -0,0 +1,94 @@
+# pylint: disable=redefined-outer-name
+
+import time as clock
+from datetime import date, time
+
+import pytest
+
+from app.core.availability import CalendarDay, CalendarSlot
+from app.core.reservations import (
+    MemoryReservations,
+    RedisReservations,
+    Reservations,
+    TooManyReservations,
+)
+
+
+@pytest.fixture(params=["memory", "redis"])
+def slots(request, fake_redis):
+    if request.param == "memory":
+        backend = MemoryReservations()
+    else:
+        backend = RedisReservations(fake_redis)
+    return Reservations(backend, ttl=60, limit=2)
+
+
+def test_only_the_holder_can_extend_or_release(slots):
+    assert slots.claim(1, "alice")
+    assert not slots.claim(1, "bob")
+    assert slots.claim(1, "alice")  # Claiming again extends
+
+    assert not slots.extend(1, "bob")
+    assert not slots.release(1, "bob")
+    assert slots.extend(1, "alice")
+    assert slots.holder(1) == "alice"
+    assert slots.release(1, "alice")
+    assert slots.holder(1) is None
+    assert slots.claim(1, "bob")
+
+
+def test_reservations_expire(slots):
+    slots.ttl = 0.05
+    slots.claim(1, "alice")
+
+    clock.sleep(0.06)
+
+    assert not slots.extend(1, "alice")
+    assert slots.claim(1, "bob")
+
+
+def test_holders_can_only_reserve_a_few_slots_at_once(slots):
+    assert slots.claim(1, "alice")
+    assert slots.claim(2, "alice")
+    with pytest.raises(TooManyReservations):
+        slots.claim(3, "alice")
+
+    assert slots.claim(2, "alice")  # Extending isn't claiming another
+    assert slots.claim(3, "bob")
+    assert slots.release(1, "alice")
+    assert slots.claim(4, "alice")
+
+
+def test_lapsed_reservations_stop_counting(slots):
+    slots.ttl = 0.05
+    slots.claim(1, "alice")
+    slots.claim(2, "alice")
+
+    clock.sleep(0.06)
+
+    assert slots.claim(3, "alice")
+    assert slots.claim(1, "bob")
+
+
+def test_calendars_mark_reserved_slots(slots):
+    days = [
+        CalendarDay(
+            doctor_id=1,
+            date=date(2025, 3, 3),
+            slots=[
+                CalendarSlot(1, time(9), bookable=True),
+                CalendarSlot(2, time(10), bookable=True),
+                CalendarSlot(3, time(11), bookable=False, patient_id=5),
+            ],
+        )
+    ]
+    slots.claim(2, "alice")
+
+    marked = slots.mark_reserved(days)
+
+    assert [(s.bookable, s.reserved) for s in marked[0].slots] == [
+        (True, False),
+        (False, True),
+        (False, False),
+    ]
+    assert days[0].slots[1].bookable  # The cached calendar isn't modified
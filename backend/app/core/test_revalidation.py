@@ -0,0 +1,134 @@
+# pylint: disable=not-callable
+
+from datetime import date, time, timedelta
+
+from sqlalchemy import func, select, update
+
+from app.core.revalidation import ConflictReason, record_change, revalidate
+from app.core.slot_events import (
+    SlotState,
+    on_slot_changes,
+    remove_slot_listener,
+)
+from app.models import (
+    Appointment,
+    AppointmentConflict,
+    AvailabilityChange,
+    Hospital,
+    Patient,
+)
+
+SOON = date.today() + timedelta(days=3)
+
+
+def _book_every_other_slot(db) -> int:
+    patient = Patient(name="Pat")
+    db.add(patient)
+    db.flush()
+    ids = db.scalars(select(Appointment.id).order_by(Appointment.id)).all()[::2]
+    db.execute(
+        update(Appointment).where(Appointment.id.in_(ids)).values(patient_id=patient.id)
+    )
+    db.commit()
+    return len(ids)
+
+
+def _count(db, model):
+    return db.scalar(select(func.count()).select_from(model))
+
+
+def test_shorter_hours_leave_conflicts_to_reschedule(db, make_hospital):
+    # UTC, so the 8 opening hours are 09:00..16:00 and the bookings the odd hours
+    hospital = make_hospital(doctors=2, timezone="UTC", slot_start=SOON, slot_days=2)
+    _book_every_other_slot(db)
+    removed = []
+    on_slot_changes(removed.extend)
+
+    hospital.close_time = time(15)
+    db.commit()
+    try:
+        run = revalidate(db, batch_size=5)
+    finally:
+        remove_slot_listener(removed.extend)
+
+    # 15:00 and 16:00 for 2 doctors on 2 days; 15:00 is booked and 16:00 open
+    assert (run.checked, run.conflicts, run.removed) == (32, 4, 4)
+    assert (run.batches, run.changes) == (7, 1)
+    conflicts = db.scalars(select(AppointmentConflict)).all()
+    assert {c.appointment_time.hour for c in conflicts} == {15}
+    assert {c.reason for c in conflicts} == {ConflictReason.OUTSIDE_HOURS}
+    assert {change.state for change in removed} == {SlotState.REMOVED}
+    assert _count(db, Appointment) == 32 - 4
+    assert _count(db, AvailabilityChange) == 0
+
+
+def test_a_stopped_run_resumes_from_its_checkpoint(db, make_hospital):
+    hospital = make_hospital(doctors=3, slot_start=SOON, slot_days=3)
+    first_doctor = min(doctor.id for doctor in hospital.doctors)
+    _book_every_other_slot(db)
+    hospital.open_time = time(12)
+    db.commit()
+
+    first = revalidate(db, batch_size=10, max_batches=2)
+    change = db.scalars(select(AvailabilityChange)).one()
+    checkpoint = (change.after_doctor_id, change.after_time)
+    rest = revalidate(db, batch_size=10)
+
+    assert (first.checked, first.changes) == (20, 0)
+    # 24 slots for each doctor
+    assert checkpoint[0] == first_doctor
+    assert checkpoint[1] is not None
+    assert first.checked + rest.checked == 3 * 3 * 8
+    # Local 09:00..11:00 on 3 days for 3 doctors, half of them booked
+    total = first.conflicts + rest.conflicts + first.removed + rest.removed
+    assert total == 3 * 3 * 3
+    assert _count(db, AppointmentConflict) == first.conflicts + rest.conflicts
+    assert _count(db, AvailabilityChange) == 0
+
+
+def test_doctors_moving_hospital_conflict_with_their_old_slots(db, make_hospital):
+    hospital = make_hospital(doctors=2, slot_start=SOON, slot_days=1)
+    moving = hospital.doctors[0]
+    elsewhere = make_hospital(doctors=1)
+    booked = _book_every_other_slot(db)
+
+    moving.hospital_id = elsewhere.id
+    db.commit()
+    run = revalidate(db, batch_size=100)
+
+    conflicts = db.scalars(select(AppointmentConflict)).all()
+    assert (run.checked, run.conflicts + run.removed) == (8, 8)
+    assert {c.doctor_id for c in conflicts} == {moving.id}
+    assert {c.reason for c in conflicts} == {ConflictReason.WRONG_HOSPITAL}
+    assert _count(db, Appointment) == 16 - run.removed
+    assert booked == 8
+
+
+def test_covered_changes_are_checked_once(db, make_hospital):
+    hospital = make_hospital(doctors=1, slot_start=SOON, slot_days=1)
+    other = make_hospital(doctors=1, slot_start=SOON, slot_days=1)
+    record_change(db, start=SOON, hospital_id=hospital.id)
+    record_change(db, start=SOON, end=SOON, hospital_id=hospital.id)
+    record_change(db, start=SOON, hospital_id=other.id)
+    db.commit()
+
+    run = revalidate(db, batch_size=100)
+
+    assert (run.changes, run.checked, run.conflicts, run.removed) == (2, 16, 0, 0)
+
+
+def test_conflicts_are_resolved_when_availability_returns(db, make_hospital):
+    hospital = make_hospital(doctors=1, slot_start=SOON, slot_days=1)
+    _book_every_other_slot(db)
+    hospital.close_time = time(13)
+    db.commit()
+    revalidate(db, batch_size=100)
+    assert _count(db, AppointmentConflict) == 2
+
+    hospital = db.get(Hospital, hospital.id)
+    hospital.close_time = time(17)
+    db.commit()
+    run = revalidate(db, batch_size=100)
+
+    assert (run.checked, run.conflicts) == (6, 0)
+    assert _count(db, AppointmentConflict) == 0
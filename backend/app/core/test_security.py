@@ -0,0 +1,93 @@
+import asyncio
+
+from sqlalchemy import update
+
+from app.core.auth import create_jwt_token
+from app.core.refresh_tokens import refresh_tokens
+from app.core.security import authenticate, load_principal
+from app.models import Staff, User
+
+
+def test_callers_are_identified_without_a_query(client, make_user, statements):
+    user = make_user()
+    client.cookies.set("access_token", create_jwt_token(user.id, user.email))
+    statements.clear()
+
+    assert client.get("/api/auth/me").status_code == 200
+    loaded = len(statements)
+    assert client.get("/api/auth/me").status_code == 200
+
+    assert loaded == 1
+    assert len(statements) == loaded
+
+
+def test_simultaneous_misses_share_one_load(async_session_factory, make_user):
+    user = make_user()
+    token = create_jwt_token(user.id, user.email)
+    loads = []
+
+    async def load(user_id):
+        loads.append(user_id)
+        async with async_session_factory() as session:
+            return await load_principal(session, user_id)
+
+    async def run():
+        return await asyncio.gather(*(authenticate(token, load) for _ in range(50)))
+
+    principals = asyncio.run(run())
+
+    assert loads == [user.id]
+    assert {principal.id for principal in principals} == {user.id}
+
+
+def test_principals_carry_their_hospital(
+    db, async_session_factory, make_hospital, make_user
+):
+    hospital = make_hospital(doctors=1)
+    doctor_id = hospital.doctors[0].id
+    staff = Staff(name="Staff", hospital_id=hospital.id)
+    db.add(staff)
+    db.commit()
+    doctor_user = make_user("doctor@test.com", person_id=doctor_id)
+    staff_user = make_user("staff@test.com", person_id=staff.id, is_superuser=True)
+    admin = make_user("admin@test.com")
+
+    async def load(user_id):
+        async with async_session_factory() as session:
+            return await load_principal(session, user_id)
+
+    assert asyncio.run(load(doctor_user.id)).hospital_ids == (hospital.id,)
+    principal = asyncio.run(load(staff_user.id))
+    assert (principal.hospital_ids, principal.is_superuser) == ((hospital.id,), True)
+    assert asyncio.run(load(admin.id)).hospital_ids == ()
+    assert asyncio.run(load("missing")) is None
+
+
+def test_deactivation_takes_effect_immediately(client, db, make_user):
+    user = make_user()
+    client.cookies.set("access_token", create_jwt_token(user.id, user.email))
+    refresh_token = refresh_tokens.issue(user.id, user.email)
+    assert client.get("/api/auth/me").status_code == 200
+
+    user.is_active = False
+    db.commit()
+
+    assert client.get("/api/auth/me").status_code == 403
+    assert refresh_tokens.verify(refresh_token) is None
+
+
+def test_logout_drops_the_cached_principal(client, db, make_user):
+    user = make_user()
+    client.cookies.set("access_token", create_jwt_token(user.id, user.email))
+    assert client.get("/api/auth/me").json()["email"] == "staff@test.com"
+
+    # A bulk UPDATE bypasses the session's change tracking, so only logout can
+    # invalidate the entry
+    db.execute(update(User).where(User.id == user.id).values(email="moved@test.com"))
+    db.commit()
+    stale = client.get("/api/auth/me").json()["email"]
+    client.post("/api/auth/logout")
+    client.cookies.set("access_token", create_jwt_token(user.id, user.email))
+
+    assert stale == "staff@test.com"
+    assert client.get("/api/auth/me").json()["email"] == "moved@test.com"
@@ -0,0 +1,176 @@
+import asyncio
+import json
+import threading
+import time
+from datetime import date, datetime
+from typing import cast
+
+import pytest
+import redis
+from fastapi import Request
+
+from app.api.rest.slot_feed import server_sent_events
+from app.core.slot_events import SlotState
+from app.core.slot_feed import (
+    MemoryBroker,
+    Overflowed,
+    RedisBroker,
+    SlotDelta,
+    SlotFeed,
+    slot_feed,
+)
+from app.models import Appointment, Patient
+
+NINE = datetime(2025, 3, 3, 14)
+TEN = datetime(2025, 3, 3, 15)
+
+
+def _feed(max_pending: int = 100) -> SlotFeed:
+    return SlotFeed(MemoryBroker(), max_pending=max_pending, coalesce_seconds=0.01)
+
+
+def test_bursts_are_coalesced_per_slot_and_filtered_by_doctor():
+    async def run() -> list[SlotDelta]:
+        feed = _feed()
+        subscription = feed.subscribe([1, 2])
+        feed.broker.publish([SlotDelta(1, TEN, SlotState.OPEN)])
+        feed.broker.publish(
+            [SlotDelta(1, TEN, SlotState.BOOKED), SlotDelta(3, NINE, SlotState.OPEN)]
+        )
+        feed.broker.publish([SlotDelta(2, NINE, SlotState.REMOVED)])
+        return await subscription.next_batch(timeout=1)
+
+    assert asyncio.run(run()) == [
+        SlotDelta(2, NINE, SlotState.REMOVED),
+        SlotDelta(1, TEN, SlotState.BOOKED),
+    ]
+
+
+def test_slow_consumers_are_told_to_resync_instead_of_queueing():
+    async def run() -> tuple[bool, list[SlotDelta], list[SlotDelta]]:
+        feed = _feed(max_pending=3)
+        subscription = feed.subscribe([1])
+        feed.broker.publish(
+            [SlotDelta(1, datetime(2025, 3, 3, h), SlotState.OPEN) for h in range(5)]
+        )
+        try:
+            await subscription.next_batch(timeout=1)
+            overflowed = False
+        except Overflowed:
+            overflowed = True
+        idle = await subscription.next_batch(timeout=0.05)
+        feed.broker.publish([SlotDelta(1, TEN, SlotState.BOOKED)])
+        return overflowed, idle, await subscription.next_batch(timeout=1)
+
+    overflowed, idle, recovered = asyncio.run(run())
+
+    assert overflowed
+    assert not idle
+    assert recovered == [SlotDelta(1, TEN, SlotState.BOOKED)]
+
+
+def test_committed_bookings_reach_subscribers_without_patients(db, make_hospital):
+    hospital = make_hospital(doctors=2, slot_start=date(2025, 3, 3), slot_days=1)
+    doctor_id = hospital.doctors[0].id
+    patient = Patient(name="Pat")
+    db.add(patient)
+    db.commit()
+
+    async def run() -> list[SlotDelta]:
+        subscription = slot_feed.subscribe([doctor_id])
+        try:
+            slot = (
+                db.query(Appointment)
+                .filter(Appointment.doctor_id == doctor_id)
+                .order_by(Appointment.appointment_time)
+                .first()
+            )
+            slot.patient_id = patient.id
+            db.commit()
+            return await subscription.next_batch(timeout=1)
+        finally:
+            slot_feed.unsubscribe(subscription)
+
+    assert asyncio.run(run()) == [SlotDelta(doctor_id, NINE, SlotState.BOOKED)]
+    assert slot_feed.broker.subscribers == 0
+
+
+def test_redis_broker_fans_out_across_workers(fake_redis):
+    publisher = RedisBroker(fake_redis)
+    worker = SlotFeed(RedisBroker(fake_redis), max_pending=10, coalesce_seconds=0.01)
+
+    async def run() -> list[SlotDelta]:
+        subscription = worker.subscribe([1])
+        # Wait for the listener thread to subscribe to the channel
+        while not fake_redis.subscribers or not fake_redis.subscribers[0].channels:
+            await asyncio.sleep(0.01)
+        publisher.publish([SlotDelta(1, TEN, SlotState.OPEN)])
+        deltas: list[SlotDelta] = await subscription.next_batch(timeout=2)
+        return deltas
+
+    assert asyncio.run(run()) == [SlotDelta(1, TEN, SlotState.OPEN)]
+
+
+def test_redis_broker_publishes_without_waiting_for_redis(fake_redis, monkeypatch):
+    sent = threading.Event()
+    monkeypatch.setattr(fake_redis, "publish", lambda *args: sent.wait(2))
+    broker = RedisBroker(fake_redis)
+
+    started = time.perf_counter()
+    broker.publish([SlotDelta(1, TEN, SlotState.OPEN)])
+    assert time.perf_counter() - started < 0.5
+    sent.set()
+
+
+def test_redis_broker_resyncs_subscribers_after_losing_the_channel(fake_redis):
+    broker = RedisBroker(fake_redis)
+    broker.retry_seconds = 0.01
+    worker = SlotFeed(broker, max_pending=10, coalesce_seconds=0.01)
+
+    async def run() -> None:
+        subscription = worker.subscribe([1])
+        while not fake_redis.subscribers or not fake_redis.subscribers[0].channels:
+            await asyncio.sleep(0.01)
+        fake_redis.subscribers[0].messages.put(redis.ConnectionError())
+        await subscription.next_batch(timeout=2)
+
+    with pytest.raises(Overflowed):
+        asyncio.run(run())
+
+
+class _Request:
+    def __init__(self, events: int) -> None:
+        self.events = events
+
+    async def is_disconnected(self) -> bool:
+        self.events -= 1
+        return self.events < 0
+
+
+def test_server_sent_events_carry_batches_and_resyncs(monkeypatch):
+    monkeypatch.setattr(slot_feed, "max_pending", 1)
+    monkeypatch.setattr(slot_feed, "coalesce_seconds", 0.01)
+
+    async def run() -> list[str]:
+        stream = server_sent_events(cast(Request, _Request(events=2)), [1])
+        events = [await anext(stream)]
+        slot_feed.broker.publish([SlotDelta(1, TEN, SlotState.BOOKED)])
+        events.append(await anext(stream))
+        slot_feed.broker.publish(
+            [SlotDelta(1, NINE, SlotState.OPEN), SlotDelta(1, TEN, SlotState.OPEN)]
+        )
+        events.append(await anext(stream))
+        with pytest.raises(StopAsyncIteration):
+            await anext(stream)
+        return events
+
+    subscribed, slots, resync = asyncio.run(run())
+
+    assert subscribed == ": subscribed\n\n"
+    name, data = slots.strip().split("\n")
+    assert name == "event: slots"
+    assert json.loads(data.removeprefix("data: ")) == {
+        "changes": [{"doctor_id": 1, "time": "2025-03-03T15:00:00", "state": "booked"}]
+    }
+    assert resync.startswith("event: resync\n")
+    assert slot_feed.broker.subscribers == 0
@@ -0,0 +1,198 @@
+# pylint: disable=redefined-outer-name
+
+import threading
+from datetime import date, datetime, time, timedelta
+
+import pytest
+from sqlalchemy import delete, update
+
+from app.core import slot_index as slot_index_module
+from app.core.slot_events import (
+    SlotChange,
+    SlotState,
+    on_slot_changes,
+    remove_slot_listener,
+)
+from app.core.slot_index import OutsideIndexWindow, SlotIndex
+from app.models import Appointment, Patient
+
+
+@pytest.fixture
+def index(monkeypatch):
+    # A window of 2025-03-01..2025-03-30
+    monkeypatch.setattr(slot_index_module, "today", lambda: date(2025, 3, 8))
+    slot_index = SlotIndex(days=30, max_hospitals=2, past_days=7)
+    on_slot_changes(slot_index.apply)
+    yield slot_index
+    remove_slot_listener(slot_index.apply)
+
+
+def test_free_slots_are_built_from_appointments(db, index, make_hospital):
+    hospital = make_hospital(doctors=2, slot_start=date(2025, 3, 8), slot_days=2)
+    first, second = (doctor.id for doctor in hospital.doctors)
+    booked = (
+        db.query(Appointment)
+        .filter(Appointment.doctor_id == first)
+        .order_by(Appointment.appointment_time)
+        .first()
+    )
+    patient = Patient(name="Pat")
+    db.add(patient)
+    db.flush()
+    booked.patient_id = patient.id
+    db.commit()
+
+    slots = index.free_slots(db, hospital.id, date(2025, 3, 8), date(2025, 3, 9))
+    counts = index.free_counts(db, hospital.id, date(2025, 3, 8), date(2025, 3, 8))
+
+    hours = [time(hour) for hour in range(9, 17)]
+    assert slots[first][date(2025, 3, 8)] == hours[1:]
+    # The DST change on 2025-03-09 doesn't shift local hours
+    assert slots[first][date(2025, 3, 9)] == hours
+    assert slots[second][date(2025, 3, 8)] == hours
+    assert counts[0].tolist() == [0] * 9 + [1] + [2] * 7 + [0] * 7
+
+
+def test_committed_writes_update_loaded_hospitals(db, index, make_hospital):
+    hospital = make_hospital(doctors=1, slot_start=date(2025, 3, 3), slot_days=1)
+    doctor_id = hospital.doctors[0].id
+    day = date(2025, 3, 3)
+    assert len(index.free_slots(db, hospital.id, day, day)[doctor_id][day]) == 8
+
+    first, second, third = (
+        db.query(Appointment).order_by(Appointment.appointment_time).limit(3).all()
+    )
+    patient = Patient(name="Pat")
+    db.add(patient)
+    db.flush()
+    first.patient_id = patient.id
+    db.delete(second)
+    third.appointment_time += timedelta(hours=12)
+    db.add(
+        Appointment(
+            doctor_id=doctor_id,
+            hospital_id=hospital.id,
+            appointment_time=datetime(2025, 3, 3, 12),
+            created_by=doctor_id,
+        )
+    )
+    db.commit()
+
+    free = index.free_slots(db, hospital.id, day, day)[doctor_id][day]
+    assert free == [time(7)] + [time(hour) for hour in range(12, 17)] + [time(23)]
+
+
+def test_rolled_back_writes_are_ignored(db, index, make_hospital):
+    hospital = make_hospital(doctors=1, slot_start=date(2025, 3, 3), slot_days=1)
+    doctor_id = hospital.doctors[0].id
+    day = date(2025, 3, 3)
+    index.free_slots(db, hospital.id, day, day)
+
+    patient = Patient(name="Pat")
+    db.add(patient)
+    db.flush()
+    appointment = db.query(Appointment).first()
+    appointment.patient_id = patient.id
+    db.flush()
+    db.rollback()
+
+    assert len(index.free_slots(db, hospital.id, day, day)[doctor_id][day]) == 8
+
+
+def test_queries_outside_the_window_are_rejected(db, index, make_hospital):
+    hospital = make_hospital(doctors=1)
+    missing = hospital.id + 1
+
+    assert index.free_slots(db, missing, date(2025, 3, 1), date(2025, 3, 1)) is None
+    with pytest.raises(OutsideIndexWindow):
+        index.free_slots(db, hospital.id, date(2025, 2, 28), date(2025, 3, 1))
+
+
+def test_other_workers_writes_show_up_once_the_hospital_expires(
+    db, index, make_hospital
+):
+    hospital = make_hospital(doctors=1, slot_start=date(2025, 3, 3), slot_days=1)
+    doctor_id = hospital.doctors[0].id
+    day = date(2025, 3, 3)
+    index.free_slots(db, hospital.id, day, day)
+    patient = Patient(name="Pat")
+    db.add(patient)
+    db.flush()
+
+    # A Core update isn't published as a slot change, like another worker's write
+    db.execute(
+        update(Appointment)
+        .where(Appointment.appointment_time == datetime(2025, 3, 3, 14))
+        .values(patient_id=patient.id)
+    )
+    db.commit()
+    before = index.free_slots(db, hospital.id, day, day)[doctor_id][day]
+    index.ttl = 0
+    after = index.free_slots(db, hospital.id, day, day)[doctor_id][day]
+
+    assert (len(before), len(after)) == (8, 7)
+
+
+def test_deleted_slots_show_up_once_the_hospital_is_reloaded(db, index, make_hospital):
+    hospital = make_hospital(doctors=1, slot_start=date(2025, 3, 3), slot_days=1)
+    doctor_id = hospital.doctors[0].id
+    day = date(2025, 3, 3)
+    index.free_slots(db, hospital.id, day, day)
+
+    db.execute(
+        delete(Appointment).where(
+            Appointment.appointment_time == datetime(2025, 3, 3, 14)
+        )
+    )
+    db.commit()
+    index.ttl = 0
+    refreshed = index.free_slots(db, hospital.id, day, day)[doctor_id][day]
+    index.reload = 0
+    reloaded = index.free_slots(db, hospital.id, day, day)[doctor_id][day]
+
+    assert (len(refreshed), len(reloaded)) == (8, 7)
+
+
+def test_changes_committed_while_a_hospital_loads_are_kept(
+    db, index, make_hospital, monkeypatch
+):
+    hospital = make_hospital(doctors=1, slot_start=date(2025, 3, 3), slot_days=1)
+    doctor_id = hospital.doctors[0].id
+    day = date(2025, 3, 3)
+    read, resume = threading.Event(), threading.Event()
+    load = index._load
+
+    def slow_load(db, hospital_id):
+        bitmaps = load(db, hospital_id)
+        read.set()
+        resume.wait(5)
+        return bitmaps
+
+    monkeypatch.setattr(index, "_load", slow_load)
+    loading = threading.Thread(target=index.hospital, args=(db, hospital.id))
+    loading.start()
+    read.wait(5)
+    # Applied while the rows read are still being indexed, without waiting on it
+    index.apply([SlotChange(doctor_id, datetime(2025, 3, 3, 14), SlotState.BOOKED)])
+    applied_while_loading = loading.is_alive()
+    resume.set()
+    loading.join()
+
+    free = index.free_slots(db, hospital.id, day, day)[doctor_id][day]
+    assert applied_while_loading
+    assert time(9) not in free and len(free) == 7
+
+
+def test_the_window_moves_with_the_date(db, index, make_hospital, monkeypatch):
+    hospital = make_hospital(doctors=1, slot_start=date(2025, 3, 30), slot_days=2)
+    doctor_id = hospital.doctors[0].id
+    last = date(2025, 3, 30)
+    assert index.free_slots(db, hospital.id, last, last)[doctor_id][last]
+
+    monkeypatch.setattr(slot_index_module, "today", lambda: date(2025, 3, 9))
+    slots = index.free_slots(db, hospital.id, last, last + timedelta(days=1))
+
+    assert (index.epoch, index.end) == (date(2025, 3, 2), date(2025, 4, 1))
+    assert len(slots[doctor_id][last + timedelta(days=1)]) == 8
+    with pytest.raises(OutsideIndexWindow):
+        index.free_slots(db, hospital.id, date(2025, 3, 1), date(2025, 3, 1))
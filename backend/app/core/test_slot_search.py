@@ -0,0 +1,45 @@
+from datetime import date, datetime
+
+from sqlalchemy import select, update
+
+from app.core.reservations import reservations
+from app.core.slot_search import earliest_slots
+from app.models import Appointment, Doctor
+
+
+def test_earliest_slots_merge_doctors_in_time_order(db, make_hospital):
+    hospital = make_hospital(doctors=3, slot_start=date(2025, 3, 3), slot_days=5)
+    first, second, third = (doctor.id for doctor in hospital.doctors)
+    db.execute(
+        update(Doctor)
+        .where(Doctor.id.in_([first, second]))
+        .values(specialty="cardiology")
+    )
+    # The first doctor is booked all Monday
+    db.execute(
+        update(Appointment)
+        .where(
+            Appointment.doctor_id == first,
+            Appointment.appointment_time < datetime(2025, 3, 4),
+        )
+        .values(patient_id=third)
+    )
+    db.commit()
+    reserved = db.scalar(
+        select(Appointment.id)
+        .where(Appointment.doctor_id == second)
+        .order_by(Appointment.appointment_time)
+    )
+    reservations.claim(reserved, "someone")
+
+    found = earliest_slots(
+        db, hospital.id, "cardiology", datetime(2025, 3, 3), limit=12, page_size=2
+    )
+    everyone = earliest_slots(db, hospital.id, None, datetime(2025, 3, 3), limit=3)
+
+    # 14:00 UTC is 09:00 in New York
+    assert [(slot.doctor_id, slot.appointment_time.hour) for slot in found] == [
+        (second, hour) for hour in range(15, 22)
+    ] + [(first, 14), (second, 14), (first, 15), (second, 15), (first, 16)]
+    assert [slot.doctor_id for slot in everyone] == [third, second, third]
+    assert not earliest_slots(db, hospital.id, "dermatology", datetime(2025, 3, 3), 5)
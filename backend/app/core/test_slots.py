@@ -0,0 +1,46 @@
+# pylint: disable=not-callable
+
+from datetime import date, time
+
+import pytest
+from sqlalchemy import func, select
+
+import app.core.slots
+from app.core.slot_events import on_slot_changes, remove_slot_listener
+from app.core.slots import OpenedSlots, open_slots
+from app.models import Appointment
+
+
+@pytest.mark.parametrize("on_conflict", [True, False])
+def test_open_slots_only_inserts_missing_ones(
+    db, make_hospital, monkeypatch, on_conflict
+):
+    if not on_conflict:
+        # As on databases whose inserts can't skip existing rows
+        monkeypatch.setattr(app.core.slots, "ON_CONFLICT_INSERTS", {})
+    hospital = make_hospital(
+        doctors=2,
+        timezone="Europe/London",
+        open_time=time(0),
+        close_time=time(3),
+        slot_start=date(2025, 3, 29),
+        slot_days=1,
+    )
+    doctor_ids = [doctor.id for doctor in hospital.doctors]
+    published = []
+    on_slot_changes(published.extend)
+    try:
+        # 01:00 doesn't exist on 2025-03-30 in London, so that day has two slots
+        opened = open_slots(
+            db, doctor_ids, date(2025, 3, 29), date(2025, 3, 30), chunk_size=3
+        )
+        again = open_slots(db, doctor_ids, date(2025, 3, 29), date(2025, 3, 30))
+    finally:
+        remove_slot_listener(published.extend)
+
+    assert opened == OpenedSlots(inserted=4, skipped=6)
+    assert again == OpenedSlots(inserted=0, skipped=10)
+    assert len(published) == 4
+    assert {change.doctor_id for change in published} == set(doctor_ids)
+    assert db.scalar(select(func.count()).select_from(Appointment)) == 10
+    assert set(db.scalars(select(Appointment.created_by))) == set(doctor_ids)
@@ -0,0 +1,113 @@
+import time as clock
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo, available_timezones
+
+import numpy as np
+import pytest
+from hypothesis import given, settings
+from hypothesis import strategies as st
+
+from app.core.availability import date_range, to_local, to_utc
+from app.core.timezones import local_to_utc, slot_grid, utc_to_local
+
+ZONES = sorted(available_timezones())
+
+zones = st.sampled_from(ZONES).map(ZoneInfo)
+
+# Whole seconds, so values survive the round trip through datetime64[s]
+naive_times = st.datetimes(
+    min_value=datetime(1980, 1, 1), max_value=datetime(2040, 12, 31)
+).map(lambda value: value.replace(microsecond=0))
+
+
+def as_array(values):
+    return np.array(values, dtype="datetime64[s]")
+
+
+def reference_grid(tz, open_time, close_time, start, end):
+    """Opening hours converted one slot at a time through zoneinfo."""
+    times = (
+        to_utc(datetime.combine(day, time(hour)), tz)
+        for day in date_range(start, end)
+        for hour in range(open_time.hour, close_time.hour)
+    )
+    return list(dict.fromkeys(times))
+
+
+@settings(deadline=None)
+@given(zones, st.lists(naive_times, min_size=1, max_size=20))
+def test_local_to_utc_matches_zoneinfo(tz, values):
+    converted = local_to_utc(tz, as_array(values)).tolist()
+    assert converted == [to_utc(value, tz) for value in values]
+
+
+# Building a zone's offset tables from cold can outlast the default deadline
+@settings(deadline=None)
+@given(zones, st.lists(naive_times, min_size=1, max_size=20))
+def test_utc_to_local_matches_zoneinfo(tz, values):
+    converted = utc_to_local(tz, as_array(values)).tolist()
+    assert converted == [to_local(value, tz) for value in values]
+
+
+@settings(max_examples=50, deadline=None)
+@given(
+    zones,
+    st.integers(0, 12),
+    st.integers(13, 23),
+    st.dates(min_value=date(1990, 1, 1), max_value=date(2039, 1, 1)),
+    st.integers(0, 400),
+)
+def test_slot_grid_matches_zoneinfo(tz, opens, closes, start, days):
+    open_time, close_time = time(opens), time(closes)
+    end = start + timedelta(days=days)
+    grid = slot_grid(tz, open_time, close_time, start, end)
+    assert grid.tolist() == reference_grid(tz, open_time, close_time, start, end)
+
+
+def test_slot_grid_over_a_skipped_day():
+    tz = ZoneInfo("Pacific/Enderbury")
+    start, end = date(1994, 12, 30), date(1995, 1, 1)
+
+    grid = slot_grid(tz, time(9), time(17), start, end)
+
+    # 1994-12-31 doesn't exist there, so its hours are those of 1995-01-01
+    assert grid.tolist() == reference_grid(tz, time(9), time(17), start, end)
+    assert len(grid) == 2 * 8
+
+
+def test_slot_grid_around_dst_changes():
+    tz = ZoneInfo("America/New_York")
+
+    spring = slot_grid(tz, time(0), time(4), date(2025, 3, 9), date(2025, 3, 9))
+    autumn = slot_grid(tz, time(0), time(4), date(2025, 11, 2), date(2025, 11, 2))
+
+    # 02:00 doesn't exist, so it shares the 03:00 slot
+    assert [value.hour for value in spring.tolist()] == [5, 6, 7]
+    # 01:00 happens twice and means the first one
+    assert [value.hour for value in autumn.tolist()] == [4, 5, 7, 8]
+
+
+@pytest.mark.benchmark
+def test_year_of_slot_grids_for_every_timezone():
+    """A year of opening hours in every timezone, against converting slot by slot."""
+    start, end = date(2026, 1, 1), date(2026, 12, 31)
+    open_time, close_time = time(8), time(18)
+    zones_ = [ZoneInfo(zone) for zone in ZONES]
+
+    started = clock.perf_counter()
+    cold = [slot_grid(tz, open_time, close_time, start, end) for tz in zones_]
+    cold_elapsed = clock.perf_counter() - started
+    started = clock.perf_counter()
+    grids = [slot_grid(tz, open_time, close_time, start, end) for tz in zones_]
+    elapsed = clock.perf_counter() - started
+    started = clock.perf_counter()
+    expected = [reference_grid(tz, open_time, close_time, start, end) for tz in zones_]
+    reference = clock.perf_counter() - started
+
+    slots = sum(len(grid) for grid in grids)
+    print(
+        f"{len(zones_)} zones, {slots:,} slots: cold {cold_elapsed:.2f}s, "
+        f"cached {elapsed:.3f}s, zoneinfo per slot {reference:.2f}s"
+    )
+    assert [grid.tolist() for grid in cold] == expected
+    assert elapsed * 10 < reference
@@ -0,0 +1,179 @@
+"""
+Vectorized conversions between naive local times and naive UTC.
+
+Converting slot by slot with ``datetime.replace(tzinfo=...)`` costs a ``zoneinfo``
+lookup per slot, which adds up when a calendar or a bulk slot insert covers months
+of opening hours for many doctors. Instead each zone's UTC offsets are kept as a
+transition table (the instants its offset changes and the offset from then on) and
+whole arrays of ``datetime64[s]`` values are converted with one ``searchsorted``.
+
+Tables are built per zone and year by sampling the zone's offset once a day and
+bisecting to the second wherever it changes, then cached. Zones that change offset
+twice within a day aren't represented exactly; none do in the tz database today.
+
+Local times follow ``zoneinfo``'s ``fold=0`` rules: a time skipped when clocks go
+forward is read with the offset before the change (so it lands in the hour after
+the gap) and a repeated time is read as its first occurrence.
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import UTC, date, datetime, time, timedelta
+from functools import lru_cache
+from typing import Sequence
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+DAY = 24 * 60 * 60
+
+HOUR = 60 * 60
+
+
+def _offset(tz: ZoneInfo, timestamp: int) -> int:
+    """The UTC offset in seconds in effect at a UTC timestamp."""
+    offset = datetime.fromtimestamp(timestamp, tz).utcoffset()
+    assert offset is not None
+    return int(offset.total_seconds())
+
+
+def _timestamp(day: date) -> int:
+    return int(datetime.combine(day, time(), UTC).timestamp())
+
+
+@dataclass(frozen=True)
+class OffsetTable:
+    """A zone's UTC offsets over a span of time."""
+
+    # The offset before the first transition
+    initial: int
+    # UTC timestamps at which the offset changes
+    transitions: np.ndarray
+    # The offset from each transition on
+    offsets: np.ndarray
+
+    @property
+    def _all_offsets(self) -> np.ndarray:
+        return np.concatenate([[self.initial], self.offsets]).astype(np.int64)
+
+    @property
+    def _before(self) -> np.ndarray:
+        return self._all_offsets[:-1]
+
+    def to_local(self, utc: np.ndarray) -> np.ndarray:
+        """Convert naive UTC ``datetime64`` values to naive local ones."""
+        seconds = utc.astype("datetime64[s]").astype(np.int64)
+        index = np.searchsorted(self.transitions, seconds, side="right")
+        local: np.ndarray = (seconds + self._all_offsets[index]).astype("datetime64[s]")
+        return local
+
+    def to_utc(self, local: np.ndarray) -> np.ndarray:
+        """Convert naive local ``datetime64`` values to naive UTC ones (``fold=0``)."""
+        seconds = local.astype("datetime64[s]").astype(np.int64)
+        # With fold=0 a transition takes effect at the later of its two wall times
+        walls = self.transitions + np.maximum(self._before, self.offsets)
+        index = np.searchsorted(walls, seconds, side="right")
+        utc: np.ndarray = (seconds - self._all_offsets[index]).astype("datetime64[s]")
+        return utc
+
+
+@lru_cache(maxsize=8192)
+def year_table(tz: ZoneInfo, year: int) -> OffsetTable:
+    """The offsets of ``tz`` from the start of ``year`` (UTC) to the start of the next."""
+    first, last = _timestamp(date(year, 1, 1)), _timestamp(date(year + 1, 1, 1))
+    samples = list(range(first, last, DAY)) + [last]
+    offsets = [_offset(tz, timestamp) for timestamp in samples]
+    transitions, after = [], []
+    for lo, hi, before, offset in zip(samples, samples[1:], offsets, offsets[1:]):
+        if before == offset:
+            continue
+        # Bisect to the first second using the new offset
+        while hi - lo > 1:
+            middle = (lo + hi) // 2
+            if _offset(tz, middle) == before:
+                lo = middle
+            else:
+                hi = middle
+        transitions.append(hi)
+        after.append(offset)
+    return OffsetTable(
+        initial=offsets[0],
+        transitions=np.array(transitions, dtype=np.int64),
+        offsets=np.array(after, dtype=np.int64),
+    )
+
+
+def offset_table(tz: ZoneInfo, start: date, end: date) -> OffsetTable:
+    """
+    The offsets of ``tz`` covering every instant on the local dates ``start``..``end``
+    (inclusive), joined from the cached per year tables.
+    """
+    years = range((start - timedelta(days=1)).year, (end + timedelta(days=1)).year + 1)
+    tables = [year_table(tz, year) for year in years]
+    if len(tables) == 1:
+        return tables[0]
+    return OffsetTable(
+        initial=tables[0].initial,
+        transitions=np.concatenate([table.transitions for table in tables]),
+        offsets=np.concatenate([table.offsets for table in tables]),
+    )
+
+
+def _date_span(values: np.ndarray) -> tuple[date, date]:
+    days = values.astype("datetime64[D]")
+    return days.min().item(), days.max().item()
+
+
+def utc_to_local(tz: ZoneInfo, utc: np.ndarray) -> np.ndarray:
+    """Convert naive UTC ``datetime64`` values to naive local time in ``tz``."""
+    if not utc.size:
+        return utc.astype("datetime64[s]")
+    return offset_table(tz, *_date_span(utc)).to_local(utc)
+
+
+def local_to_utc(tz: ZoneInfo, local: np.ndarray) -> np.ndarray:
+    """Convert naive local ``datetime64`` values in ``tz`` to naive UTC."""
+    if not local.size:
+        return local.astype("datetime64[s]")
+    return offset_table(tz, *_date_span(local)).to_utc(local)
+
+
+def slot_grid(
+    tz: ZoneInfo, open_time: time, close_time: time, start: date, end: date
+) -> np.ndarray:
+    """
+    UTC start times (``datetime64[s]``) of every opening hour on the local dates
+    ``start``..``end`` (inclusive), in order. A local hour skipped by a DST change
+    maps onto the next one, so it is only included once. Zones that skip a whole day
+    (Pacific/Enderbury at the end of 1994) map it onto the next day, out of order.
+    """
+    days = np.arange(
+        np.datetime64(start, "D"), np.datetime64(end, "D") + 1, dtype="datetime64[D]"
+    )
+    hours = np.arange(open_time.hour, close_time.hour, dtype=np.int64) * HOUR
+    local = (days.astype("datetime64[s]")[:, None] + hours[None, :]).ravel()
+    if not local.size:
+        return local
+    utc: np.ndarray = np.unique(offset_table(tz, start, end).to_utc(local))
+    return utc
+
+
+def local_times(
+    values: Sequence[tuple[ZoneInfo, datetime | None]],
+) -> list[datetime | None]:
+    """
+    Convert ``(timezone, naive UTC time)`` pairs to naive local times, with one
+    vectorized conversion per timezone. ``None`` times stay ``None``.
+    """
+    by_zone: dict[ZoneInfo, list[int]] = defaultdict(list)
+    for position, (tz, value) in enumerate(values):
+        if value is not None:
+            by_zone[tz].append(position)
+    converted: list[datetime | None] = [None] * len(values)
+    for tz, positions in by_zone.items():
+        utc = np.array([values[i][1] for i in positions], dtype="datetime64[s]")
+        for position, local in zip(positions, utc_to_local(tz, utc).tolist()):
+            converted[position] = local
+    return converted
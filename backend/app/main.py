@@ -1,12 +1,46 @@
-from fastapi import FastAPI
+import gc
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 
+from app.api.graphql.schema import router as graphql_router
+from app.api.rest.appointments import router as appointments_router
 from app.api.rest.auth import router as auth_router
+from app.api.rest.hospitals import router as hospitals_router
+from app.api.rest.patients import router as patients_router
+from app.api.rest.slot_feed import router as slot_feed_router
+from app.core.config import settings
+from app.core.database import (
+    SAFE_METHODS,
+    check_shards,
+    engine,
+    stick_to_primary,
+)
+from app.core.hashing import HasherBusy
+from app.core.metrics import CONTENT_TYPE, MetricsMiddleware, registry
+from app.core.patient_index import patient_index
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+    check_shards()
+    if settings.patient_index_warm:
+        # Built in the background, so the first autocomplete doesn't wait for it
+        patient_index.warm(engine)
+    if settings.gc_freeze_at_startup:
+        gc.collect()
+        gc.freeze()
+    yield
+
 
 app = FastAPI(
     title="Appointment Scheduler API",
     description="Dual REST/GraphQL API for appointment scheduling",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Add CORS middleware
@@ -25,8 +59,40 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    """Send a client's reads to the primary for a short while after it writes."""
+    response = await call_next(request)
+    if request.method not in SAFE_METHODS and response.status_code < 400:
+        stick_to_primary(response)
+    return response
+
+
+# Outermost, so the latency covers the other middleware too
+app.add_middleware(MetricsMiddleware)
+
+
+@app.exception_handler(HasherBusy)
+async def hasher_busy(request: Request, exc: HasherBusy) -> JSONResponse:
+    """Shed logins quickly when the password hashing pool is saturated."""
+    # pylint: disable=unused-argument
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Too many logins in progress, please retry"},
+        headers={"Retry-After": str(settings.password_hash_retry_after)},
+    )
+
+
 # Include REST API routers
 app.include_router(auth_router)
+app.include_router(appointments_router)
+app.include_router(hospitals_router)
+app.include_router(patients_router)
+app.include_router(slot_feed_router)
+
+# GraphQL API
+app.include_router(graphql_router, prefix="/graphql")
 
 
 @app.get("/")
@@ -37,6 +103,12 @@ async def root():
     }
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics() -> Response:
+    """Request, SQL and booking conflict metrics in the Prometheus text format."""
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
@@ -1,11 +1,27 @@
 """
 Database models package.
+
+Relationships raise rather than lazy load; queries load them with a profile from
+``loading``.
 """
 
 from .appointments import Appointment
 from .base import Base
 from .facilities import Hospital
+from .loading import with_profile
 from .people import Doctor, Patient, Staff
+from .revalidation import AppointmentConflict, AvailabilityChange
 from .users import User
 
-__all__ = ["Appointment", "Base", "Doctor", "Hospital", "Patient", "Staff", "User"]
+__all__ = [
+    "Appointment",
+    "AppointmentConflict",
+    "AvailabilityChange",
+    "Base",
+    "Doctor",
+    "Hospital",
+    "Patient",
+    "Staff",
+    "User",
+    "with_profile",
+]
@@ -21,6 +21,9 @@ class Appointment(Base):
 
     id: Mapped[int_pk]
     doctor_id: Mapped[int] = mapped_column(ForeignKey("doctors.id"))
+    # The doctor's hospital, denormalized as the partition key (see
+    # app.core.partitioning)
+    hospital_id: Mapped[int] = mapped_column(ForeignKey("hospitals.id"))
     patient_id: Mapped[Optional[int]] = mapped_column(ForeignKey("patients.id"))
     appointment_time: Mapped[datetime]
     created_at: Mapped[datetime] = mapped_column(default=lambda: datetime.now(UTC))
@@ -29,19 +32,27 @@ class Appointment(Base):
     )
     created_by: Mapped[person_fk]
 
-    creator: Mapped["Person"] = relationship()
+    creator: Mapped["Person"] = relationship(lazy="raise")
     doctor: Mapped["Doctor"] = relationship(
-        back_populates="appointments", foreign_keys=[doctor_id]
+        back_populates="appointments", foreign_keys=[doctor_id], lazy="raise"
     )
     patient: Mapped["Patient"] = relationship(
-        back_populates="appointments", foreign_keys=[patient_id]
+        back_populates="appointments", foreign_keys=[patient_id], lazy="raise"
     )
 
     __table_args__ = (
-        # Prevent double bookings - unique constraint on doctor + time
+        # Prevent double bookings - unique constraint on doctor + time. A doctor works
+        # at one hospital, so adding hospital_id doesn't change what's unique, but
+        # PostgreSQL needs the partition keys in a partitioned table's unique indexes.
         Index(
-            "idx_unique_doctor_timeslot", "doctor_id", "appointment_time", unique=True
+            "idx_unique_doctor_timeslot",
+            "doctor_id",
+            "appointment_time",
+            "hospital_id",
+            unique=True,
         ),
+        # A patient's appointments, across hospitals
+        Index("idx_appointment_patient", "patient_id", "appointment_time"),
     )
 
     def __repr__(self) -> str:
@@ -26,8 +26,10 @@ class Hospital(Base):
     open_time: Mapped[time]
     close_time: Mapped[time]
 
-    doctors: Mapped[list["Doctor"]] = relationship(back_populates="hospital")
-    staff: Mapped[list["Staff"]] = relationship(back_populates="hospital")
+    doctors: Mapped[list["Doctor"]] = relationship(
+        back_populates="hospital", lazy="raise"
+    )
+    staff: Mapped[list["Staff"]] = relationship(back_populates="hospital", lazy="raise")
 
     def __repr__(self) -> str:
         return f"<Hospital id={self.id} name={self.name}>"
@@ -0,0 +1,48 @@
+"""
+Named eager loading profiles.
+
+Every relationship is declared with ``lazy="raise"``, so touching one that a query
+didn't load raises instead of quietly running a query per row. A query that needs
+related objects asks for them up front with a profile::
+
+    db.scalars(with_profile(select(Appointment), "appointment detail"))
+"""
+
+from __future__ import annotations
+
+from typing import Any, TypeVar
+
+from sqlalchemy import Select
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.interfaces import ORMOption
+
+from .appointments import Appointment
+from .facilities import Hospital
+from .people import Doctor
+
+Statement = TypeVar("Statement", bound=Select[Any])
+
+PROFILES: dict[str, tuple[ORMOption, ...]] = {
+    # Slots with the doctor they belong to
+    "calendar": (joinedload(Appointment.doctor),),
+    # One appointment with everything shown next to it; many-to-one, so one query
+    "appointment detail": (
+        joinedload(Appointment.doctor).joinedload(Doctor.hospital),
+        joinedload(Appointment.patient),
+        joinedload(Appointment.creator),
+    ),
+    # A hospital's people, a query per collection rather than per hospital
+    "hospital roster": (
+        selectinload(Hospital.doctors),
+        selectinload(Hospital.staff),
+    ),
+}
+
+
+def with_profile(statement: Statement, profile: str) -> Statement:
+    """Add a profile's loader options to a select."""
+    try:
+        options = PROFILES[profile]
+    except KeyError:
+        raise ValueError(f"Unknown loading profile: {profile}") from None
+    return statement.options(*options)
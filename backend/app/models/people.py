@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING, Optional
 
-from sqlalchemy import ForeignKey, String
+from sqlalchemy import ForeignKey, Index, String
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .base import Base, int_pk, person_fk
@@ -39,9 +39,16 @@ class Doctor(Person):
     hospital_id: Mapped[int] = mapped_column(ForeignKey("hospitals.id"))
     specialty: Mapped[Optional[str]]  # Consider Enum for specialties
 
-    appointments: Mapped[list["Appointment"]] = relationship(back_populates="doctor")
+    appointments: Mapped[list["Appointment"]] = relationship(
+        back_populates="doctor", lazy="raise"
+    )
     # Currently a doctor works only at one hospital
-    hospital: Mapped["Hospital"] = relationship(back_populates="doctors")
+    hospital: Mapped["Hospital"] = relationship(back_populates="doctors", lazy="raise")
+
+    __table_args__ = (
+        # Finding a hospital's doctors, optionally by specialty
+        Index("idx_doctor_hospital_specialty", "hospital_id", "specialty"),
+    )
 
     def __repr__(self) -> str:
         return f"<Doctor id={self.id} name={self.name}>"
@@ -56,7 +63,9 @@ class Patient(Person):
 
     id: Mapped[person_fk] = mapped_column(primary_key=True)
 
-    appointments: Mapped[list["Appointment"]] = relationship(back_populates="patient")
+    appointments: Mapped[list["Appointment"]] = relationship(
+        back_populates="patient", lazy="raise"
+    )
 
     def __repr__(self) -> str:
         return f"<Patient id={self.id} name={self.name}>"
@@ -72,8 +81,8 @@ class Staff(Person):
     id: Mapped[person_fk] = mapped_column(primary_key=True)
     hospital_id: Mapped[int] = mapped_column(ForeignKey("hospitals.id"))
 
-    # Currently a staff member works only at one hospital32
-    hospital = relationship("Hospital", back_populates="staff")
+    # Currently a staff member works only at one hospital
+    hospital = relationship("Hospital", back_populates="staff", lazy="raise")
 
     def __repr__(self) -> str:
         return f"<Staff id={self.id} name={self.name} hospital_id={self.hospital_id}>"
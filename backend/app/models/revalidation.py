@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+from datetime import UTC, date, datetime
+from typing import Optional
+
+from sqlalchemy import Index
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base, int_pk
+
+
+class AvailabilityChange(Base):
+    """
+    A range of slots whose availability was edited and still has to be revalidated,
+    for one doctor or for every doctor of a hospital. The worker in
+    ``app.core.revalidation`` works through the changes in id order.
+    """
+
+    __tablename__ = "availability_changes"
+
+    id: Mapped[int_pk]
+    hospital_id: Mapped[Optional[int]]
+    doctor_id: Mapped[Optional[int]]
+    # Local dates, inclusive; no end date means every date from the start on
+    start_date: Mapped[date]
+    end_date: Mapped[Optional[date]]
+    created_at: Mapped[datetime] = mapped_column(default=lambda: datetime.now(UTC))
+    # Checkpoint: the last slot revalidated so far, by doctor then time
+    after_doctor_id: Mapped[Optional[int]]
+    after_time: Mapped[Optional[datetime]]
+
+    def __repr__(self) -> str:
+        return (
+            f"<AvailabilityChange id={self.id} hospital_id={self.hospital_id} "
+            f"doctor_id={self.doctor_id} start={self.start_date} end={self.end_date}>"
+        )
+
+
+class AppointmentConflict(Base):
+    """
+    A booked appointment that no longer fits its doctor's availability and has to
+    be rescheduled.
+    """
+
+    __tablename__ = "appointment_conflicts"
+
+    id: Mapped[int_pk]
+    # Not foreign keys, so archiving or cancelling the appointment isn't held up
+    appointment_id: Mapped[int] = mapped_column(unique=True)
+    hospital_id: Mapped[int]
+    doctor_id: Mapped[int]
+    patient_id: Mapped[int]
+    appointment_time: Mapped[datetime]
+    reason: Mapped[str]
+    detected_at: Mapped[datetime] = mapped_column(default=lambda: datetime.now(UTC))
+
+    __table_args__ = (
+        # A hospital's appointments to reschedule, soonest first
+        Index("idx_conflict_hospital_time", "hospital_id", "appointment_time"),
+    )
+
+    def __repr__(self) -> str:
+        return (
+            f"<AppointmentConflict appointment_id={self.appointment_id} "
+            f"reason={self.reason}>"
+        )
@@ -0,0 +1,81 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import InvalidRequestError
+
+from app.models import Appointment, Hospital, Patient, Staff, with_profile
+
+MONDAY = date(2025, 3, 3)
+
+
+def test_relationships_refuse_to_lazy_load(db, make_hospital):
+    make_hospital(doctors=1, slot_start=MONDAY, slot_days=1)
+    appointment = db.scalars(select(Appointment)).first()
+
+    with pytest.raises(InvalidRequestError, match="lazy='raise'"):
+        _ = appointment.doctor
+    with pytest.raises(ValueError, match="Unknown loading profile"):
+        with_profile(select(Appointment), "everything")
+
+
+def test_appointment_detail_loads_in_one_query(db, make_hospital, query_budget):
+    make_hospital(doctors=2, slot_start=MONDAY, slot_days=1)
+    patient = Patient(name="Pat")
+    db.add(patient)
+    db.flush()
+    booked = db.scalars(select(Appointment)).first()
+    booked.patient_id = patient.id
+    booked_id = booked.id
+    db.commit()
+    db.expunge_all()
+
+    with query_budget(1):
+        appointment = db.scalars(
+            with_profile(
+                select(Appointment).where(Appointment.id == booked_id),
+                "appointment detail",
+            )
+        ).one()
+        names = (
+            appointment.doctor.name,
+            appointment.doctor.hospital.name,
+            appointment.patient.name,
+            appointment.creator.name,
+        )
+
+    assert names == ("Doctor 0", "Test Hospital", "Pat", "Doctor 0")
+
+
+def test_hospital_roster_doesnt_grow_with_hospitals(db, make_hospital, query_budget):
+    for doctors in (1, 3, 5):
+        hospital = make_hospital(doctors=doctors)
+        db.add(Staff(name="Staff", hospital_id=hospital.id))
+    db.commit()
+    db.expunge_all()
+
+    # The hospitals, then their doctors, then their staff
+    with query_budget(3):
+        hospitals = db.scalars(with_profile(select(Hospital), "hospital roster")).all()
+        roster = [(len(h.doctors), len(h.staff)) for h in hospitals]
+
+    assert roster == [(1, 1), (3, 1), (5, 1)]
+
+
+def test_calendar_slots_carry_their_doctor(db, make_hospital, query_budget):
+    make_hospital(doctors=3, slot_start=MONDAY, slot_days=2)
+    db.expunge_all()
+
+    with query_budget(1):
+        slots = db.scalars(with_profile(select(Appointment), "calendar")).all()
+        doctors = {slot.doctor.name for slot in slots}
+
+    assert len(slots) == 3 * 2 * 8
+    assert doctors == {"Doctor 0", "Doctor 1", "Doctor 2"}
+
+
+def test_query_budgets_fail_tests_that_exceed_them(db, query_budget):
+    with pytest.raises(pytest.fail.Exception, match="2 statements over a budget of 1"):
+        with query_budget(1):
+            db.execute(select(Hospital))
+            db.execute(select(Staff))
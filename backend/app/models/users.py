@@ -25,15 +25,14 @@ class User(Base):
     is_active: Mapped[bool] = mapped_column(default=True)
     is_superuser: Mapped[bool] = mapped_column(default=False)
     person_id: Mapped[Optional[person_fk]]
-    refresh_token_hash: Mapped[Optional[str]] = mapped_column(default=None)
 
-    person: Mapped[Optional["Person"]] = relationship()
+    person: Mapped[Optional["Person"]] = relationship(lazy="raise")
 
     def __repr__(self) -> str:
         return f"<User id={self.id} email={self.email} is_active={self.is_active}>"
 
     @validates("email")
-    def validate_email(self, address):
+    def validate_email(self, key, address):  # pylint: disable=unused-argument
         if not re.match(r"^[^@]+@[^@]+\.[^@]+$", address):
             raise ValueError("Invalid email address")
         return address.lower()